@@ -1,22 +1,41 @@
 import asyncio
+import base64
+import contextlib
+import copy
+import itertools
 import json
 import os
-import shutil
 import socket
 import threading
 import time
 import traceback
-from collections import deque
+import types
+from collections import OrderedDict, deque
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Union
 
-import shortuuid
+import psutil
 from pydantic import BaseModel
 from starlette.websockets import WebSocketState
 
 from .core import OpenInterpreter
-
-last_start_time = 0
+from .utils.file_transfer import (
+    RangeNotSatisfiable,
+    UploadTooLarge,
+    file_size,
+    parse_range,
+    read_file,
+    upload_chunks,
+    write_file,
+)
+from .utils.metrics import (
+    metrics,
+    observe_llm_span,
+    websocket_bytes_sent,
+    websocket_frames_sent,
+)
+from .utils.model_registry import model_registry
+from .utils.worker_pool import QueueFullError, WorkerPool
 
 try:
     import janus
@@ -31,36 +50,294 @@ try:
         UploadFile,
         WebSocket,
     )
-    from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+    from fastapi.responses import (
+        JSONResponse,
+        PlainTextResponse,
+        Response,
+        StreamingResponse,
+    )
     from starlette.status import HTTP_403_FORBIDDEN
 except:
     # Server dependencies are not required by the main package.
     pass
 
+try:
+    import msgpack
+except ImportError:
+    # Only needed for the binary websocket protocol (?protocol=msgpack)
+    msgpack = None
+
 
 complete_message = {"role": "server", "type": "status", "content": "complete"}
 
+_end_of_stream = object()
+
+
+async def iterate_in_thread(make_iterator, pool=None, key=None):
+    """
+    Runs a blocking iterator (like `interpreter.chat(stream=True)`, which runs the LLM and code) in a thread,
+    yielding its items here without blocking the event loop. If we stop early, the iterator is closed in its thread
+    after the item it's working on. With a WorkerPool, it runs as one of `key`'s jobs there instead of in a thread
+    of its own, so it waits its turn like any other response.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def run():
+        iterator = None
+        try:
+            iterator = make_iterator()
+            for item in iterator:
+                if cancelled.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, _end_of_stream)
+            except RuntimeError:
+                pass  # The loop is closed
+
+    if pool is None:
+        job = threading.Thread(target=run, daemon=True)
+        job.start()
+    else:
+        job = pool.submit(key, run)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _end_of_stream:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+        if pool is not None:
+            job.cancel()  # (If it's still waiting for a worker)
+
+
+async def run_in_pool(pool, key, function, *args, **kwargs):
+    """
+    Runs function(*args, **kwargs) as one of `key`'s jobs in a WorkerPool, returning its result without blocking the
+    event loop.
+    """
+    results = iterate_in_thread(lambda: [function(*args, **kwargs)], pool, key)
+    try:
+        async for result in results:
+            return result
+    finally:
+        await results.aclose()
+
+
+# Coalescing stops adding to a frame once it's this many characters
+max_coalesced_size = 64 * 1024
+
+
+def _can_drop(chunk):
+    """
+    Content chunks can be dropped when the client falls behind. Start / end flags and server messages can't.
+    """
+    return (
+        isinstance(chunk, dict)
+        and chunk.get("role") != "server"
+        and "start" not in chunk
+        and "end" not in chunk
+    )
+
+
+def _can_coalesce(chunk):
+    """
+    Whether later chunks of the same message can be appended to this one: streamed text, but not flags, active lines,
+    images or server messages.
+    """
+    return (
+        _can_drop(chunk)
+        and isinstance(chunk.get("content"), str)
+        and chunk.get("type") in ("message", "code", "console")
+        and chunk.get("format") != "active_line"
+        and "id" not in chunk
+    )
+
+
+def _continues(previous, chunk):
+    return _can_coalesce(chunk) and all(
+        chunk.get(key) == previous.get(key) for key in ("role", "type", "format")
+    )
+
+
+def _to_binary(output):
+    """
+    For the msgpack protocol: base64 images are sent as raw bytes, with a "bytes.png" format instead of "base64.png".
+    """
+    if (
+        isinstance(output, dict)
+        and output.get("type") == "image"
+        and str(output.get("format")).startswith("base64.")
+        and isinstance(output.get("content"), str)
+    ):
+        output = {
+            **output,
+            "format": "bytes." + output["format"][len("base64.") :],
+            "content": base64.b64decode(output["content"]),
+        }
+    return output
+
+
+def _from_binary(chunk):
+    """
+    The reverse of _to_binary, so the rest of the interpreter only sees base64 images.
+    """
+    if (
+        isinstance(chunk, dict)
+        and chunk.get("type") == "image"
+        and str(chunk.get("format")).startswith("bytes.")
+        and isinstance(chunk.get("content"), bytes)
+    ):
+        chunk = {
+            **chunk,
+            "format": "base64." + chunk["format"][len("bytes.") :],
+            "content": base64.b64encode(chunk["content"]).decode("ascii"),
+        }
+    return chunk
+
+
+class ReplayBuffer:
+    """
+    Numbers the outputs sent to a session's clients (1, 2, 3...) and keeps the last `size` of them, so a client that
+    reconnects can pick up where it left off. Acknowledgements are cumulative: acknowledging N acknowledges every
+    output up to N.
+    """
+
+    def __init__(self, size=1000):
+        self.outputs = deque(maxlen=size)
+        self.last_seq = 0
+        self.acked_seq = 0
+        self._waiters = []  # (seq, future) for each send waiting on an acknowledgement
+
+    def add(self, output):
+        """
+        Returns a copy of output with the next sequence number as its "seq", and remembers it.
+        """
+        self.last_seq += 1
+        output = {**output, "seq": self.last_seq}
+        self.outputs.append(output)
+        return output
+
+    def since(self, seq):
+        """
+        Returns the outputs after `seq`, oldest first, as far back as the buffer goes.
+        """
+        if not self.outputs:
+            return []
+        start = max(0, seq + 1 - self.outputs[0]["seq"])
+        return list(itertools.islice(self.outputs, start, None))
+
+    def ack(self, seq):
+        if seq <= self.acked_seq:
+            return
+        self.acked_seq = min(seq, self.last_seq)
+        waiting = []
+        for waiter_seq, future in self._waiters:
+            if waiter_seq <= self.acked_seq:
+                if not future.done():
+                    future.set_result(True)
+            else:
+                waiting.append((waiter_seq, future))
+        self._waiters = waiting
+
+    async def wait_for_ack(self, seq, timeout):
+        """
+        Waits until output `seq` is acknowledged. Returns False if it isn't within `timeout` seconds.
+        """
+        if seq <= self.acked_seq:
+            return True
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((seq, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters = [
+                waiter for waiter in self._waiters if waiter[1] is not future
+            ]
+
+
+# Every interpreter's responses (LLM calls and the code they run) take turns on these workers, so a server with
+# many sessions runs at most INTERPRETER_MAX_CONCURRENT_RESPONSES at once. INTERPRETER_MAX_QUEUED_RESPONSES (if set)
+# turns new responses away when that many are already waiting.
+respond_pool = WorkerPool(
+    max_workers=int(os.getenv("INTERPRETER_MAX_CONCURRENT_RESPONSES", "4")),
+    max_queued=int(os.getenv("INTERPRETER_MAX_QUEUED_RESPONSES", "0")) or None,
+    name="respond",
+)
+
 
 class AsyncInterpreter(OpenInterpreter):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.respond_thread = None
+        # The LLM's timings go to /metrics
+        self.tracer.on_span_end.append(observe_llm_span)
+        self.respond_pool = respond_pool
+        self.respond_thread = None  # The Job running (or waiting to run) respond()
         self.stop_event = threading.Event()
         self.output_queue = None
         self.unsent_messages = deque()
+        # At most output_queue_size chunks wait to be sent (0 for no limit). When the queue is full, "block" makes
+        # the response wait for the client to catch up (for up to output_block_timeout seconds, so a client that's
+        # gone can't hang it), and "drop" drops content chunks (never start / end flags or server messages)
+        self.output_queue_size = int(os.getenv("INTERPRETER_OUTPUT_QUEUE_SIZE", "1000"))
+        self.output_backpressure = os.getenv("INTERPRETER_OUTPUT_BACKPRESSURE", "block")
+        self.output_block_timeout = 30
+        self.dropped_outputs = 0
+        self._output_stalled = False
+        # Chunks that continue the same message within this many seconds are sent as one frame (0 to turn off)
+        self.coalesce_window = float(os.getenv("INTERPRETER_COALESCE_MS", "15")) / 1000
         self.id = os.getenv("INTERPRETER_ID", datetime.now().timestamp())
         self.print = False  # Will print output
 
         self.require_acknowledge = (
             os.getenv("INTERPRETER_REQUIRE_ACKNOWLEDGE", "False").lower() == "true"
         )
-        self.acknowledged_outputs = []
+        # Seconds to wait for an acknowledgement before sending the output again
+        self.ack_timeout = 1
+        # The last outputs sent, so clients that reconnect can resume from where they were
+        self.replay = ReplayBuffer(int(os.getenv("INTERPRETER_REPLAY_BUFFER", "1000")))
 
-        self.server = Server(self)
+        self._server = None  # Created when it's first used, so session interpreters don't each get one
 
         # For the 01. This lets the OAI compatible server accumulate context before responding.
         self.context_mode = False
+        # When it last got a {START}, since it keeps responding for 6 seconds after
+        self.last_start_time = 0
+
+    @property
+    def server(self):
+        if self._server is None:
+            self._server = Server(self)
+        return self._server
+
+    @server.setter
+    def server(self, value):
+        self._server = value
+
+    def new_session(self):
+        """
+        Returns a new AsyncInterpreter with this one's settings, but its own messages, languages and output queue.
+        """
+        session = AsyncInterpreter()
+        _copy_settings(self, session)
+        _copy_settings(self.llm, session.llm)
+        _copy_settings(self.computer, session.computer)
+        # (So every session's responses take turns on the same workers)
+        session.respond_pool = self.respond_pool
+        return session
 
     async def input(self, chunk):
         """
@@ -71,8 +348,7 @@ class AsyncInterpreter(OpenInterpreter):
         if "start" in chunk:
             # If the user is starting something, the interpreter should stop.
             if self.respond_thread is not None and self.respond_thread.is_alive():
-                self.stop_event.set()
-                self.respond_thread.join()
+                await self._stop_responding()
             self.accumulate(chunk)
         elif "content" in chunk:
             self.accumulate(chunk)
@@ -88,8 +364,7 @@ class AsyncInterpreter(OpenInterpreter):
 
                 if command == "stop":
                     # Any start flag would have stopped it a moment ago, but to be sure:
-                    self.stop_event.set()
-                    self.respond_thread.join()
+                    await self._stop_responding()
                     return
                 if command == "go":
                     # This is to approve code.
@@ -97,17 +372,97 @@ class AsyncInterpreter(OpenInterpreter):
                     pass
 
             self.stop_event.clear()
-            self.respond_thread = threading.Thread(
-                target=self.respond, args=(run_code,)
-            )
-            self.respond_thread.start()
+            if self.output_queue == None:
+                # (Made here too, in case we respond before anyone has asked for output)
+                self.output_queue = janus.Queue(maxsize=self.output_queue_size)
+            self.respond_thread = self.respond_pool.submit(self, self.respond, run_code)
+
+    async def _stop_responding(self):
+        self.stop_event.set()
+        if self.respond_thread is not None:
+            # If it's still waiting for a worker, it doesn't need one anymore
+            self.respond_thread.cancel()
+            # Wait off the event loop, since the loop is what empties the output queue the response may be waiting on
+            await asyncio.to_thread(self.respond_thread.join)
 
     async def output(self):
         if self.output_queue == None:
-            self.output_queue = janus.Queue()
+            self.output_queue = janus.Queue(maxsize=self.output_queue_size)
         return await self.output_queue.async_q.get()
 
+    async def outputs(self):
+        """
+        Returns the next outputs to send, in order. Chunks that continue the same message and arrive within
+        coalesce_window seconds are merged into one, so fast streams send fewer, larger frames.
+        """
+        outputs = [await self.output()]
+        if self.coalesce_window <= 0 or not _can_coalesce(outputs[0]):
+            return outputs
+
+        await asyncio.sleep(self.coalesce_window)
+        pieces = [outputs[0]["content"]]
+        size = len(pieces[0])
+        while size < max_coalesced_size:
+            try:
+                chunk = self.output_queue.async_q.get_nowait()
+            except janus.AsyncQueueEmpty:
+                break
+            if pieces is not None and _continues(outputs[-1], chunk):
+                pieces.append(chunk["content"])
+                size += len(chunk["content"])
+                continue
+            if pieces is not None:
+                outputs[-1] = {**outputs[-1], "content": "".join(pieces)}
+            outputs.append(chunk)
+            pieces = [chunk["content"]] if _can_coalesce(chunk) else None
+        if pieces is not None:
+            outputs[-1] = {**outputs[-1], "content": "".join(pieces)}
+        return outputs
+
+    def resume(self, seq):
+        """
+        Sends every output after `seq` again (as far back as the replay buffer goes), instead of whatever was
+        waiting to be resent. Outputs up to `seq` count as acknowledged.
+        """
+        self.replay.ack(seq)
+        # Messages that never got a sequence number were never sent, so they're not in the replay buffer
+        unnumbered = [
+            output
+            for output in self.unsent_messages
+            if not (isinstance(output, dict) and "seq" in output)
+        ]
+        self.unsent_messages = deque(self.replay.since(seq) + unnumbered)
+
+    def _put_output(self, chunk):
+        """
+        Queues a chunk to be sent, waiting for room or dropping it (see output_backpressure) if the queue is full.
+        """
+        # Once the client has kept us waiting a whole timeout, don't wait for it again until it catches up
+        block = not _can_drop(chunk) or (
+            self.output_backpressure == "block" and not self._output_stalled
+        )
+        queue = self.output_queue.sync_q
+        try:
+            if block and not self.stop_event.is_set():
+                # Wait a little at a time, so a response that's stopped stops waiting
+                deadline = time.monotonic() + self.output_block_timeout
+                while True:
+                    try:
+                        queue.put(chunk, timeout=min(0.1, self.output_block_timeout))
+                        break
+                    except janus.SyncQueueFull:
+                        if self.stop_event.is_set() or time.monotonic() >= deadline:
+                            raise
+            else:
+                queue.put_nowait(chunk)
+            self._output_stalled = False
+        except janus.SyncQueueFull:
+            self.dropped_outputs += 1
+            self._output_stalled = True
+
     def respond(self, run_code=None):
+        if self.stop_event.is_set():
+            return  # Stopped while waiting for a worker
         for attempt in range(5):  # 5 attempts
             try:
                 if run_code == None:
@@ -156,7 +511,7 @@ class AsyncInterpreter(OpenInterpreter):
                     if self.debug:
                         print("Interpreter produced this chunk:", chunk)
 
-                    self.output_queue.sync_q.put(chunk)
+                    self._put_output(chunk)
                     sent_chunks = True
 
                 if not sent_chunks:
@@ -176,9 +531,11 @@ class AsyncInterpreter(OpenInterpreter):
                             "content": messages[attempt % len(messages)],
                         }
                     )
-                    time.sleep(1)
+                    # Don't hold on to the worker if we're stopped
+                    if self.stop_event.wait(1):
+                        return
                 else:
-                    self.output_queue.sync_q.put(complete_message)
+                    self._put_output(complete_message)
                     if self.debug:
                         print("\nServer response complete.\n")
                     return
@@ -190,8 +547,8 @@ class AsyncInterpreter(OpenInterpreter):
                     "type": "error",
                     "content": traceback.format_exc() + "\n" + str(e),
                 }
-                self.output_queue.sync_q.put(error_message)
-                self.output_queue.sync_q.put(complete_message)
+                self._put_output(error_message)
+                self._put_output(complete_message)
                 print("\n\n--- SENT ERROR: ---\n\n")
                 print(error)
                 print("\n\n--- (ERROR ABOVE WAS SENT) ---\n\n")
@@ -202,8 +559,8 @@ class AsyncInterpreter(OpenInterpreter):
             "type": "error",
             "content": "No chunks sent or unknown error.",
         }
-        self.output_queue.sync_q.put(error_message)
-        self.output_queue.sync_q.put(complete_message)
+        self._put_output(error_message)
+        self._put_output(complete_message)
         raise Exception("No chunks sent or unknown error.")
 
     def accumulate(self, chunk):
@@ -276,6 +633,222 @@ class AsyncInterpreter(OpenInterpreter):
             self.messages[-1]["content"] += chunk
 
 
+# State that belongs to one conversation, not to the settings a new session starts with
+_session_state = {
+    "messages",
+    "responding",
+    "last_messages_count",
+    "conversation_filename",
+    "id",
+    "respond_thread",
+    "stop_event",
+    "output_queue",
+    "unsent_messages",
+    "dropped_outputs",
+    "replay",
+    "last_start_time",
+}
+
+
+def _copy_settings(source, target):
+    """
+    Copies source's settings to target. Plain values (strings, numbers, lists, dicts...) are copied, and functions
+    set on source (like a custom llm.completions) are shared. Other objects (the tracer, the computer's tools and
+    their settings, the image pipeline...) aren't copied: target keeps its own. So do lists and dicts that can't be
+    copied, and methods that are only source's own versions of target's (like llm.vision_renderer).
+    """
+    for key, value in vars(source).items():
+        if key.startswith("_") or key in _session_state:
+            continue
+        if isinstance(value, (str, int, float, bool, type(None))):
+            setattr(target, key, value)
+        elif isinstance(value, (list, tuple, dict)):
+            try:
+                setattr(target, key, copy.deepcopy(value))
+            except Exception:
+                pass
+        elif isinstance(value, (types.FunctionType, types.MethodType)):
+            current = getattr(target, key, None)
+            if getattr(value, "__func__", value) is not getattr(
+                current, "__func__", current
+            ):
+                setattr(target, key, value)
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class Session:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.last_used = time.monotonic()
+        self.connections = 0
+
+    @property
+    def busy(self):
+        thread = self.interpreter.respond_thread
+        return self.connections > 0 or (thread is not None and thread.is_alive())
+
+
+class SessionManager:
+    """
+    Gives each session ID its own interpreter (messages, languages, output queue), so one server can serve many users.
+
+    Requests without a session ID use the default interpreter, like before. At most `max_sessions` sessions are kept:
+    sessions idle for `ttl` seconds are closed, and when a new session needs room the least recently used idle one
+    is closed. If every session is busy, new ones are refused with SessionLimitError.
+    """
+
+    def __init__(self, default, factory=None, max_sessions=None, ttl=None):
+        self.default = default
+        self.factory = factory or default.new_session
+        if max_sessions is None:
+            max_sessions = int(os.getenv("INTERPRETER_MAX_SESSIONS", "16"))
+        if ttl is None:
+            ttl = float(os.getenv("INTERPRETER_SESSION_TTL", "3600"))
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+
+        # Session ID -> Session, least recently used first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def get(self, session_id):
+        """
+        Returns the interpreter for this session ID (the default one for None), creating it if needed.
+        """
+        return self._get(session_id).interpreter
+
+    def _get(self, session_id, connect=False):
+        if session_id is None:
+            return Session(self.default)
+
+        closing = []
+        try:
+            with self._lock:
+                closing += self._pop_expired()
+                session = self._sessions.get(session_id)
+                if session is not None:
+                    return self._use(session_id, session, connect)
+                closing += self._make_room()
+
+            # Made without holding the lock, since it takes a while and other sessions' requests need the lock
+            interpreter = self.factory()
+            interpreter.id = session_id
+
+            with self._lock:
+                # (Another request may have made this session, or taken the room, in the meantime)
+                session = self._sessions.get(session_id)
+                if session is None:
+                    closing += self._make_room()
+                    session = self._sessions[session_id] = Session(interpreter)
+                    self.created += 1
+                return self._use(session_id, session, connect)
+        finally:
+            for old in closing:
+                self._close(old)
+
+    def _make_room(self):
+        """
+        If we're full, pops the least recently used idle session (returned, to be closed), or raises
+        SessionLimitError if they're all busy. Call it holding the lock.
+        """
+        if len(self._sessions) < self.max_sessions:
+            return []
+        idle = [key for key, value in self._sessions.items() if not value.busy]
+        if not idle:
+            raise SessionLimitError(
+                f"All {self.max_sessions} sessions are busy. Try again later."
+            )
+        self.evicted += 1
+        return [self._sessions.pop(idle[0])]
+
+    def _use(self, session_id, session, connect):
+        self._sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        if connect:
+            session.connections += 1
+        return session
+
+    @contextlib.contextmanager
+    def connection(self, session_id):
+        """
+        Holds a session open (it won't expire or be evicted) for as long as a client is connected to it.
+        """
+        session = self._get(session_id, connect=True)
+        try:
+            yield session.interpreter
+        finally:
+            if session_id is not None:
+                with self._lock:
+                    session.connections -= 1
+                    session.last_used = time.monotonic()
+
+    def _pop_expired(self):
+        now = time.monotonic()
+        expired = [
+            key
+            for key, session in self._sessions.items()
+            if not session.busy and now - session.last_used > self.ttl
+        ]
+        self.expired += len(expired)
+        return [self._sessions.pop(key) for key in expired]
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._close(session)
+        return session is not None
+
+    def close_expired(self):
+        with self._lock:
+            expired = self._pop_expired()
+        for session in expired:
+            self._close(session)
+
+    def _close(self, session):
+        interpreter = session.interpreter
+        interpreter.stop_event.set()
+        try:
+            interpreter.computer.terminate()
+        except Exception:
+            traceback.print_exc()
+
+    def interpreters(self):
+        """
+        The shared interpreter, then each session's.
+        """
+        with self._lock:
+            return [self.default] + [
+                session.interpreter for session in self._sessions.values()
+            ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "busy": sum(session.busy for session in self._sessions.values()),
+                "max_sessions": self.max_sessions,
+                "created": self.created,
+                "evicted": self.evicted,
+                "expired": self.expired,
+            }
+
+
+def session_id_of(connection):
+    """
+    The session ID of a request or websocket: from a /sessions/{session_id}/... URL, or the X-Session-ID header.
+    """
+    return connection.path_params.get("session_id") or connection.headers.get(
+        "X-Session-ID"
+    )
+
+
 def authenticate_function(key):
     """
     This function checks if the provided key is valid for authentication.
@@ -294,8 +867,17 @@ def authenticate_function(key):
         return key == api_key
 
 
-def create_router(async_interpreter):
+def create_router(async_interpreter, sessions=None, server=None):
+    """
+    The server's routes. They're also served under /sessions/{session_id}/, and requests with a session ID (from that
+    URL or an X-Session-ID header) go to that session's interpreter in `sessions` instead of `async_interpreter`.
+    `server` is the Server they're served by (for its host and authenticate function).
+    """
     router = APIRouter()
+    if sessions is None:
+        sessions = SessionManager(async_interpreter)
+    if server is None:
+        server = async_interpreter.server
 
     @router.get("/heartbeat")
     async def heartbeat():
@@ -320,9 +902,9 @@ def create_router(async_interpreter):
                 <div id="messages"></div>
                 <script>
                     var ws = new WebSocket("ws://"""
-            + async_interpreter.server.host
+            + server.host
             + ":"
-            + str(async_interpreter.server.port)
+            + str(server.port)
             + """/");
                     var lastMessageElement = null;
 
@@ -436,7 +1018,45 @@ def create_router(async_interpreter):
 
     @router.websocket("/")
     async def websocket_endpoint(websocket: WebSocket):
-        await websocket.accept()
+        # ?protocol=msgpack sends and receives msgpack frames instead of JSON text
+        binary = websocket.query_params.get("protocol") == "msgpack"
+        if binary and msgpack is None:
+            await websocket.accept()
+            # 1003: Unsupported data
+            await websocket.close(
+                code=1003,
+                reason="The msgpack protocol needs msgpack on the server (pip install msgpack).",
+            )
+            return
+        try:
+            with sessions.connection(session_id_of(websocket)) as async_interpreter:
+                await websocket.accept()
+                # A client reconnecting with ?resume=N gets every output after N again
+                resume = websocket.query_params.get("resume")
+                if resume is not None and resume.isdigit():
+                    async_interpreter.resume(int(resume))
+                await handle_websocket(websocket, async_interpreter, binary)
+        except SessionLimitError as e:
+            # 1013: Try again later
+            await websocket.close(code=1013, reason=str(e))
+
+    async def handle_websocket(websocket, async_interpreter, binary=False):
+        async def send_frame(output):
+            if binary:
+                frame = msgpack.packb(_to_binary(output))
+                await websocket.send_bytes(frame)
+            else:
+                frame = json.dumps(output)  # ASCII, so its length is its size in bytes
+                await websocket.send_text(frame)
+            websocket_frames_sent.inc()
+            websocket_bytes_sent.inc(len(frame))
+
+        def decode(data):
+            if "text" in data:
+                return json.loads(data["text"])
+            if binary:
+                return _from_binary(msgpack.unpackb(data["bytes"]))
+            return data["bytes"]
 
         try:  # solving it ;)/ # killian super wrote this
 
@@ -452,33 +1072,26 @@ def create_router(async_interpreter):
                             not authenticated
                             and os.getenv("INTERPRETER_REQUIRE_AUTH") != "False"
                         ):
-                            if "text" in data:
-                                data = json.loads(data["text"])
+                            if "text" in data or (binary and "bytes" in data):
+                                data = decode(data)
                                 if "auth" in data:
-                                    if async_interpreter.server.authenticate(
-                                        data["auth"]
-                                    ):
+                                    if server.authenticate(data["auth"]):
                                         authenticated = True
-                                        await websocket.send_text(
-                                            json.dumps({"auth": True})
-                                        )
+                                        await send_frame({"auth": True})
                             if not authenticated:
-                                await websocket.send_text(json.dumps({"auth": False}))
+                                await send_frame({"auth": False})
                             continue
 
                         if data.get("type") == "websocket.receive":
-                            if "text" in data:
-                                data = json.loads(data["text"])
-                                if (
-                                    async_interpreter.require_acknowledge
-                                    and "ack" in data
-                                ):
-                                    async_interpreter.acknowledged_outputs.append(
-                                        data["ack"]
-                                    )
-                                    continue
-                            elif "bytes" in data:
-                                data = data["bytes"]
+                            data = decode(data)
+                            if (
+                                isinstance(data, dict)
+                                and async_interpreter.require_acknowledge
+                                and "ack" in data
+                            ):
+                                if isinstance(data["ack"], int):
+                                    async_interpreter.replay.ack(data["ack"])
+                                continue
                             await async_interpreter.input(data)
                         elif data.get("type") == "websocket.disconnect":
                             print("Client wants to disconnect, that's fine..")
@@ -495,8 +1108,8 @@ def create_router(async_interpreter):
                             "content": traceback.format_exc() + "\n" + str(e),
                         }
                         if websocket.client_state == WebSocketState.CONNECTED:
-                            await websocket.send_text(json.dumps(error_message))
-                            await websocket.send_text(json.dumps(complete_message))
+                            await send_frame(error_message)
+                            await send_frame(complete_message)
                             print("\n\n--- SENT ERROR: ---\n\n")
                         else:
                             print(
@@ -505,6 +1118,11 @@ def create_router(async_interpreter):
                         print(error)
                         print("\n\n--- (ERROR ABOVE) ---\n\n")
 
+            def numbered(output):
+                if isinstance(output, dict) and "seq" not in output:
+                    return async_interpreter.replay.add(output)
+                return output
+
             async def send_output():
                 while True:
                     if websocket.client_state != WebSocketState.CONNECTED:
@@ -512,24 +1130,36 @@ def create_router(async_interpreter):
                     try:
                         # First, try to send any unsent messages
                         while async_interpreter.unsent_messages:
-                            output = async_interpreter.unsent_messages[0]
+                            unsent_messages = async_interpreter.unsent_messages
+                            output = unsent_messages[0] = numbered(unsent_messages[0])
                             if async_interpreter.debug:
                                 print("This was unsent, sending it again:", output)
 
                             success = await send_message(output)
-                            if success:
-                                async_interpreter.unsent_messages.popleft()
+                            # (A resume may have replaced the queue while we were sending)
+                            if (
+                                success
+                                and unsent_messages is async_interpreter.unsent_messages
+                            ):
+                                unsent_messages.popleft()
 
                         # If we've sent all unsent messages, get a new output
                         if not async_interpreter.unsent_messages:
-                            output = await async_interpreter.output()
-                            success = await send_message(output)
-                            if not success:
-                                async_interpreter.unsent_messages.append(output)
-                                if async_interpreter.debug:
-                                    print(
-                                        f"Added message to unsent_messages queue after failed attempts: {output}"
+                            outputs = [
+                                numbered(output)
+                                for output in await async_interpreter.outputs()
+                            ]
+                            for i, output in enumerate(outputs):
+                                success = await send_message(output)
+                                if not success:
+                                    async_interpreter.unsent_messages.extend(
+                                        outputs[i:]
                                     )
+                                    if async_interpreter.debug:
+                                        print(
+                                            f"Added message to unsent_messages queue after failed attempts: {output}"
+                                        )
+                                    break
 
                     except Exception as e:
                         error = traceback.format_exc() + "\n" + str(e)
@@ -547,16 +1177,6 @@ def create_router(async_interpreter):
                         )
 
             async def send_message(output):
-                if isinstance(output, dict) and "id" in output:
-                    id = output["id"]
-                else:
-                    id = shortuuid.uuid()
-                    if (
-                        isinstance(output, dict)
-                        and async_interpreter.require_acknowledge
-                    ):
-                        output["id"] = id
-
                 for attempt in range(20):
                     # time.sleep(0.5)
 
@@ -568,26 +1188,28 @@ def create_router(async_interpreter):
 
                         if isinstance(output, bytes):
                             await websocket.send_bytes(output)
+                            websocket_frames_sent.inc()
+                            websocket_bytes_sent.inc(len(output))
                             return True  # Haven't set up ack for this
                         else:
-                            if async_interpreter.require_acknowledge:
-                                output["id"] = id
+                            if async_interpreter.require_acknowledge and isinstance(
+                                output, dict
+                            ):
+                                # Clients acknowledge this id. Acknowledging an output acknowledges all before it
+                                output["id"] = output["seq"]
                             if async_interpreter.debug:
                                 print("Sending this over the websocket:", output)
-                            await websocket.send_text(json.dumps(output))
-
-                        if async_interpreter.require_acknowledge:
-                            acknowledged = False
-                            for _ in range(100):
-                                if id in async_interpreter.acknowledged_outputs:
-                                    async_interpreter.acknowledged_outputs.remove(id)
-                                    acknowledged = True
-                                    if async_interpreter.debug:
-                                        print("This output was acknowledged:", output)
-                                    break
-                                await asyncio.sleep(0.0001)
+                            await send_frame(output)
 
+                        if async_interpreter.require_acknowledge and isinstance(
+                            output, dict
+                        ):
+                            acknowledged = await async_interpreter.replay.wait_for_ack(
+                                output["seq"], async_interpreter.ack_timeout
+                            )
                             if acknowledged:
+                                if async_interpreter.debug:
+                                    print("This output was acknowledged:", output)
                                 return True
                             else:
                                 if async_interpreter.debug:
@@ -632,7 +1254,8 @@ def create_router(async_interpreter):
 
     # TODO
     @router.post("/")
-    async def post_input(payload: Dict[str, Any]):
+    async def post_input(payload: Dict[str, Any], request: Request):
+        async_interpreter = sessions.get(session_id_of(request))
         try:
             async_interpreter.input(payload)
             return {"status": "success"}
@@ -640,7 +1263,8 @@ def create_router(async_interpreter):
             return {"error": str(e)}, 500
 
     @router.post("/settings")
-    async def set_settings(payload: Dict[str, Any]):
+    async def set_settings(payload: Dict[str, Any], request: Request):
+        async_interpreter = sessions.get(session_id_of(request))
         for key, value in payload.items():
             print("Updating settings...")
             # print(f"Updating settings: {key} = {value}")
@@ -667,7 +1291,8 @@ def create_router(async_interpreter):
         return {"status": "success"}
 
     @router.get("/settings/{setting}")
-    async def get_setting(setting: str):
+    async def get_setting(setting: str, request: Request):
+        async_interpreter = sessions.get(session_id_of(request))
         if hasattr(async_interpreter, setting):
             setting_value = getattr(async_interpreter, setting)
             try:
@@ -680,7 +1305,8 @@ def create_router(async_interpreter):
     if os.getenv("INTERPRETER_INSECURE_ROUTES", "").lower() == "true":
 
         @router.post("/run")
-        async def run_code(payload: Dict[str, Any]):
+        async def run_code(payload: Dict[str, Any], request: Request):
+            async_interpreter = sessions.get(session_id_of(request))
             language, code = payload.get("language"), payload.get("code")
             if not (language and code):
                 return {"error": "Both 'language' and 'code' are required."}, 400
@@ -692,24 +1318,102 @@ def create_router(async_interpreter):
             except Exception as e:
                 return {"error": str(e)}, 500
 
+        # Uploads can't make files bigger than this (0 for no limit)
+        max_upload_bytes = (
+            int(os.getenv("INTERPRETER_MAX_UPLOAD_BYTES", str(1024**3))) or None
+        )
+
+        def check_upload_size(request, offset=0):
+            length = request.headers.get("content-length")
+            if (
+                max_upload_bytes is not None
+                and length
+                and length.isdigit()
+                and offset + int(length) > max_upload_bytes
+            ):
+                raise UploadTooLarge(
+                    f"Files can't be bigger than {max_upload_bytes} bytes (INTERPRETER_MAX_UPLOAD_BYTES)."
+                )
+
         @router.post("/upload")
-        async def upload_file(file: UploadFile = File(...), path: str = Form(...)):
+        async def upload_file(
+            request: Request, file: UploadFile = File(...), path: str = Form(...)
+        ):
             try:
-                with open(path, "wb") as output_file:
-                    shutil.copyfileobj(file.file, output_file)
-                return {"status": "success"}
+                check_upload_size(request)
+                size = await write_file(
+                    upload_chunks(file), path, max_bytes=max_upload_bytes
+                )
+                return {"status": "success", "size": size}
+            except UploadTooLarge as e:
+                return JSONResponse(status_code=413, content={"error": str(e)})
             except Exception as e:
                 return {"error": str(e)}, 500
 
-        @router.get("/download/{filename}")
-        async def download_file(filename: str):
+        @router.put("/upload")
+        async def stream_upload(request: Request, path: str, offset: int = 0):
+            """
+            Streams the request body to `path`. To resume an upload that stopped, send the rest with
+            ?offset= the number of bytes the server has (it says, if it's wrong).
+            """
             try:
-                return StreamingResponse(
-                    open(filename, "rb"), media_type="application/octet-stream"
+                size = await asyncio.to_thread(file_size, path)
+                if offset and offset != size:
+                    return JSONResponse(
+                        status_code=409,
+                        content={
+                            "error": f"The file has {size} bytes, not {offset}.",
+                            "size": size,
+                        },
+                    )
+                check_upload_size(request, offset)
+                size = await write_file(
+                    request.stream(), path, offset, max_upload_bytes
                 )
+                return {"status": "success", "size": size}
+            except UploadTooLarge as e:
+                return JSONResponse(status_code=413, content={"error": str(e)})
             except Exception as e:
                 return {"error": str(e)}, 500
 
+        @router.get("/download/{filename:path}")
+        async def download_file(filename: str, request: Request, gzip: bool = False):
+            """
+            Streams a file. Supports a single "Range: bytes=..." (to resume a download), and ?gzip=true to compress it
+            on the fly (for whole files only, since ranges are of the file's bytes).
+            """
+            try:
+                size = await asyncio.to_thread(os.path.getsize, filename)
+            except OSError as e:
+                return JSONResponse(status_code=404, content={"error": str(e)})
+            try:
+                byte_range = parse_range(request.headers.get("range"), size)
+            except RangeNotSatisfiable:
+                return Response(
+                    status_code=416, headers={"Content-Range": f"bytes */{size}"}
+                )
+
+            headers = {"Accept-Ranges": "bytes"}
+            if byte_range is not None:
+                start, end = byte_range
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+                headers["Content-Length"] = str(end - start + 1)
+                return StreamingResponse(
+                    read_file(filename, start, end - start + 1),
+                    status_code=206,
+                    headers=headers,
+                    media_type="application/octet-stream",
+                )
+            if gzip:
+                headers["Content-Encoding"] = "gzip"
+            else:
+                headers["Content-Length"] = str(size)
+            return StreamingResponse(
+                read_file(filename, compress=gzip),
+                headers=headers,
+                media_type="application/octet-stream",
+            )
+
     ### OPENAI COMPATIBLE ENDPOINT
 
     class ChatMessage(BaseModel):
@@ -723,7 +1427,7 @@ def create_router(async_interpreter):
         temperature: Optional[float] = None
         stream: Optional[bool] = False
 
-    async def openai_compatible_generator():
+    async def openai_compatible_generator(async_interpreter):
         made_chunk = False
 
         for message in [
@@ -734,38 +1438,49 @@ def create_router(async_interpreter):
             "Can you respond?",
             "Please reply.",
         ]:
-            for i, chunk in enumerate(
-                async_interpreter.chat(message=message, stream=True, display=True)
-            ):
-                made_chunk = True
-
-                if async_interpreter.stop_event.is_set():
-                    break
-
-                output_content = None
-
-                if chunk["type"] == "message" and "content" in chunk:
-                    output_content = chunk["content"]
-                if chunk["type"] == "code" and "start" in chunk:
-                    output_content = " "
-
-                if output_content:
-                    await asyncio.sleep(0)
-                    output_chunk = {
-                        "id": i,
-                        "object": "chat.completion.chunk",
-                        "created": time.time(),
-                        "model": "open-interpreter",
-                        "choices": [{"delta": {"content": output_content}}],
-                    }
-                    yield f"data: {json.dumps(output_chunk)}\n\n"
+            # Run the LLM and code with the other responses, so other requests aren't blocked while this one
+            # streams, and it counts towards INTERPRETER_MAX_CONCURRENT_RESPONSES
+            chunks = iterate_in_thread(
+                lambda: async_interpreter.chat(
+                    message=message, stream=True, display=True
+                ),
+                async_interpreter.respond_pool,
+                async_interpreter,
+            )
+            i = 0
+            try:
+                async for chunk in chunks:
+                    made_chunk = True
+
+                    if async_interpreter.stop_event.is_set():
+                        break
+
+                    output_content = None
+
+                    if chunk["type"] == "message" and "content" in chunk:
+                        output_content = chunk["content"]
+                    if chunk["type"] == "code" and "start" in chunk:
+                        output_content = " "
+
+                    if output_content:
+                        output_chunk = {
+                            "id": i,
+                            "object": "chat.completion.chunk",
+                            "created": time.time(),
+                            "model": "open-interpreter",
+                            "choices": [{"delta": {"content": output_content}}],
+                        }
+                        yield f"data: {json.dumps(output_chunk)}\n\n"
+                    i += 1
+            finally:
+                await chunks.aclose()
 
             if made_chunk:
                 break
 
     @router.post("/openai/chat/completions")
-    async def chat_completion(request: ChatCompletionRequest):
-        global last_start_time
+    async def chat_completion(request: ChatCompletionRequest, http_request: Request):
+        async_interpreter = sessions.get(session_id_of(http_request))
 
         # Convert to LMC
         last_message = request.messages[-1]
@@ -831,11 +1546,11 @@ def create_router(async_interpreter):
                 if async_interpreter.messages[-1]["content"] == "{START}":
                     # Remove that {START} message that would have just been added
                     async_interpreter.messages = async_interpreter.messages[:-1]
-                last_start_time = time.time()
+                async_interpreter.last_start_time = time.time()
             else:
                 # Check if we're within 6 seconds of last_start_time
                 current_time = time.time()
-                if current_time - last_start_time <= 6:
+                if current_time - async_interpreter.last_start_time <= 6:
                     # Continue processing
                     pass
                 else:
@@ -850,15 +1565,23 @@ def create_router(async_interpreter):
                 return
 
         async_interpreter.stop_event.set()
-        time.sleep(0.1)
+        await asyncio.sleep(0.1)
         async_interpreter.stop_event.clear()
 
         if request.stream:
             return StreamingResponse(
-                openai_compatible_generator(), media_type="application/x-ndjson"
+                openai_compatible_generator(async_interpreter),
+                media_type="application/x-ndjson",
             )
         else:
-            messages = async_interpreter.chat(message=".", stream=False, display=True)
+            messages = await run_in_pool(
+                async_interpreter.respond_pool,
+                async_interpreter,
+                async_interpreter.chat,
+                message=".",
+                stream=False,
+                display=True,
+            )
             content = messages[-1]["content"]
             return {
                 "id": "200",
@@ -876,15 +1599,18 @@ class Server:
     DEFAULT_PORT = 8000
 
     def __init__(self, async_interpreter, host=None, port=None):
+        # So async_interpreter.server is this server, rather than another one it would make
+        async_interpreter._server = self
         self.app = FastAPI()
-        router = create_router(async_interpreter)
+        self.sessions = SessionManager(async_interpreter)
         self.authenticate = authenticate_function
+        router = create_router(async_interpreter, self.sessions, self)
 
         # Add authentication middleware
         @self.app.middleware("http")
         async def validate_api_key(request: Request, call_next):
-            # Ignore authentication for the /heartbeat route
-            if request.url.path == "/heartbeat":
+            # Ignore authentication for the /heartbeat and /metrics routes
+            if request.url.path in ("/heartbeat", "/metrics"):
                 return await call_next(request)
 
             api_key = request.headers.get("X-API-KEY")
@@ -898,6 +1624,35 @@ class Server:
                 )
 
         self.app.include_router(router)
+        self.app.include_router(router, prefix="/sessions/{session_id}")
+
+        @self.app.get("/sessions")
+        async def session_stats():
+            return {
+                **self.sessions.stats(),
+                "responses": self.sessions.default.respond_pool.stats(),
+            }
+
+        self._register_metrics()
+
+        @self.app.get("/metrics")
+        async def get_metrics():
+            return PlainTextResponse(
+                metrics.render(), media_type="text/plain; version=0.0.4"
+            )
+
+        @self.app.delete("/sessions/{session_id}")
+        async def close_session(session_id: str):
+            return {"closed": self.sessions.close(session_id)}
+
+        @self.app.exception_handler(SessionLimitError)
+        async def session_limit(request: Request, exc: SessionLimitError):
+            return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+        @self.app.exception_handler(QueueFullError)
+        async def responses_full(request: Request, exc: QueueFullError):
+            return JSONResponse(status_code=503, content={"detail": str(exc)})
+
         h = host or os.getenv("HOST", Server.DEFAULT_HOST)
         p = port or int(os.getenv("PORT", Server.DEFAULT_PORT))
         self.config = uvicorn.Config(app=self.app, host=h, port=p)
@@ -921,6 +1676,69 @@ class Server:
         self.config.port = value
         self.uvicorn_server = uvicorn.Server(self.config)
 
+    def _register_metrics(self):
+        """
+        Gauges read from this server's sessions when /metrics is scraped.
+        """
+        sessions = self.sessions
+        pool = sessions.default.respond_pool
+        process = psutil.Process()
+
+        def total(attribute):
+            return lambda: sum(
+                len(attribute(interpreter)) for interpreter in sessions.interpreters()
+            )
+
+        metrics.gauge(
+            "interpreter_sessions",
+            "Sessions (not counting the shared interpreter).",
+            function=lambda: sessions.stats()["sessions"],
+        )
+        metrics.gauge(
+            "interpreter_sessions_busy",
+            "Sessions that are connected or responding.",
+            function=lambda: sessions.stats()["busy"],
+        )
+        metrics.gauge(
+            "interpreter_responses_running",
+            "Responses running now.",
+            function=lambda: pool.running,
+        )
+        metrics.gauge(
+            "interpreter_responses_queued",
+            "Responses waiting for a worker.",
+            function=lambda: pool.queued,
+        )
+        metrics.gauge(
+            "interpreter_unsent_messages",
+            "Outputs waiting to be sent again to clients that dropped them.",
+            function=total(lambda interpreter: interpreter.unsent_messages),
+        )
+        metrics.counter(
+            "interpreter_dropped_outputs_total",
+            "Outputs dropped because a client couldn't keep up.",
+            function=lambda: sum(
+                interpreter.dropped_outputs for interpreter in sessions.interpreters()
+            ),
+        )
+        metrics.gauge(
+            "interpreter_kernels",
+            "Running language kernels (Python, shell...) across sessions.",
+            function=total(
+                lambda interpreter: interpreter.computer.terminal._active_languages
+            ),
+        )
+        metrics.gauge(
+            "process_resident_memory_bytes",
+            "Resident memory of the server process.",
+            function=lambda: process.memory_info().rss,
+        )
+
+    def _close_expired_sessions(self):
+        while True:
+            time.sleep(min(60, self.sessions.ttl))
+            self.sessions.close_expired()
+
     def run(self, host=None, port=None, retries=5):
         if host is not None:
             self.host = host
@@ -939,6 +1757,16 @@ class Server:
         else:
             print(f"Server will run at http://{self.host}:{self.port}")
 
+        # Close idle sessions even if no more requests come in to notice them
+        threading.Thread(target=self._close_expired_sessions, daemon=True).start()
+
+        # Load local models (e.g. "easyocr,moondream") while the server starts, instead of in the first request
+        warmup = os.getenv("INTERPRETER_WARMUP_MODELS", "")
+        if warmup:
+            model_registry.warmup(
+                [name.strip() for name in warmup.split(",") if name.strip()]
+            )
+
         self.uvicorn_server.run()
 
         # for _ in range(retries):
@@ -1,122 +1,314 @@
-from concurrent.futures import ThreadPoolExecutor
+import concurrent.futures
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+
+from ...utils.model_registry import get_tiktoken_encoding
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """
+    Returns the tiktoken encoder for this model (or a close enough one), so we only look it up once per model.
+    Returns None if tiktoken can't load one (it downloads encodings on first use), so we don't retry on every call.
+    """
+    try:
+        return get_tiktoken_encoding(model)
+    except Exception:
+        return None
+
 
-import tiktoken
+def get_token_counter(llm):
+    """
+    Returns a function that counts tokens for this llm, falling back to ~4 characters per token if tiktoken isn't available.
+    """
+    encoding = get_encoding(llm.model)
+    if encoding is None:
+        return lambda text: -(-len(text) // 4)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def split_long_line(line, tokens, llm):
+    encoding = get_encoding(llm.model)
+    if encoding is None:
+        return [line[i : i + tokens * 4] for i in range(0, len(line), tokens * 4)]
+    tokenized_line = encoding.encode(line, disallowed_special=())
+    return [
+        encoding.decode(tokenized_line[i : i + tokens])
+        for i in range(0, len(tokenized_line), tokens)
+    ]
 
 
 def split_into_chunks(text, tokens, llm, overlap):
-    try:
-        encoding = tiktoken.encoding_for_model(llm.model)
-        tokenized_text = encoding.encode(text)
-        chunks = []
-        for i in range(0, len(tokenized_text), tokens - overlap):
-            chunk = encoding.decode(tokenized_text[i : i + tokens])
-            chunks.append(chunk)
-    except Exception:
-        chunks = []
-        for i in range(0, len(text), tokens * 4 - overlap):
-            chunk = text[i : i + tokens * 4]
-            chunks.append(chunk)
-    return chunks
+    """
+    Splits text into chunks of at most `tokens` tokens (plus `overlap` tokens from the end of the previous chunk).
+    """
+    return list(iter_chunks(text.splitlines(keepends=True), tokens, llm, overlap))
+
+
+def iter_chunks(lines, tokens, llm, overlap):
+    """
+    Like split_into_chunks, but takes an iterable of lines and yields each chunk as soon as it's complete,
+    so the whole text never has to be in memory.
+
+    Chunks end on line breaks, and past the halfway point they end on lines picked by their *content*, not their position.
+    That way an edit early in a document only changes the chunks around it, so the chunk cache stays useful.
+    """
+    count_tokens = get_token_counter(llm)
+    body_tokens = max(tokens - overlap, 1)
+
+    def with_overlap(previous, body):
+        if previous is None or overlap <= 0:
+            return body
+        encoding = get_encoding(llm.model)
+        if encoding is None:
+            return previous[-overlap * 4 :] + body
+        tail = encoding.decode(
+            encoding.encode(previous, disallowed_special=())[-overlap:]
+        )
+        return tail + body
+
+    previous = None
+    current_lines = []
+    current_tokens = 0
+    for line in lines:
+        line_tokens = count_tokens(line)
+        if line_tokens > body_tokens:
+            pieces = split_long_line(line, body_tokens, llm)
+        else:
+            pieces = [line]
+
+        for piece in pieces:
+            piece_tokens = line_tokens if len(pieces) == 1 else count_tokens(piece)
+
+            if current_lines and current_tokens + piece_tokens > body_tokens:
+                body = "".join(current_lines)
+                yield with_overlap(previous, body)
+                previous = body
+                current_lines = []
+                current_tokens = 0
+
+            current_lines.append(piece)
+            current_tokens += piece_tokens
+
+            # A content-defined boundary, hit on average every ~body_tokens / 4 tokens
+            if current_tokens >= body_tokens // 2 and zlib.crc32(
+                piece.encode()
+            ) % body_tokens < 4 * max(piece_tokens, 1):
+                body = "".join(current_lines)
+                yield with_overlap(previous, body)
+                previous = body
+                current_lines = []
+                current_tokens = 0
+
+    if current_lines:
+        yield with_overlap(previous, "".join(current_lines))
+
+
+def iter_lines(source):
+    """
+    Yields lines from a file path, a string, or an iterable of strings / bytes, reading files lazily.
+    """
+    if isinstance(source, (str, os.PathLike)) and os.path.isfile(source):
+        with open(source, "r", errors="replace") as file:
+            yield from file
+    elif isinstance(source, str):
+        yield from source.splitlines(keepends=True)
+    else:
+        for piece in source:
+            if isinstance(piece, bytes):
+                piece = piece.decode(errors="replace")
+            yield from piece.splitlines(keepends=True)
 
 
 def chunk_responses(responses, tokens, llm):
-    try:
-        encoding = tiktoken.encoding_for_model(llm.model)
-        chunked_responses = []
-        current_chunk = ""
-        current_tokens = 0
-
-        for response in responses:
-            tokenized_response = encoding.encode(response)
-            new_tokens = current_tokens + len(tokenized_response)
-
-            # If the new token count exceeds the limit, handle the current chunk
-            if new_tokens > tokens:
-                # If current chunk is empty or response alone exceeds limit, add response as standalone
-                if current_tokens == 0 or len(tokenized_response) > tokens:
-                    chunked_responses.append(response)
-                else:
-                    chunked_responses.append(current_chunk)
-                    current_chunk = response
-                    current_tokens = len(tokenized_response)
-                continue
-
-            # Add response to the current chunk
-            current_chunk += "\n\n" + response if current_chunk else response
-            current_tokens = new_tokens
-
-        # Add remaining chunk if not empty
-        if current_chunk:
-            chunked_responses.append(current_chunk)
-    except Exception:
-        chunked_responses = []
-        current_chunk = ""
-        current_chars = 0
-
-        for response in responses:
-            new_chars = current_chars + len(response)
-
-            # If the new char count exceeds the limit, handle the current chunk
-            if new_chars > tokens * 4:
-                # If current chunk is empty or response alone exceeds limit, add response as standalone
-                if current_chars == 0 or len(response) > tokens * 4:
-                    chunked_responses.append(response)
-                else:
-                    chunked_responses.append(current_chunk)
-                    current_chunk = response
-                    current_chars = len(response)
-                continue
-
-            # Add response to the current chunk
-            current_chunk += "\n\n" + response if current_chunk else response
-            current_chars = new_chars
-
-        # Add remaining chunk if not empty
-        if current_chunk:
+    """
+    Packs responses together into chunks of at most `tokens` tokens. Always returns fewer chunks than responses (if there's more than one).
+    """
+    count_tokens = get_token_counter(llm)
+
+    chunked_responses = []
+    current_chunk = ""
+    current_tokens = 0
+
+    for response in responses:
+        response_tokens = count_tokens(response)
+
+        # If the new token count exceeds the limit, start a new chunk
+        if current_chunk and current_tokens + response_tokens > tokens:
             chunked_responses.append(current_chunk)
+            current_chunk = ""
+            current_tokens = 0
+
+        # Add response to the current chunk
+        current_chunk += "\n\n" + response if current_chunk else response
+        current_tokens += response_tokens
+
+    # Add remaining chunk if not empty
+    if current_chunk:
+        chunked_responses.append(current_chunk)
+
+    # Responses too big to pack together? Pair them anyway, so reducing always makes progress
+    if len(responses) > 1 and len(chunked_responses) >= len(responses):
+        chunked_responses = [
+            "\n\n".join(responses[i : i + 2]) for i in range(0, len(responses), 2)
+        ]
+
     return chunked_responses
 
 
+_load_lock = threading.Lock()
+
+
 def fast_llm(llm, system_message, user_message):
-    old_messages = llm.interpreter.messages
-    old_system_message = llm.interpreter.system_message
-    try:
-        llm.interpreter.system_message = system_message
-        llm.interpreter.messages = []
-        response = llm.interpreter.chat(user_message)
-    finally:
-        llm.interpreter.messages = old_messages
-        llm.interpreter.system_message = old_system_message
-        return response[-1].get("content")
-
-
-def query_map_chunks(chunks, llm, query):
-    """Query the chunks of text using query_chunk_map."""
-    with ThreadPoolExecutor() as executor:
-        responses = list(
-            executor.map(lambda chunk: fast_llm(llm, query, chunk), chunks)
-        )
+    """
+    Calls the language model directly and returns its response.
+
+    This doesn't touch interpreter.messages or run any code, so it's safe to call from many threads at once.
+    """
+    # Loading and resolving the model can change the llm's settings, so only one thread does it at a time
+    with _load_lock:
+        if not llm._is_loaded:
+            llm.load()
+        model = llm.resolve_model()
+
+    params = llm.completion_params(
+        model,
+        [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message},
+        ],
+    )
+
+    response = ""
+    for chunk in llm.completions(**params):
+        if "choices" not in chunk or len(chunk["choices"]) == 0:
+            continue
+        content = chunk["choices"][0]["delta"].get("content", "")
+        if content:
+            response += content
+    return response
+
+
+class ChunkCache:
+    """
+    A thread-safe LRU cache of responses, keyed by the model, the query and the chunk of text.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, llm, query, chunk):
+        # Anything that changes the answer is part of the key
+        settings = [
+            llm.model,
+            llm.api_base,
+            llm.api_version,
+            llm.temperature,
+            llm.max_tokens,
+        ]
+        return hashlib.sha256(
+            "\0".join([str(setting) for setting in settings] + [query, chunk]).encode()
+        ).hexdigest()
+
+    def get(self, llm, query, chunk):
+        key = self._key(llm, query, chunk)
+        with self._lock:
+            if key in self._responses:
+                self._responses.move_to_end(key)
+                return self._responses[key]
+        return None
+
+    def set(self, llm, query, chunk, response):
+        key = self._key(llm, query, chunk)
+        with self._lock:
+            self._responses[key] = response
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+
+
+def cached_fast_llm(llm, query, chunk, cache=None):
+    """fast_llm, but answered from `cache` if we've seen this chunk before."""
+    response = cache.get(llm, query, chunk) if cache is not None else None
+    if response is None:
+        response = fast_llm(llm, query, chunk)
+        if cache is not None:
+            cache.set(llm, query, chunk, response)
+    return response
+
+
+def query_chunks(chunks, llm, query, max_workers=8, cache=None):
+    """
+    Queries each chunk with at most `max_workers` requests in flight.
+    Yields (index, response) as each one finishes. Chunks already in `cache` don't call the LLM.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        try:
+            for i, chunk in enumerate(chunks):
+                futures[executor.submit(cached_fast_llm, llm, query, chunk, cache)] = i
+
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # If we're stopped early, don't start the requests that are still waiting
+            for future in futures:
+                future.cancel()
+
+
+def query_map_chunks(chunks, llm, query, max_workers=8, cache=None):
+    """Query the chunks of text, returning the responses in order."""
+    responses = [None] * len(chunks)
+    for i, response in query_chunks(chunks, llm, query, max_workers, cache):
+        responses[i] = response
     return responses
 
 
-def query_reduce_chunks(responses, llm, chunk_size, query):
-    """Reduce query responses in a while loop."""
+def query_reduce_chunks(responses, llm, chunk_size, query, max_workers=8, cache=None):
+    """
+    Reduce query responses until only one is left.
+    Yields each reduced response as soon as it's ready. The last one yielded is the final response.
+    """
+    if len(responses) == 1:
+        yield responses[0]
+        return
+
     while len(responses) > 1:
         chunks = chunk_responses(responses, chunk_size, llm)
 
-        # Use multithreading to summarize each chunk simultaneously
-        with ThreadPoolExecutor() as executor:
-            summaries = list(
-                executor.map(lambda chunk: fast_llm(llm, query, chunk), chunks)
-            )
+        summaries = [None] * len(chunks)
+        for i, summary in query_chunks(chunks, llm, query, max_workers, cache):
+            summaries[i] = summary
+            yield summary
+
+        responses = summaries
+
 
-    return summaries[0]
+summarize_query = "You are a highly skilled AI trained in language comprehension and summarization. I would like you to read the following text and summarize it into a concise abstract paragraph. Aim to retain the most important points, providing a coherent and readable summary that could help a person understand the main points of the discussion without needing to read the entire text. Please avoid unnecessary details or tangential points."
+summarize_reduce_query = "You are tasked with taking multiple summarized texts and merging them into one unified and concise summary. Maintain the core essence of the content and provide a clear and comprehensive summary that encapsulates all the main points from the individual summaries."
 
 
 class Ai:
     def __init__(self, computer):
         self.computer = computer
 
+        self.chunk_size = 2000  # Tokens per chunk in query() / summarize()
+        self.chunk_overlap = 50  # Tokens
+        self.max_concurrency = 8  # LLM requests in flight at once
+        # So re-querying a mostly unchanged text only re-processes the changed chunks
+        self.cache = ChunkCache()
+
     def chat(self, text, base64=None):
         messages = [
             {
@@ -164,29 +356,157 @@ class Ai:
 
             return response[-1].get("content")
 
-    def query(self, text, query, custom_reduce_query=None):
+    def query(self, text, query, custom_reduce_query=None, stream=False):
+        """
+        Asks the language model `query` about each chunk of `text`, then merges the answers (map-reduce).
+
+        If stream=True, returns a generator of partial responses as they're merged. The last one is the final response.
+        """
+        if stream:
+            return self._streaming_query(text, query, custom_reduce_query)
+
+        response = ""
+        for response in self._streaming_query(text, query, custom_reduce_query):
+            pass
+        return response
+
+    def _streaming_query(self, text, query, custom_reduce_query=None):
         if custom_reduce_query == None:
             custom_reduce_query = query
 
-        chunk_size = 2000
-        overlap = 50
+        llm = self.computer.interpreter.llm
 
         # Split the text into chunks
-        chunks = split_into_chunks(
-            text, chunk_size, self.computer.interpreter.llm, overlap
-        )
+        chunks = split_into_chunks(text, self.chunk_size, llm, self.chunk_overlap)
+        if not chunks:
+            return
 
         # (Map) Query each chunk
-        responses = query_map_chunks(chunks, self.computer.interpreter.llm, query)
+        responses = query_map_chunks(
+            chunks, llm, query, self.max_concurrency, self.cache
+        )
 
         # (Reduce) Compress the responses
-        response = query_reduce_chunks(
-            responses, self.computer.interpreter.llm, chunk_size, custom_reduce_query
+        yield from query_reduce_chunks(
+            responses,
+            llm,
+            self.chunk_size,
+            custom_reduce_query,
+            self.max_concurrency,
+            self.cache,
         )
 
-        return response
-
-    def summarize(self, text):
-        query = "You are a highly skilled AI trained in language comprehension and summarization. I would like you to read the following text and summarize it into a concise abstract paragraph. Aim to retain the most important points, providing a coherent and readable summary that could help a person understand the main points of the discussion without needing to read the entire text. Please avoid unnecessary details or tangential points."
-        custom_reduce_query = "You are tasked with taking multiple summarized texts and merging them into one unified and concise summary. Maintain the core essence of the content and provide a clear and comprehensive summary that encapsulates all the main points from the individual summaries."
-        return self.query(text, query, custom_reduce_query)
+    def summarize(self, text, stream=False):
+        return self.query(text, summarize_query, summarize_reduce_query, stream=stream)
+
+    def summarize_stream(self, source, fan_in=4):
+        """
+        Summarizes a file path, a string, or an iterator of strings, without holding it all in memory.
+
+        Chunks are summarized as they're read, and every `fan_in` neighbouring summaries are merged as soon as they're all done,
+        building a tree. Yields {"level": ..., "content": ..., "final": ...} for each summary as soon as it's ready,
+        where level 0 summarizes raw text and level n merges summaries from level n - 1. The last one yielded is final.
+        """
+        llm = self.computer.interpreter.llm
+        fan_in = max(fan_in, 2)
+
+        # levels[n] holds the futures of level n summaries that haven't been merged yet, in text order
+        levels = []
+        pending = {}  # Futures we haven't yielded yet -> their level
+        exhausted = False  # Have we read all of the input?
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+
+            def submit(level, query, text):
+                future = executor.submit(cached_fast_llm, llm, query, text, self.cache)
+                while len(levels) <= level:
+                    levels.append([])
+                levels[level].append(future)
+                pending[future] = level
+
+            def collect(block):
+                if block and pending:
+                    concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+
+                # Once the input is read, the only summary left is the final one. Don't yield it twice
+                is_last = (
+                    exhausted
+                    and len(pending) == 1
+                    and sum(len(level) for level in levels) == 1
+                )
+
+                # Yield whatever has finished
+                for future in [future for future in pending if future.done()]:
+                    level = pending.pop(future)
+                    if not is_last:
+                        yield {
+                            "level": level,
+                            "content": future.result(),
+                            "final": False,
+                        }
+
+                # Merge each group of fan_in finished siblings
+                for level in range(len(levels)):
+                    while len(levels[level]) >= fan_in and not any(
+                        future in pending for future in levels[level][:fan_in]
+                    ):
+                        siblings = levels[level][:fan_in]
+                        del levels[level][:fan_in]
+                        submit(
+                            level + 1,
+                            summarize_reduce_query,
+                            "\n\n".join(future.result() for future in siblings),
+                        )
+
+            try:
+                chunks = iter_chunks(
+                    iter_lines(source), self.chunk_size, llm, self.chunk_overlap
+                )
+                # Read one chunk ahead, so we know when we've submitted the last one
+                chunk = next(chunks, None)
+                while chunk is not None:
+                    next_chunk = next(chunks, None)
+                    submit(0, summarize_query, chunk)
+                    exhausted = next_chunk is None
+
+                    # Don't read further ahead than we can summarize, so memory stays bounded
+                    while len(pending) >= self.max_concurrency:
+                        yield from collect(block=True)
+                    yield from collect(block=False)
+
+                    chunk = next_chunk
+
+                while pending:
+                    yield from collect(block=True)
+
+                # Merge what's left. Higher levels cover earlier text, so they go first
+                summaries = [
+                    future.result() for level in reversed(levels) for future in level
+                ]
+                level = len(levels) - 1
+                while len(summaries) > 1:
+                    level += 1
+                    groups = [
+                        "\n\n".join(summaries[i : i + fan_in])
+                        for i in range(0, len(summaries), fan_in)
+                    ]
+                    summaries = list(
+                        executor.map(
+                            lambda group: cached_fast_llm(
+                                llm, summarize_reduce_query, group, self.cache
+                            ),
+                            groups,
+                        )
+                    )
+                    if len(summaries) > 1:
+                        for summary in summaries:
+                            yield {"level": level, "content": summary, "final": False}
+
+                if summaries:
+                    yield {"level": level, "content": summaries[0], "final": True}
+            finally:
+                # If we're stopped early, don't start the summaries that are still waiting
+                for future in pending:
+                    future.cancel()
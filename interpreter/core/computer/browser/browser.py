@@ -1,7 +1,6 @@
 import time
 
 import html2text
-import requests
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
@@ -28,7 +27,7 @@ class Browser:
         """
         Searches the web for the specified query and returns the results.
         """
-        response = requests.get(
+        response = self.computer.http.get(
             f'{self.computer.api_base.strip("/")}/browser/search',
             params={"query": query},
         )
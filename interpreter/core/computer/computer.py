@@ -1,5 +1,6 @@
 import json
 
+from ..utils.http_client import HttpClient
 from .ai.ai import Ai
 from .browser.browser import Browser
 from .calendar.calendar import Calendar
@@ -44,6 +45,8 @@ class Computer:
         self.ai = Ai(self)
         self.files = Files(self)
 
+        self.http = HttpClient()  # Shared, keep-alive connections for API calls
+
         self.emit_images = True
         self.api_base = "https://api.openinterpreter.com/v0"
         self.save_skills = True
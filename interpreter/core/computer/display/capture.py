@@ -0,0 +1,328 @@
+"""
+Screen capture backends. Each one grabs the screen, or a region of it, as a (height, width, 3) RGB NumPy array.
+
+"mss" reads the pixels straight from the display server (X11, including Xvfb, as well as macOS and Windows)
+and we wrap its buffer without copying it. "pyautogui" works wherever pyautogui does, and is the fallback.
+Set OI_CAPTURE_BACKEND, or computer.display.capture, to pick one.
+
+BackgroundCapture keeps grabbing frames at a low rate into a small ring buffer, so a screenshot can be
+returned right away and we can tell when the screen has stopped changing (see wait_for_stable).
+"""
+
+import collections
+import os
+import threading
+import time
+
+from ...utils.lazy_import import lazy_import
+
+# Lazy import of optional packages
+try:
+    cv2 = lazy_import("cv2")
+except:
+    cv2 = None  # Fixes colab error
+
+np = lazy_import("numpy")
+pyautogui = lazy_import("pyautogui")
+
+
+class PyautoguiCapture:
+    name = "pyautogui"
+
+    def grab(self, region=None):
+        """
+        Returns the screen, or its (left, top, width, height) region, as an RGB array.
+        """
+        img = pyautogui.screenshot(region=region)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return np.asarray(img)
+
+    def close(self):
+        pass
+
+
+class MssCapture:
+    name = "mss"
+
+    def __init__(self):
+        import mss  # Raises ImportError if it's not installed
+
+        self._mss = mss
+        # An mss instance holds a display connection, which can't be shared between threads
+        self._local = threading.local()
+
+    def _screen(self):
+        screen = getattr(self._local, "screen", None)
+        if screen is None:
+            screen = self._local.screen = self._mss.mss()
+        return screen
+
+    def grab(self, region=None):
+        """
+        Returns the screen, or its (left, top, width, height) region, as an RGB array.
+        The array is a view of mss's BGRA buffer, so nothing is copied until it's turned into an image.
+        """
+        screen = self._screen()
+        if region is None:
+            monitor = screen.monitors[0]  # All monitors together, like pyautogui
+        else:
+            left, top, width, height = region
+            monitor = {"left": left, "top": top, "width": width, "height": height}
+
+        shot = screen.grab(monitor)
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(
+            shot.height, shot.width, 4
+        )
+        return bgra[:, :, 2::-1]
+
+    def close(self):
+        screen = getattr(self._local, "screen", None)
+        if screen is not None:
+            screen.close()
+            self._local.screen = None
+
+
+capture_backends = {"mss": MssCapture, "pyautogui": PyautoguiCapture}
+
+
+def get_capture_backend(name=None):
+    """
+    Returns a new capture backend. `name` is "mss", "pyautogui" or "auto" (mss if it's installed),
+    defaulting to OI_CAPTURE_BACKEND.
+    """
+    name = name or os.getenv("OI_CAPTURE_BACKEND") or "auto"
+    if name == "auto":
+        try:
+            return MssCapture()
+        except ImportError:
+            return PyautoguiCapture()
+    if name not in capture_backends:
+        raise ValueError(
+            f"Unknown capture backend {name!r}. Choose from: auto, "
+            + ", ".join(capture_backends)
+        )
+    return capture_backends[name]()
+
+
+_default_capture = None
+_default_capture_lock = threading.Lock()
+
+
+def default_capture():
+    """
+    The capture backend shared by everything that doesn't set its own.
+    """
+    global _default_capture
+    with _default_capture_lock:
+        if _default_capture is None:
+            _default_capture = get_capture_backend()
+        return _default_capture
+
+
+def composite_frames(frames, labels=None):
+    """
+    Lays RGB frames out left to right, top-aligned, in one new array. If `labels` are given,
+    writes each one across the middle of its frame.
+    """
+    height = max(frame.shape[0] for frame in frames)
+    width = sum(frame.shape[1] for frame in frames)
+    collage = np.zeros((height, width, 3), dtype=np.uint8)
+
+    x_offset = 0
+    for frame in frames:
+        frame_height, frame_width = frame.shape[:2]
+        collage[:frame_height, x_offset : x_offset + frame_width] = frame[:, :, :3]
+        x_offset += frame_width
+
+    if labels:
+        _draw_labels(collage, [frame.shape[1] for frame in frames], labels)
+
+    return collage
+
+
+def _draw_labels(collage, widths, labels):
+    """
+    Writes each label, in white, as large as fits across the middle of its frame.
+    """
+    height = collage.shape[0]
+
+    if cv2 is not None:
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        line_type = 2
+        x_offset = 0
+        for width, text in zip(widths, labels):
+            # Scale the font so the text fills the frame
+            text_size = cv2.getTextSize(text, font, 4, line_type)[0]
+            font_scale = min(width / text_size[0], height / text_size[1])
+            text_size = cv2.getTextSize(text, font, font_scale, line_type)[0]
+
+            text_x = x_offset + width // 2 - text_size[0] // 2
+            text_y = height // 2 - text_size[1] // 2
+            cv2.putText(
+                collage,
+                text,
+                (text_x, text_y),
+                font,
+                font_scale,
+                (255, 255, 255),
+                line_type,
+            )
+            x_offset += width
+        return
+
+    from PIL import Image, ImageDraw, ImageFont
+
+    img = Image.fromarray(collage)
+    draw = ImageDraw.Draw(img)
+    x_offset = 0
+    for width, text in zip(widths, labels):
+        try:
+            font = ImageFont.load_default(size=max(1, width // max(1, len(text))))
+        except TypeError:
+            # Pillow < 10.1 only has a small bitmap font
+            font = ImageFont.load_default()
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        draw.text(
+            (
+                x_offset + (width - (right - left)) // 2 - left,
+                (height - (bottom - top)) // 2 - top,
+            ),
+            text,
+            fill=(255, 255, 255),
+            font=font,
+        )
+        x_offset += width
+    collage[:] = np.asarray(img)
+
+
+class BackgroundCapture:
+    """
+    Grabs the whole screen `fps` times a second on a background thread, keeping the last `max_frames` frames.
+    Memory is bounded by max_frames full screen frames (about 33 MB each on a 4K screen).
+    """
+
+    def __init__(self, capture, fps=2, max_frames=3):
+        self.capture = capture
+        self.fps = fps
+        self.frames = collections.deque(maxlen=max_frames)  # (time captured, frame)
+        self.error = None  # The last exception from capturing, if any
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                frame = self.capture.grab()
+                with self._condition:
+                    self.frames.append((time.time(), frame))
+                    self.error = None
+                    self._condition.notify_all()
+            except Exception as e:
+                # Keep trying (the display may come back), but let waiters know
+                with self._condition:
+                    self.error = e
+                    self._condition.notify_all()
+            self._stop.wait(max(0, 1 / self.fps - (time.time() - started)))
+
+    def latest(self):
+        """
+        Returns the most recent (time captured, frame), or None if we don't have one yet.
+        """
+        with self._condition:
+            return self.frames[-1] if self.frames else None
+
+    def wait_for_frame(self, after=0, timeout=None):
+        """
+        Returns the first (time captured, frame) captured after `after` (a time.time()), waiting up to `timeout` seconds.
+        Returns None on timeout, or if capturing is failing or stopped.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while True:
+                for captured, frame in self.frames:
+                    if captured > after:
+                        return captured, frame
+                if self.error is not None or self._stop.is_set():
+                    return None
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def iter_frames(self, timeout):
+        """
+        Yields each new (time captured, frame) as it's captured, for up to `timeout` seconds.
+        """
+        deadline = time.time() + timeout
+        last = time.time()
+        while True:
+            result = self.wait_for_frame(after=last, timeout=deadline - time.time())
+            if result is None:
+                return
+            last = result[0]
+            yield result
+
+
+def poll_frames(capture, interval, timeout):
+    """
+    Yields (time captured, frame) from `capture` every `interval` seconds, for up to `timeout` seconds.
+    For when there's no BackgroundCapture running.
+    """
+    deadline = time.time() + timeout
+    while True:
+        started = time.time()
+        yield started, capture.grab()
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, max(0, interval - (time.time() - started))))
+
+
+def frames_differ(a, b, tolerance=0.001, step=4):
+    """
+    True if more than `tolerance` (a fraction) of the pixels differ. Checks every `step`th pixel each way,
+    so a blinking caret or a clock ticking over doesn't count as the screen changing.
+    """
+    if a.shape != b.shape:
+        return True
+    a, b = a[::step, ::step], b[::step, ::step]
+    changed = (a != b).any(axis=2) if a.ndim == 3 else a != b
+    return changed.mean() > tolerance
+
+
+def wait_for_stable(frames, stable_for=0.5, tolerance=0.001):
+    """
+    Consumes (time captured, frame) pairs until the screen has looked the same for `stable_for` seconds.
+    Returns that last frame, or None if `frames` ran out first (a timeout).
+    """
+    stable_since = None
+    previous = None
+    for captured, frame in frames:
+        if previous is None or frames_differ(previous, frame, tolerance):
+            stable_since = captured
+        elif captured - stable_since >= stable_for:
+            return frame
+        previous = frame
+    return None
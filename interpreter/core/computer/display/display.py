@@ -4,12 +4,12 @@ import os
 import platform
 import pprint
 import subprocess
+import threading
 import time
 import warnings
 from contextlib import redirect_stdout
 from io import BytesIO
 
-import requests
 from IPython.display import display
 from PIL import Image
 
@@ -33,6 +33,15 @@ pywinctl = lazy_import("pywinctl")
 
 
 from ..utils.computer_vision import find_text_in_image, pytesseract_get_text
+from ..utils.incremental_analysis import IncrementalAnalysis
+from .capture import (
+    BackgroundCapture,
+    composite_frames,
+    default_capture,
+    poll_frames,
+    wait_for_stable,
+)
+from .element_index import ElementIndex
 
 
 class Display:
@@ -42,6 +51,110 @@ class Display:
         self._width = None
         self._height = None
         self._hashes = {}
+        # Remembers the last frame's OCR words and element boxes, so find / find_text / get_text_as_list_of_lists
+        # only re-analyze the parts of the screen that changed. Set to None to always analyze the whole screen
+        self.analysis = IncrementalAnalysis()
+        # Remembers what find / find_text / get_text_as_list_of_lists found on the current frame, so asking again
+        # (e.g. clicking several things on a screen that hasn't changed) is instant. Set to None to always look again
+        self.element_index = ElementIndex()
+        self._capture = None
+        # Opt-in: in OS mode, keep grabbing the screen in the background, so view() / find() use the latest frame
+        # instead of waiting on a fresh capture. Holds at most background_frames frames
+        self.background_capture = False
+        self.background_fps = 2
+        self.background_frames = 3
+        self._background = None
+
+    @property
+    def capture(self):
+        """
+        The screen capture backend (see capture.get_capture_backend). Shared by default; set your own to override it.
+        """
+        if self._capture is None:
+            self._capture = default_capture()
+        return self._capture
+
+    @capture.setter
+    def capture(self, value):
+        self._capture = value
+
+    def start_background_capture(self):
+        """
+        Starts capturing the screen in the background (if it isn't already), and returns the BackgroundCapture.
+        """
+        background = self._background
+        if background is None or (
+            background.capture,
+            background.fps,
+            background.frames.maxlen,
+        ) != (self.capture, self.background_fps, self.background_frames):
+            self.stop_background_capture()
+            background = BackgroundCapture(
+                self.capture, self.background_fps, self.background_frames
+            )
+            self._background = background
+        background.start()
+        return background
+
+    def stop_background_capture(self):
+        if self._background is not None:
+            self._background.stop()
+            self._background = None
+
+    def _background_frame(self):
+        """
+        Returns a recent frame from the background capture, or None if it's off (it only runs in OS mode).
+        """
+        if not (
+            self.background_capture and getattr(self.computer.interpreter, "os", False)
+        ):
+            self.stop_background_capture()
+            return None
+
+        background = self.start_background_capture()
+        # The latest frame if it's recent, otherwise the next one
+        interval = 1 / self.background_fps
+        result = background.wait_for_frame(
+            after=time.time() - 2 * interval, timeout=2 * interval + 1
+        )
+        return None if result is None else result[1]
+
+    def _grab(self, region=None):
+        """
+        Grabs the screen, or its (left, top, width, height) region, using the background capture if it's on.
+        """
+        frame = self._background_frame()
+        # (Use it if it's the primary screen, maybe in physical pixels, e.g. on Retina screens, and the region is on it)
+        if (
+            frame is not None
+            and abs(frame.shape[1] / frame.shape[0] - self.width / self.height) < 0.01
+            and (
+                region is None
+                or (
+                    region[0] >= 0
+                    and region[1] >= 0
+                    and region[0] + region[2] <= self.width
+                    and region[1] + region[3] <= self.height
+                )
+            )
+        ):
+            if region is None:
+                return frame
+            scale = frame.shape[1] / self.width
+            left, top, width, height = (int(round(value * scale)) for value in region)
+            return frame[max(0, top) : top + height, max(0, left) : left + width]
+        return self.capture.grab(region=region)
+
+    def wait_for_stable(self, timeout=5, stable_for=0.5, tolerance=0.001):
+        """
+        Waits until the screen has stopped changing (looked the same for `stable_for` seconds), e.g. after a click.
+        Returns True once it has, or False if it's still changing after `timeout` seconds.
+        """
+        if self._background is not None and self._background.running:
+            frames = self._background.iter_frames(timeout)
+        else:
+            frames = poll_frames(self.capture, min(0.1, stable_for / 2), timeout)
+        return wait_for_stable(frames, stable_for, tolerance) is not None
 
     # We use properties here so that this code only executes when height/width are accessed for the first time
     @property
@@ -139,12 +252,14 @@ class Display:
             if active_app_only:
                 active_window = pywinctl.getActiveWindow()
                 if active_window:
-                    screenshot = pyautogui.screenshot(
-                        region=(
-                            active_window.left,
-                            active_window.top,
-                            active_window.width,
-                            active_window.height,
+                    screenshot = Image.fromarray(
+                        self._grab(
+                            region=(
+                                active_window.left,
+                                active_window.top,
+                                active_window.width,
+                                active_window.height,
+                            )
                         )
                     )
                     message = format_to_recipient(
@@ -153,12 +268,12 @@ class Display:
                     )
                     print(message)
                 else:
-                    screenshot = pyautogui.screenshot()
+                    screenshot = Image.fromarray(self._grab())
 
             else:
                 screenshot = take_screenshot_to_pil(
-                    screen=screen, combine_screens=combine_screens
-                )  #  this function uses pyautogui.screenshot which works fine for all OS (mac, linux and windows)
+                    screen=screen, combine_screens=combine_screens, grab=self._grab
+                )
                 message = format_to_recipient(
                     "Taking a screenshot of the entire screen.\n\nTo focus on the active app, use computer.display.view(active_app_only=True).",
                     "assistant",
@@ -180,19 +295,20 @@ class Display:
 
             if quadrant in quadrant_coordinates:
                 x, y = quadrant_coordinates[quadrant]
-                screenshot = pyautogui.screenshot(
-                    region=(x, y, quadrant_width, quadrant_height)
+                screenshot = Image.fromarray(
+                    self._grab(region=(x, y, quadrant_width, quadrant_height))
                 )
             else:
                 raise ValueError("Invalid quadrant. Choose between 1 and 4.")
 
         # Open the image file with PIL
         # IPython interactive mode auto-displays plots, causing RGBA handling issues, possibly MacOS-specific.
+        # (Captured frames are already RGB, and converting would copy them)
         if isinstance(screenshot, list):
             screenshot = [
-                img.convert("RGB") for img in screenshot
+                img if img.mode == "RGB" else img.convert("RGB") for img in screenshot
             ]  # if screenshot is a list (i.e combine_screens=False).
-        else:
+        elif screenshot.mode != "RGB":
             screenshot = screenshot.convert("RGB")
 
         if show:
@@ -205,66 +321,98 @@ class Display:
 
         return screenshot  # this will be a list of combine_screens == False
 
-    def find(self, description, screenshot=None):
-        if description.startswith('"') and description.endswith('"'):
-            return self.find_text(description.strip('"'), screenshot)
-        else:
-            try:
-                if self.computer.debug:
-                    print("DEBUG MODE ON")
-                    print("NUM HASHES:", len(self._hashes))
-                else:
-                    message = format_to_recipient(
-                        "Locating this icon will take ~15 seconds. Subsequent icons should be found more quickly.",
-                        recipient="user",
-                    )
-                    print(message)
+    def warmup(self, background=True):
+        """
+        Loads the local icon finding model ahead of time, so the first `find` doesn't have to wait for it.
+        """
 
-                if len(self._hashes) > 5000:
-                    self._hashes = dict(list(self._hashes.items())[-5000:])
+        def load():
+            from .point.point import warmup
 
-                from .point.point import point
+            warmup(background=False)
 
-                result = point(
-                    description, screenshot, self.computer.debug, self._hashes
-                )
+        if background:
+            thread = threading.Thread(target=load, daemon=True)
+            thread.start()
+            return thread
+        load()
 
-                return result
-            except:
-                if self.computer.debug:
-                    # We want to know these bugs lmao
-                    raise
-                if self.computer.offline:
-                    raise
+    def find(self, description, screenshot=None):
+        if description.startswith('"') and description.endswith('"'):
+            return self.find_text(description.strip('"'), screenshot)
+        if screenshot is None:
+            # The whole screen (from the background capture, if it's on), rather than point() taking its own
+            screenshot = Image.fromarray(self._grab())
+        if self.element_index is not None:
+            return self.element_index.find(
+                screenshot,
+                "icon",
+                description,
+                lambda: self._find_icon(description, screenshot),
+            )
+        return self._find_icon(description, screenshot)
+
+    def _find_icon(self, description, screenshot=None):
+        try:
+            if self.computer.debug:
+                print("DEBUG MODE ON")
+                print("NUM HASHES:", len(self._hashes))
+            else:
                 message = format_to_recipient(
-                    "Locating this icon will take ~30 seconds. We're working on speeding this up.",
+                    "Locating this icon will take ~15 seconds. Subsequent icons should be found more quickly.",
                     recipient="user",
                 )
                 print(message)
 
-                # Take a screenshot
-                if screenshot == None:
-                    screenshot = self.screenshot(show=False)
+            if len(self._hashes) > 5000:
+                self._hashes = dict(list(self._hashes.items())[-5000:])
 
-                # Downscale the screenshot to 1920x1080
-                screenshot = screenshot.resize((1920, 1080))
+            from .point.point import point
 
-                # Convert the screenshot to base64
-                buffered = BytesIO()
-                screenshot.save(buffered, format="PNG")
-                screenshot_base64 = base64.b64encode(buffered.getvalue()).decode()
+            result = point(
+                description,
+                screenshot,
+                self.computer.debug,
+                self._hashes,
+                self.analysis,
+            )
 
-                try:
-                    response = requests.post(
-                        f'{self.computer.api_base.strip("/")}/point/',
-                        json={"query": description, "base64": screenshot_base64},
-                    )
-                    return response.json()
-                except Exception as e:
-                    raise Exception(
-                        str(e)
-                        + "\n\nIcon locating API not available, or we were unable to find the icon. Please try another method to find this icon."
-                    )
+            return result
+        except:
+            if self.computer.debug:
+                # We want to know these bugs lmao
+                raise
+            if self.computer.offline:
+                raise
+            message = format_to_recipient(
+                "Locating this icon will take ~30 seconds. We're working on speeding this up.",
+                recipient="user",
+            )
+            print(message)
+
+            # Take a screenshot
+            if screenshot == None:
+                screenshot = self.screenshot(show=False)
+
+            # Downscale the screenshot to 1920x1080
+            screenshot = screenshot.resize((1920, 1080))
+
+            # Convert the screenshot to base64
+            buffered = BytesIO()
+            screenshot.save(buffered, format="PNG")
+            screenshot_base64 = base64.b64encode(buffered.getvalue()).decode()
+
+            try:
+                response = self.computer.http.post(
+                    f'{self.computer.api_base.strip("/")}/point/',
+                    json={"query": description, "base64": screenshot_base64},
+                )
+                return response.json()
+            except Exception as e:
+                raise Exception(
+                    str(e)
+                    + "\n\nIcon locating API not available, or we were unable to find the icon. Please try another method to find this icon."
+                )
 
     def find_text(self, text, screenshot=None):
         """
@@ -273,6 +421,13 @@ class Display:
         if screenshot == None:
             screenshot = self.screenshot(show=False)
 
+        if self.element_index is not None:
+            return self.element_index.find(
+                screenshot, "text", text, lambda: self._find_text(text, screenshot)
+            )
+        return self._find_text(text, screenshot)
+
+    def _find_text(self, text, screenshot):
         if not self.computer.offline:
             # Convert the screenshot to base64
             buffered = BytesIO()
@@ -280,7 +435,7 @@ class Display:
             screenshot_base64 = base64.b64encode(buffered.getvalue()).decode()
 
             try:
-                response = requests.post(
+                response = self.computer.http.post(
                     f'{self.computer.api_base.strip("/")}/point/text/',
                     json={"query": text, "base64": screenshot_base64},
                 )
@@ -292,7 +447,9 @@ class Display:
         # We'll only get here if 1) self.computer.offline = True, or the API failed
 
         # Find the text in the screenshot
-        centers = find_text_in_image(screenshot, text, self.computer.debug)
+        centers = find_text_in_image(
+            screenshot, text, self.computer.debug, analysis=self.analysis
+        )
 
         return [
             {"coordinates": center, "text": "", "similarity": 1} for center in centers
@@ -305,6 +462,16 @@ class Display:
         if screenshot == None:
             screenshot = self.screenshot(show=False, force_image=True)
 
+        if self.element_index is not None:
+            return self.element_index.find(
+                screenshot,
+                "lines",
+                None,
+                lambda: self._get_text_as_list_of_lists(screenshot),
+            )
+        return self._get_text_as_list_of_lists(screenshot)
+
+    def _get_text_as_list_of_lists(self, screenshot):
         if not self.computer.offline:
             # Convert the screenshot to base64
             buffered = BytesIO()
@@ -312,7 +479,7 @@ class Display:
             screenshot_base64 = base64.b64encode(buffered.getvalue()).decode()
 
             try:
-                response = requests.post(
+                response = self.computer.http.post(
                     f'{self.computer.api_base.strip("/")}/text/',
                     json={"base64": screenshot_base64},
                 )
@@ -324,109 +491,42 @@ class Display:
         # We'll only get here if 1) self.computer.offline = True, or the API failed
 
         try:
-            return pytesseract_get_text(screenshot)
+            return pytesseract_get_text(screenshot, self.analysis)
         except:
             raise Exception(
                 "Failed to find text locally.\n\nTo find text in order to use the mouse, please make sure you've installed `pytesseract` along with the Tesseract executable (see this Stack Overflow answer for help installing Tesseract: https://stackoverflow.com/questions/50951955/pytesseract-tesseractnotfound-error-tesseract-is-not-installed-or-its-not-i)."
             )
 
 
-def take_screenshot_to_pil(screen=0, combine_screens=True):
+def take_screenshot_to_pil(screen=0, combine_screens=True, capture=None, grab=None):
+    """
+    `grab(region)` grabs each screen (by default, `capture`'s grab, or the default capture backend's).
+    """
+    if grab is None:
+        grab = (capture or default_capture()).grab
+
     # Get information about all screens
     monitors = screeninfo.get_monitors()
     if screen == -1:  # All screens
         # Take a screenshot of each screen and save them in a list
-        screenshots = [
-            pyautogui.screenshot(
-                region=(monitor.x, monitor.y, monitor.width, monitor.height)
-            )
+        frames = [
+            grab(region=(monitor.x, monitor.y, monitor.width, monitor.height))
             for monitor in monitors
         ]
 
         if combine_screens:
-            # Combine all screenshots horizontally
-            total_width = sum([img.width for img in screenshots])
-            max_height = max([img.height for img in screenshots])
-
-            # Create a new image with a size that can contain all screenshots
-            new_img = Image.new("RGB", (total_width, max_height))
-
-            # Paste each screenshot into the new image
-            x_offset = 0
-            for i, img in enumerate(screenshots):
-                # Convert PIL Image to OpenCV Image (numpy array)
-                img_cv = np.array(img)
-                img_cv = cv2.cvtColor(img_cv, cv2.COLOR_RGB2BGR)
-
-                # Convert new_img PIL Image to OpenCV Image (numpy array)
-                new_img_cv = np.array(new_img)
-                new_img_cv = cv2.cvtColor(new_img_cv, cv2.COLOR_RGB2BGR)
-
-                # Paste each screenshot into the new image using OpenCV
-                new_img_cv[
-                    0 : img_cv.shape[0], x_offset : x_offset + img_cv.shape[1]
-                ] = img_cv
-                x_offset += img.width
-
-                # Add monitor labels using OpenCV
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                font_scale = 4
-                font_color = (255, 255, 255)
-                line_type = 2
-
-                if i == 0:
-                    text = "Primary Monitor"
-                else:
-                    text = f"Monitor {i}"
-
-                # Calculate the font scale that will fit the text perfectly in the center of the monitor
-                text_size = cv2.getTextSize(text, font, font_scale, line_type)[0]
-                font_scale = min(img.width / text_size[0], img.height / text_size[1])
-
-                # Recalculate the text size with the new font scale
-                text_size = cv2.getTextSize(text, font, font_scale, line_type)[0]
-
-                # Calculate the position to center the text
-                text_x = x_offset - img.width // 2 - text_size[0] // 2
-                text_y = max_height // 2 - text_size[1] // 2
-
-                cv2.putText(
-                    new_img_cv,
-                    text,
-                    (text_x, text_y),
-                    font,
-                    font_scale,
-                    font_color,
-                    line_type,
-                )
-
-                # Convert new_img from OpenCV Image back to PIL Image
-                new_img_cv = cv2.cvtColor(new_img_cv, cv2.COLOR_BGR2RGB)
-                new_img = Image.fromarray(new_img_cv)
-
-            return new_img
+            # Combine all screenshots horizontally, in one new image
+            labels = ["Primary Monitor"] + [
+                f"Monitor {i}" for i in range(1, len(frames))
+            ]
+            return Image.fromarray(composite_frames(frames, labels))
         else:
-            return screenshots
-    elif screen > 0:
-        # Take a screenshot of the selected screen
-        return pyautogui.screenshot(
-            region=(
-                monitors[screen].x,
-                monitors[screen].y,
-                monitors[screen].width,
-                monitors[screen].height,
-            )
-        )
-
+            return [Image.fromarray(frame) for frame in frames]
     else:
-        # Take a screenshot of the primary screen
-        return pyautogui.screenshot(
-            region=(
-                monitors[screen].x,
-                monitors[screen].y,
-                monitors[screen].width,
-                monitors[screen].height,
-            )
+        # Take a screenshot of the selected screen (0 is the primary screen)
+        monitor = monitors[screen]
+        return Image.fromarray(
+            grab(region=(monitor.x, monitor.y, monitor.width, monitor.height))
         )
 
 
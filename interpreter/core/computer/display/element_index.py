@@ -0,0 +1,89 @@
+"""
+Remembers what was found on the current screen, so clicking several things on a screen that hasn't changed doesn't
+look for each of them from scratch.
+
+Results are tied to the hash of the frame they were found in. Looking something up in a new frame (any pixel
+changed) clears the index. The OCR words, element boxes and icon embeddings behind the results are cached
+separately (the OCR cache, Display.analysis and Display._hashes), so new queries on the same screen are fast too.
+"""
+
+import copy
+import threading
+from collections import OrderedDict
+
+from ..utils.computer_vision import image_hash
+
+
+class ElementIndex:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.frame_hash = None
+        self._results = OrderedDict()  # (kind, query) -> result
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0  # How many times the screen changed
+
+    def frame(self, screenshot):
+        """
+        Makes `screenshot` the current frame, clearing the index if it's different from the last one.
+        Returns its hash.
+        """
+        key = image_hash(screenshot)
+        with self._lock:
+            if key != self.frame_hash:
+                if self.frame_hash is not None:
+                    self.invalidations += 1
+                self.frame_hash = key
+                self._results.clear()
+        return key
+
+    def lookup(self, frame_hash, kind, query):
+        """
+        Returns a copy of what was found for (kind, query) in this frame, or None.
+        """
+        with self._lock:
+            if frame_hash == self.frame_hash and (kind, query) in self._results:
+                self._results.move_to_end((kind, query))
+                self.hits += 1
+                return copy.deepcopy(self._results[(kind, query)])
+            self.misses += 1
+            return None
+
+    def store(self, frame_hash, kind, query, result):
+        with self._lock:
+            # The screen may have changed while we were looking
+            if frame_hash != self.frame_hash:
+                return
+            self._results[(kind, query)] = copy.deepcopy(result)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def find(self, screenshot, kind, query, search):
+        """
+        Returns what `search()` finds for (kind, query) in `screenshot`, from the index if it was already found
+        in this frame.
+        """
+        key = self.frame(screenshot)
+        result = self.lookup(key, kind, query)
+        if result is None:
+            result = search()
+            self.store(key, kind, query, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self.frame_hash = None
+            self._results.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": len(self._results),
+            }
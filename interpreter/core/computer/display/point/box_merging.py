@@ -0,0 +1,88 @@
+"""
+Merges overlapping bounding boxes (dicts with x, y, width and height) until none overlap.
+
+Boxes only grow when they're merged, so boxes that overlap keep overlapping, and the final groups don't depend on
+the order merges happen in. That lets us find every overlapping pair at once with a sweep line, merge them with
+union-find, and repeat only while the merged boxes overlap something new (usually one or two rounds), instead of
+comparing every box against every other on each pass.
+"""
+
+
+def boxes_overlap(a, b):
+    return (
+        a["x"] < b["x"] + b["width"]
+        and a["x"] + a["width"] > b["x"]
+        and a["y"] < b["y"] + b["height"]
+        and a["y"] + a["height"] > b["y"]
+    )
+
+
+def _overlapping_pairs(rects):
+    """
+    Yields (i, j) for every pair of overlapping (x1, y1, x2, y2) rects, sweeping left to right.
+    """
+    order = sorted(range(len(rects)), key=lambda i: rects[i][0])
+    active = []
+    for i in order:
+        x1, y1, x2, y2 = rects[i]
+        # Drop rects that end before this one starts
+        active = [j for j in active if rects[j][2] > x1]
+        for j in active:
+            other = rects[j]
+            if x1 < other[2] and x2 > other[0] and y1 < other[3] and y2 > other[1]:
+                yield i, j
+        active.append(i)
+
+
+def merge_overlapping_boxes(boxes):
+    """
+    Returns the merged boxes, in the order of their earliest input box. Each one is a copy of that box
+    with x, y, width and height covering its whole group.
+    """
+    # Each group: (index of its earliest box, x1, y1, x2, y2)
+    groups = [
+        (i, box["x"], box["y"], box["x"] + box["width"], box["y"] + box["height"])
+        for i, box in enumerate(boxes)
+    ]
+
+    while True:
+        parent = list(range(len(groups)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        merged = False
+        for i, j in _overlapping_pairs([group[1:] for group in groups]):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+                merged = True
+
+        if not merged:
+            break
+
+        combined = {}
+        for i, group in enumerate(groups):
+            root = find(i)
+            if root not in combined:
+                combined[root] = list(group)
+            else:
+                current = combined[root]
+                current[0] = min(current[0], group[0])
+                current[1] = min(current[1], group[1])
+                current[2] = min(current[2], group[2])
+                current[3] = max(current[3], group[3])
+                current[4] = max(current[4], group[4])
+        groups = sorted(tuple(group) for group in combined.values())
+
+    groups.sort()
+    merged_boxes = []
+    for first, x1, y1, x2, y2 in groups:
+        box = boxes[first].copy()
+        box["x"], box["y"] = x1, y1
+        box["width"], box["height"] = x2 - x1, y2 - y1
+        merged_boxes.append(box)
+    return merged_boxes
@@ -0,0 +1,89 @@
+"""
+A faster way to embed icons with CLIP on machines without a GPU, turned on with OI_POINT_CPU_FAST=True
+(or "auto" to turn it on only when there's no GPU).
+
+- The vision tower's linear layers are dynamically quantized to int8. Compare its speed and accuracy with full
+  precision using tests/benchmarks/bench_point_embeddings.py.
+- PyTorch uses one thread per physical core (OI_POINT_TORCH_THREADS to override), since matrix
+  multiplies don't gain from hyperthreads.
+- Crops are resized to the model's input size before they're batched, the same way CLIP's preprocessing
+  would (scale the short side, crop the center), so preprocessing works on small images.
+- Crops that can't be icons (long thin strips, tiny slivers) are dropped before they're embedded.
+
+Icons embedded this way are cached under different keys than full precision ones, so the two never mix.
+"""
+
+import os
+
+from PIL import Image, ImageOps
+
+# CLIP ViT-B/32's input size
+clip_input_size = 224
+
+
+def cpu_fast_path_enabled(device):
+    setting = os.getenv("OI_POINT_CPU_FAST", "False").lower()
+    if setting == "auto":
+        return device.type == "cpu"
+    return setting == "true"
+
+
+def tune_threads(torch):
+    """
+    Sets how many threads PyTorch uses for inference: OI_POINT_TORCH_THREADS, or one per physical core.
+    """
+    threads = os.getenv("OI_POINT_TORCH_THREADS")
+    if threads:
+        threads = int(threads)
+    else:
+        import psutil
+
+        threads = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+    return threads
+
+
+def quantize_clip(model, torch):
+    """
+    Quantizes the linear layers of a sentence-transformers CLIP model's vision tower (and its projection) to int8,
+    in place. The text tower only embeds the query, so it's left alone.
+    """
+    # sentence-transformers' CLIPModel wraps a transformers CLIPModel
+    clip = model[0].model
+    for name in ["vision_model", "visual_projection"]:
+        setattr(
+            clip,
+            name,
+            torch.ao.quantization.quantize_dynamic(
+                getattr(clip, name), {torch.nn.Linear}, dtype=torch.qint8
+            ),
+        )
+    return model
+
+
+def prepare_crops(images, size=clip_input_size):
+    """
+    Resizes each image the way CLIP's preprocessing would (the short side to `size`, then the center `size` x `size`).
+    """
+    return [
+        ImageOps.fit(image.convert("RGB"), (size, size), Image.BICUBIC)
+        for image in images
+    ]
+
+
+def prefilter_icons(icons, max_aspect=None, min_area=None):
+    """
+    Drops crops too elongated or too small to be icons, so they aren't embedded.
+    OI_POINT_MAX_ICON_ASPECT (default 4) and OI_POINT_MIN_ICON_AREA (default 200 pixels) tune it.
+    """
+    if max_aspect is None:
+        max_aspect = float(os.getenv("OI_POINT_MAX_ICON_ASPECT", "4"))
+    if min_area is None:
+        min_area = float(os.getenv("OI_POINT_MIN_ICON_AREA", "200"))
+    return [
+        icon
+        for icon in icons
+        if icon["width"] * icon["height"] >= min_area
+        and max(icon["width"], icon["height"])
+        <= max_aspect * max(1, min(icon["width"], icon["height"]))
+    ]
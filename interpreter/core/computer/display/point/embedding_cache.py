@@ -0,0 +1,272 @@
+"""
+An on-disk cache of icon embeddings, shared across sessions, so icons we've seen before don't need to go through CLIP again.
+
+Embeddings live in a memory-mapped float32 array (one row per icon); a small JSON index maps each icon's hash to its row.
+When the array is full, the least recently used rows are reused. Processes sharing the cache take turns (with a lock
+file) to change which rows are used, re-reading the index first if another process has changed it.
+"""
+
+import contextlib
+import heapq
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+default_embedding_cache_path = os.path.join(
+    os.path.expanduser("~"), ".cache", "open-interpreter", "icon_embeddings"
+)
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """
+    Holds an exclusive lock on the file at path (made if needed), so other processes wait for it.
+    """
+    with open(path, "a+b") as file:
+        if os.name == "nt":
+            import msvcrt
+
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class EmbeddingCache:
+    def __init__(self, path=None, dim=512, max_size_mb=None, flush_interval=5):
+        self.path = (
+            path
+            or os.getenv("OI_POINT_EMBEDDING_CACHE_PATH")
+            or default_embedding_cache_path
+        )
+        self.dim = dim
+        if max_size_mb is None:
+            max_size_mb = float(os.getenv("OI_POINT_EMBEDDING_CACHE_MB", "64"))
+        self.capacity = max(1, int(max_size_mb * 1024 * 1024) // (dim * 4))
+        # Seconds between writing when icons were last used, if nothing else changes (0 to write every time)
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._array = None
+        self._index = None  # icon hash -> [row, last used]
+        self._index_stamp = None  # The index file we last read or wrote, to notice other processes' changes
+        self._free_rows = []  # Unused rows below _next_row
+        self._next_row = 0  # Rows from here on have never been used
+        # Whether last used times have changed since the index was written
+        self._dirty = False
+        self._flushed = 0
+
+    @property
+    def _array_path(self):
+        return os.path.join(self.path, "embeddings.f32")
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.path, "index.json")
+
+    @property
+    def _lock_path(self):
+        return os.path.join(self.path, "lock")
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self._index_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read_index(self):
+        try:
+            with open(self._index_path, "r") as file:
+                data = json.load(file)
+            if data.get("dim") == self.dim and data.get("capacity") == self.capacity:
+                return data["index"]
+        except:
+            pass
+        return {}
+
+    def _set_index(self, index):
+        self._index = index
+        used = {entry[0] for entry in index.values()}
+        self._next_row = max(used) + 1 if used else 0
+        self._free_rows = [row for row in range(self._next_row) if row not in used]
+
+    def _open(self):
+        if self._array is not None:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        with _file_lock(self._lock_path):
+            index = self._read_index()
+            size = self.capacity * self.dim * 4
+            if not (
+                os.path.exists(self._array_path)
+                and os.path.getsize(self._array_path) == size
+            ):
+                # Missing, or written with other settings. Start over
+                index = {}
+                with open(self._array_path, "wb") as file:
+                    file.truncate(size)
+
+            self._array = np.memmap(
+                self._array_path,
+                dtype=np.float32,
+                mode="r+",
+                shape=(self.capacity, self.dim),
+            )
+            self._set_index(index)
+            self._write_index()
+
+    def _sync(self):
+        """
+        Re-reads the index if another process has written it since we last did, keeping our later last used times.
+        """
+        stamp = self._stamp()
+        if stamp == self._index_stamp:
+            return
+        index = self._read_index()
+        for icon_hash, entry in index.items():
+            ours = self._index.get(icon_hash)
+            if ours is not None and ours[0] == entry[0]:
+                entry[1] = max(entry[1], ours[1])
+        self._set_index(index)
+        self._index_stamp = stamp
+
+    def __len__(self):
+        with self._lock:
+            self._open()
+            self._sync()
+            return len(self._index)
+
+    def get_many(self, icon_hashes):
+        """
+        Returns {icon hash: embedding} for the icons we have.
+        """
+        with self._lock:
+            self._open()
+            # (So another process can't reuse a row while we read it)
+            with _file_lock(self._lock_path):
+                self._sync()
+                now = time.time()
+                found = {}
+                for icon_hash in icon_hashes:
+                    entry = self._index.get(icon_hash)
+                    if entry is not None:
+                        entry[1] = now
+                        found[icon_hash] = np.array(self._array[entry[0]])
+                if found:
+                    self._dirty = True
+                    if time.monotonic() - self._flushed >= self.flush_interval:
+                        self._write_index()
+            return found
+
+    def set_many(self, embeddings):
+        """
+        Stores {icon hash: embedding}, evicting the least recently used embeddings if we're full.
+        """
+        if not embeddings:
+            return
+
+        with self._lock:
+            self._open()
+            with _file_lock(self._lock_path):
+                # (Another process may have used rows since we last looked)
+                self._sync()
+                now = time.time()
+
+                new_hashes = [
+                    icon_hash
+                    for icon_hash in embeddings
+                    if icon_hash not in self._index
+                ]
+                available = len(self._free_rows) + self.capacity - self._next_row
+                evict = max(0, len(new_hashes) - available)
+                if evict:
+                    # (Not the ones we're about to update)
+                    oldest = heapq.nsmallest(
+                        evict,
+                        (
+                            icon_hash
+                            for icon_hash in self._index
+                            if icon_hash not in embeddings
+                        ),
+                        key=lambda icon_hash: self._index[icon_hash][1],
+                    )
+                    for icon_hash in oldest:
+                        self._free_rows.append(self._index.pop(icon_hash)[0])
+
+                for icon_hash, embedding in embeddings.items():
+                    if icon_hash in self._index:
+                        row = self._index[icon_hash][0]
+                    elif self._free_rows:
+                        row = self._free_rows.pop()
+                    elif self._next_row < self.capacity:
+                        row = self._next_row
+                        self._next_row += 1
+                    else:
+                        continue  # More new embeddings than the whole cache holds
+                    self._array[row] = np.asarray(embedding, dtype=np.float32).reshape(
+                        self.dim
+                    )
+                    self._index[icon_hash] = [row, now]
+
+                self._array.flush()
+                if (
+                    new_hashes
+                    or time.monotonic() - self._flushed >= self.flush_interval
+                ):
+                    self._write_index()
+                else:
+                    self._dirty = True  # Only last used times changed
+
+    def clear(self):
+        with self._lock:
+            self._open()
+            with _file_lock(self._lock_path):
+                self._set_index({})
+                self._write_index()
+
+    def flush(self):
+        """
+        Writes when icons were last used, if that's changed since the index was written.
+        """
+        with self._lock:
+            if self._array is None or not self._dirty:
+                return
+            with _file_lock(self._lock_path):
+                self._sync()
+                self._write_index()
+
+    def _write_index(self):
+        """
+        Writes the index. Call it holding the lock file, after _sync.
+        """
+        try:
+            # Write to a temporary file first so a concurrent reader never sees half a file
+            temp_path = f"{self._index_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as file:
+                json.dump(
+                    {"dim": self.dim, "capacity": self.capacity, "index": self._index},
+                    file,
+                )
+            os.replace(temp_path, self._index_path)
+            self._index_stamp = self._stamp()
+            self._dirty = False
+            self._flushed = time.monotonic()
+        except:
+            # Non blocking
+            pass
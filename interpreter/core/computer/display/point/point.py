@@ -2,26 +2,82 @@ import hashlib
 import io
 import os
 import subprocess
+import threading
 from typing import List
 
 import cv2
-import nltk
 import numpy as np
 import torch
 from PIL import Image, ImageDraw, ImageEnhance, ImageFont
-from sentence_transformers import SentenceTransformer, util
 
 from .....terminal_interface.utils.oi_dir import oi_dir
+from ....utils.model_registry import model_registry
 from ...utils.computer_vision import pytesseract_get_text_bounding_boxes
+from .box_merging import merge_overlapping_boxes
+from .cpu_inference import (
+    cpu_fast_path_enabled,
+    prefilter_icons,
+    prepare_crops,
+    quantize_clip,
+    tune_threads,
+)
+from .embedding_cache import EmbeddingCache
 
-try:
-    nltk.corpus.words.words()
-except LookupError:
-    nltk.download("words", quiet=True)
-from nltk.corpus import words
+# The CLIP model and the English word list are slow to load, so we only load them when they're first needed.
+# The model is shared with the rest of the process through the model registry
+_english_words = None
+_load_lock = threading.Lock()
 
-# Create a set of English words
-english_words = set(words.words())
+embedding_cache = EmbeddingCache()
+
+
+def get_english_words():
+    global _english_words
+    if _english_words is None:
+        with _load_lock:
+            if _english_words is None:
+                import nltk
+
+                try:
+                    nltk.corpus.words.words()
+                except LookupError:
+                    nltk.download("words", quiet=True)
+                from nltk.corpus import words
+
+                # Create a set of English words
+                _english_words = set(words.words())
+    return _english_words
+
+
+def get_model():
+    if fast_model and cpu_fast_path_enabled(device):
+        return model_registry.get("clip-int8")
+    return model_registry.get("clip")
+
+
+def embedding_key(key):
+    """
+    Quantized embeddings are a little different from full precision ones, so they're cached separately.
+    """
+    if fast_model and cpu_fast_path_enabled(device):
+        return key + ":int8"
+    return key
+
+
+def warmup(background=True):
+    """
+    Loads the CLIP model and word list ahead of time, so the first `point` call doesn't have to wait for them.
+    """
+
+    def load():
+        get_english_words()
+        get_model()
+
+    if background:
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        return thread
+    load()
 
 
 def take_screenshot_to_pil(filename="temp_screenshot.png"):
@@ -42,14 +98,16 @@ def take_screenshot_to_pil(filename="temp_screenshot.png"):
 from ...utils.computer_vision import find_text_in_image
 
 
-def point(description, screenshot=None, debug=False, hashes=None):
+def point(description, screenshot=None, debug=False, hashes=None, analysis=None):
     if description.startswith('"') and description.endswith('"'):
-        return find_text_in_image(description.strip('"'), screenshot, debug)
+        return find_text_in_image(
+            screenshot, description.strip('"'), debug, analysis=analysis
+        )
     else:
-        return find_icon(description, screenshot, debug, hashes)
+        return find_icon(description, screenshot, debug, hashes, analysis)
 
 
-def find_icon(description, screenshot=None, debug=False, hashes=None):
+def find_icon(description, screenshot=None, debug=False, hashes=None, analysis=None):
     if debug:
         print("STARTING")
     if screenshot == None:
@@ -68,7 +126,16 @@ def find_icon(description, screenshot=None, debug=False, hashes=None):
     #     temp_image_path = temp_file.name
     #   print("yeah took", time.time()-thetime)
 
-    icons_bounding_boxes = get_element_boxes(image_data, debug)
+    if analysis is not None:
+        # Only look for elements in the parts of the screen that changed since the last frame
+        icons_bounding_boxes = analysis.run(
+            "elements",
+            image_data,
+            lambda region: get_element_boxes(region, debug),
+            keys=("x", "y"),
+        )
+    else:
+        icons_bounding_boxes = get_element_boxes(image_data, debug)
 
     if debug:
         print("GOT ICON BOUNDING BOXES")
@@ -131,7 +198,7 @@ def find_icon(description, screenshot=None, debug=False, hashes=None):
     if debug:
         print("GETTING TEXT")
 
-    response = pytesseract_get_text_bounding_boxes(screenshot)
+    response = pytesseract_get_text_bounding_boxes(image_data, analysis)
 
     if debug:
         print("GOT TEXT, processing it")
@@ -160,6 +227,7 @@ def find_icon(description, screenshot=None, debug=False, hashes=None):
     ]  # icons are sometimes text, like "X"
 
     # Filter blocks so the text.lower() needs to be a real word in the English dictionary
+    english_words = get_english_words()
     filtered_blocks = []
     for b in blocks:
         words = b["text"].lower().split()
@@ -339,44 +407,8 @@ def find_icon(description, screenshot=None, debug=False, hashes=None):
             os.path.join(debug_path, "debug_image_after_expanding_boxes.png")
         )
 
-    def combine_boxes(icons_bounding_boxes):
-        while True:
-            combined_boxes = []
-            for box in icons_bounding_boxes:
-                for i, combined_box in enumerate(combined_boxes):
-                    if (
-                        box["x"] < combined_box["x"] + combined_box["width"]
-                        and box["x"] + box["width"] > combined_box["x"]
-                        and box["y"] < combined_box["y"] + combined_box["height"]
-                        and box["y"] + box["height"] > combined_box["y"]
-                    ):
-                        combined_box["x"] = min(box["x"], combined_box["x"])
-                        combined_box["y"] = min(box["y"], combined_box["y"])
-                        combined_box["width"] = (
-                            max(
-                                box["x"] + box["width"],
-                                combined_box["x"] + combined_box["width"],
-                            )
-                            - combined_box["x"]
-                        )
-                        combined_box["height"] = (
-                            max(
-                                box["y"] + box["height"],
-                                combined_box["y"] + combined_box["height"],
-                            )
-                            - combined_box["y"]
-                        )
-                        break
-                else:
-                    combined_boxes.append(box.copy())
-            if len(combined_boxes) == len(icons_bounding_boxes):
-                break
-            else:
-                icons_bounding_boxes = combined_boxes
-        return combined_boxes
-
     if os.getenv("OI_POINT_OVERLAP", "True") == "True":
-        icons_bounding_boxes = combine_boxes(icons_bounding_boxes)
+        icons_bounding_boxes = merge_overlapping_boxes(icons_bounding_boxes)
 
     if debug:
         image_data_copy = image_data.copy()
@@ -405,7 +437,7 @@ def find_icon(description, screenshot=None, debug=False, hashes=None):
         icon["height"] = h
 
         icon_image_hash = hashlib.sha256(icon_image.tobytes()).hexdigest()
-        icon["hash"] = icon_image_hash
+        icon["hash"] = embedding_key(icon_image_hash)
 
         # Calculate the relative central xy coordinates of the bounding box
         center_x = box["center_x"] / image_width  # Relative X coordinate
@@ -424,6 +456,10 @@ def find_icon(description, screenshot=None, debug=False, hashes=None):
         desktop = os.path.join(os.path.join(os.path.expanduser("~")), "Desktop")
         image_data_copy.save(os.path.join(desktop, "point_vision.png"))
 
+    if fast_model and cpu_fast_path_enabled(device):
+        # Don't spend time embedding crops that can't be icons
+        icons = prefilter_icons(icons) or icons
+
     if "icon" not in description.lower():
         description += " icon"
 
@@ -441,98 +477,129 @@ def find_icon(description, screenshot=None, debug=False, hashes=None):
     return coordinates
 
 
-# torch.set_num_threads(4)
-
 fast_model = True
 
-# First, we load the respective CLIP model
-model = SentenceTransformer("clip-ViT-B-32")
+if torch.cuda.is_available():
+    device = torch.device("cuda")
+elif torch.backends.mps.is_available():
+    device = torch.device("mps")
+else:
+    device = torch.device("cpu")
 
 
-import os
+def load_model(quantize=False):
+    """
+    Loads the icon embedding model. `quantize` loads the int8 CPU version (see cpu_inference.py).
+    """
+    global transforms
 
-import timm
+    if fast_model:
+        from sentence_transformers import SentenceTransformer
 
-if fast_model == False:
-    # Check if the model file exists
-    if not os.path.isfile(model_path):
-        # If not, create and save the model
-        model = timm.create_model(
-            "vit_base_patch16_siglip_224",
-            pretrained=True,
-            num_classes=0,
-        )
-        model = model.eval()
-        torch.save(model.state_dict(), model_path)
+        # First, we load the respective CLIP model
+        model = SentenceTransformer("clip-ViT-B-32")
+        if quantize:
+            tune_threads(torch)
+            return quantize_clip(model.to("cpu"), torch)
     else:
-        # If the model file exists, load the model from the saved state
-        model = timm.create_model(
-            "vit_base_patch16_siglip_256",
-            pretrained=False,  # Don't load pretrained weights
-            num_classes=0,
-        )
-        model.load_state_dict(torch.load(model_path))
-        model = model.eval()
-
-    # get model specific transforms (normalization, resize)
-    data_config = timm.data.resolve_model_data_config(model)
-    transforms = timm.data.create_transform(**data_config, is_training=False)
+        import timm
+
+        # Check if the model file exists
+        if not os.path.isfile(model_path):
+            # If not, create and save the model
+            model = timm.create_model(
+                "vit_base_patch16_siglip_224",
+                pretrained=True,
+                num_classes=0,
+            )
+            model = model.eval()
+            torch.save(model.state_dict(), model_path)
+        else:
+            # If the model file exists, load the model from the saved state
+            model = timm.create_model(
+                "vit_base_patch16_siglip_256",
+                pretrained=False,  # Don't load pretrained weights
+                num_classes=0,
+            )
+            model.load_state_dict(torch.load(model_path))
+            model = model.eval()
 
-    def embed_images(images: List[Image.Image], model, transforms):
-        # Stack images along the batch dimension
-        image_batch = torch.stack([transforms(image) for image in images])
-        # Get embeddings
-        embeddings = model(image_batch)
-        return embeddings
+        # get model specific transforms (normalization, resize)
+        data_config = timm.data.resolve_model_data_config(model)
+        transforms = timm.data.create_transform(**data_config, is_training=False)
 
-    # Usage:
-    # images = [Image.open(io.BytesIO(image_bytes1)), Image.open(io.BytesIO(image_bytes2)), ...]
-    # embeddings = embed_images(images, model, transforms)
+    # Move the model to the specified device
+    return model.to(device)
 
 
-if torch.cuda.is_available():
-    device = torch.device("cuda")
-elif torch.backends.mps.is_available():
-    device = torch.device("mps")
-else:
-    device = torch.device("cpu")
-
-# Move the model to the specified device
-model = model.to(device)
+def embed_images(images: List[Image.Image], model, transforms):
+    # Stack images along the batch dimension
+    image_batch = torch.stack([transforms(image) for image in images])
+    # Get embeddings
+    embeddings = model(image_batch)
+    return embeddings
 
 
 def image_search(query, icons, hashes, debug):
-    hashed_icons = [icon for icon in icons if icon["hash"] in hashes]
-    unhashed_icons = [icon for icon in icons if icon["hash"] not in hashes]
+    if not icons:
+        return []
 
-    # Embed the unhashed icons
-    if fast_model:
-        query_and_unhashed_icons_embeds = model.encode(
-            [query] + [icon["data"] for icon in unhashed_icons],
-            batch_size=128,
-            convert_to_tensor=True,
-            show_progress_bar=debug,
-        )
-    else:
-        query_and_unhashed_icons_embeds = embed_images(
-            [query] + [icon["data"] for icon in unhashed_icons], model, transforms
-        )
+    from sentence_transformers import util
 
-    query_embed = query_and_unhashed_icons_embeds[0]
-    unhashed_icons_embeds = query_and_unhashed_icons_embeds[1:]
+    # The query's embedding is cached too, so a repeated lookup doesn't need the model at all
+    query_hash = embedding_key("query:" + hashlib.sha256(query.encode()).hexdigest())
 
-    # Store hashes for unhashed icons
-    for icon, emb in zip(unhashed_icons, unhashed_icons_embeds):
-        hashes[icon["hash"]] = emb
+    # Icons we've embedded before, in this session (hashes) or a previous one (embedding_cache)
+    cached = embedding_cache.get_many(
+        [query_hash] + [icon["hash"] for icon in icons if icon["hash"] not in hashes]
+    )
+    query_embed = cached.pop(query_hash, None)
+    if query_embed is not None:
+        query_embed = torch.from_numpy(query_embed).to(device)
+    for icon_hash, emb in cached.items():
+        hashes[icon_hash] = torch.from_numpy(emb).to(device)
+    for icon in icons:
+        if icon["hash"] in hashes:
+            # Keep recently used embeddings at the end, so Display trims the oldest
+            hashes[icon["hash"]] = hashes.pop(icon["hash"])
 
-    # Move tensors to the specified device before concatenating
-    unhashed_icons_embeds = unhashed_icons_embeds.to(device)
+    unhashed_icons = [icon for icon in icons if icon["hash"] not in hashes]
+    icon_images = [icon["data"] for icon in unhashed_icons]
+    if fast_model and cpu_fast_path_enabled(device):
+        icon_images = prepare_crops(icon_images)
+    inputs = ([query] if query_embed is None else []) + icon_images
+
+    # Embed the query (if needed) and the unhashed icons
+    if inputs:
+        model = get_model()
+        if fast_model:
+            embeds = model.encode(
+                inputs,
+                batch_size=128,
+                convert_to_tensor=True,
+                show_progress_bar=debug,
+            )
+        else:
+            embeds = embed_images(inputs, model, transforms)
+        embeds = embeds.to(device)
+
+        new_embeds = {}
+        if query_embed is None:
+            query_embed = embeds[0]
+            embeds = embeds[1:]
+            new_embeds[query_hash] = query_embed
+
+        # Store hashes for unhashed icons
+        for icon, emb in zip(unhashed_icons, embeds):
+            hashes[icon["hash"]] = emb
+            new_embeds[icon["hash"]] = emb
+
+        embedding_cache.set_many(
+            {key: emb.detach().cpu().numpy() for key, emb in new_embeds.items()}
+        )
 
-    # Include hashed icons in img_emb
-    img_emb = torch.cat(
-        [unhashed_icons_embeds]
-        + [hashes[icon["hash"]].unsqueeze(0) for icon in hashed_icons]
-    )
+    # In the same order as icons, so corpus_id below indexes into icons
+    img_emb = torch.stack([hashes[icon["hash"]] for icon in icons])
 
     # Perform semantic search
     hits = util.semantic_search(query_embed, img_emb)[0]
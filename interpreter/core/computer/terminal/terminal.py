@@ -2,6 +2,7 @@ import json
 import os
 import time
 
+from ...utils.metrics import code_execution_seconds
 from ..utils.recipient_utils import parse_for_recipient
 from .languages.applescript import AppleScript
 from .languages.html import HTML
@@ -129,6 +130,7 @@ class Terminal:
                 self._active_languages[language] = lang_class(self.computer)
             else:
                 self._active_languages[language] = lang_class()
+        started = time.perf_counter()
         try:
             for chunk in self._active_languages[language].run(code):
                 # self.format_to_recipient can format some messages as having a certain recipient.
@@ -159,6 +161,10 @@ class Terminal:
 
         except GeneratorExit:
             self.stop()
+        finally:
+            code_execution_seconds.observe(
+                time.perf_counter() - started, language=language
+            )
 
     def stop(self):
         for language in self._active_languages.values():
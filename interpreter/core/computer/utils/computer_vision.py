@@ -1,4 +1,9 @@
+import hashlib
 import io
+import itertools
+import os
+import threading
+from collections import OrderedDict
 
 from ...utils.lazy_import import lazy_import
 
@@ -8,29 +13,169 @@ try:
     cv2 = lazy_import("cv2")
 except:
     cv2 = None  # Fixes colab error
-PIL = lazy_import("PIL")
 pytesseract = lazy_import("pytesseract")
 
+# OCR results for recent frames, keyed by image hash. Finding text, finding icons and reading the screen
+# often look at the same frame, and Tesseract takes seconds on a large screen
+ocr_cache_max_entries = 16
+ocr_cache_max_bytes = 16 * 1024 * 1024
+# Hash -> [tesseract data, approximate size in bytes, text index]
+_ocr_cache = OrderedDict()
+_ocr_cache_lock = threading.Lock()
+
+
+def image_hash(img):
+    """
+    A hash of the image's pixels (and size / mode), used to recognize a frame we've already processed.
+    """
+    # (np.asarray copies the pixels out about twice as fast as tobytes, and sha256 is hardware accelerated on most CPUs)
+    digest = hashlib.sha256(np.ascontiguousarray(np.asarray(img)))
+    digest.update(f"{img.size}{img.mode}".encode())
+    return digest.hexdigest()[:32]
+
+
+def _to_grayscale(img):
+    if cv2 is not None and img.mode == "RGB":
+        return cv2.cvtColor(np.array(img), cv2.COLOR_BGR2GRAY)
+    return np.array(img.convert("L"))
+
+
+tesseract_data_keys = [
+    "level",
+    "page_num",
+    "block_num",
+    "par_num",
+    "line_num",
+    "word_num",
+    "left",
+    "top",
+    "width",
+    "height",
+    "conf",
+    "text",
+]
+_block_offsets = itertools.count(1)
+
+
+def _tesseract_boxes(img, words_only=False):
+    """
+    Runs Tesseract, returning a dict per box. Block numbers are made unique across calls, so results from
+    different parts of the screen can be merged.
+    """
+    data = pytesseract.image_to_data(
+        _to_grayscale(img), output_type=pytesseract.Output.DICT
+    )
+    offset = next(_block_offsets) * 10000
+    boxes = []
+    for values in zip(*data.values()):
+        box = dict(zip(data.keys(), values))
+        if words_only and box.get("level") != 5:
+            continue
+        if "block_num" in box:
+            box["block_num"] += offset
+        boxes.append(box)
+    return boxes
 
-def pytesseract_get_text(img):
-    # List the attributes of pytesseract, which will trigger lazy loading of it
-    attributes = dir(pytesseract)
+
+def _boxes_to_data(boxes):
+    """
+    Turns a list of box dicts back into image_to_data's dict of lists, with blocks in reading order.
+    """
+    blocks = {}
+    for box in boxes:
+        blocks.setdefault(box.get("block_num", 0), []).append(box)
+    ordered = sorted(
+        blocks.values(), key=lambda block: (block[0]["top"], block[0]["left"])
+    )
+
+    keys = list(boxes[0].keys()) if boxes else tesseract_data_keys
+    data = {key: [] for key in keys}
+    for block in ordered:
+        for box in block:
+            for key in keys:
+                data[key].append(box.get(key))
+    return data
+
+
+def _ocr_entry(img, analysis=None):
+    """
+    Returns this frame's cache entry, [tesseract data, size, text index], running Tesseract if we haven't seen it.
+    The data is shared, so callers must not modify it.
+    """
     if pytesseract == None:
         raise ImportError("The pytesseract module could not be imported.")
 
-    result = pytesseract.image_to_string(img)
-    return result
+    key = image_hash(img)
+    with _ocr_cache_lock:
+        if key in _ocr_cache:
+            _ocr_cache.move_to_end(key)
+            return _ocr_cache[key]
 
+    # Use pytesseract to get the data from the image
+    if analysis is not None:
+        # Just the words: page, block and line boxes span regions that didn't change
+        boxes = analysis.run(
+            "ocr", img, lambda region: _tesseract_boxes(region, words_only=True)
+        )
+    else:
+        boxes = _tesseract_boxes(img)
+    data = _boxes_to_data(boxes)
+
+    size = sum(len(str(value)) + 8 for values in data.values() for value in values)
+    entry = [data, size, None]
+    with _ocr_cache_lock:
+        _ocr_cache[key] = entry
+        total = sum(entry[1] for entry in _ocr_cache.values())
+        while len(_ocr_cache) > 1 and (
+            len(_ocr_cache) > ocr_cache_max_entries or total > ocr_cache_max_bytes
+        ):
+            total -= _ocr_cache.popitem(last=False)[1][1]
+
+    return entry
+
+
+def pytesseract_get_data(img, analysis=None):
+    """
+    Returns pytesseract's image_to_data dict (one entry per box, in lists) for this image.
+    Runs Tesseract once per frame; later calls with the same pixels get a copy of the cached result.
+
+    If `analysis` (an IncrementalAnalysis) is passed, only the parts of the screen that changed since its last frame are OCR'd.
+    """
+    data = _ocr_entry(img, analysis)[0]
+    return {name: list(values) for name, values in data.items()}
+
+
+def clear_ocr_cache():
+    with _ocr_cache_lock:
+        _ocr_cache.clear()
+
+
+def pytesseract_get_text(img, analysis=None):
+    """
+    Returns the image's text, a line per line of text and a blank line between blocks.
+    """
+    d = pytesseract_get_data(img, analysis)
+
+    lines = []
+    last_line = None
+    for i in range(len(d["text"])):
+        text = d["text"][i].strip()
+        if not text:
+            continue
+        line = (d["block_num"][i], d["par_num"][i], d["line_num"][i])
+        if last_line is not None and line == last_line:
+            lines[-1] += " " + text
+        else:
+            if last_line is not None and line[0] != last_line[0]:
+                lines.append("")
+            lines.append(text)
+        last_line = line
 
-def pytesseract_get_text_bounding_boxes(img):
-    # Convert PIL Image to NumPy array
-    img_array = np.array(img)
+    return "\n".join(lines)
 
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
 
-    # Use pytesseract to get the data from the image
-    d = pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT)
+def pytesseract_get_text_bounding_boxes(img, analysis=None):
+    d = pytesseract_get_data(img, analysis)
 
     # Create an empty list to hold dictionaries for each bounding box
     boxes = []
@@ -51,163 +196,200 @@ def pytesseract_get_text_bounding_boxes(img):
     return boxes
 
 
-def find_text_in_image(img, text, debug=False):
-    # Convert PIL Image to NumPy array
-    img_array = np.array(img)
-
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
-
-    # Use pytesseract to get the data from the image
-    d = pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT)
-
-    # Initialize an empty list to store the centers of the bounding boxes
-    centers = []
-
-    # Get the number of detected boxes
-    n_boxes = len(d["level"])
-
-    # Create a copy of the grayscale image to draw on
-    img_draw = np.array(gray.copy())
-
-    # Convert the img_draw grayscale image to RGB
-    img_draw = cv2.cvtColor(img_draw, cv2.COLOR_GRAY2RGB)
-
-    id = 0
-
-    # Loop through each box
-    for i in range(n_boxes):
-        if debug:
-            # (DEBUGGING) Draw each box on the grayscale image
-            cv2.rectangle(
-                img_draw,
-                (d["left"][i], d["top"][i]),
-                (d["left"][i] + d["width"][i], d["top"][i] + d["height"][i]),
-                (0, 255, 0),
-                2,
-            )
-            # Draw the detected text in the rectangle in small font
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 0.5
-            font_color = (0, 0, 255)
-            line_type = 2
-
-            cv2.putText(
-                img_draw,
-                d["text"][i],
-                (d["left"][i], d["top"][i] - 10),
-                font,
-                font_scale,
-                font_color,
-                line_type,
-            )
-
-        # Print the text of the box
-        # If the text in the box matches the given text
-        if text.lower() in d["text"][i].lower():
-            # Find the start index of the matching text in the box
-            start_index = d["text"][i].lower().find(text.lower())
-            # Calculate the percentage of the box width that the start of the matching text represents
-            start_percentage = start_index / len(d["text"][i])
-            # Move the left edge of the box to the right by this percentage of the box width
-            d["left"][i] = d["left"][i] + int(d["width"][i] * start_percentage)
-
-            # Calculate the width of the matching text relative to the entire text in the box
-            text_width_percentage = len(text) / len(d["text"][i])
-            # Adjust the width of the box to match the width of the matching text
-            d["width"][i] = int(d["width"][i] * text_width_percentage)
-
-            # Calculate the center of the bounding box
-            center = (
-                d["left"][i] + d["width"][i] / 2,
-                d["top"][i] + d["height"][i] / 2,
-            )
-
-            # Add the center to the list
-            centers.append(center)
-
-            # Draw the bounding box on the image in red and make it slightly larger
-            larger = 10
-            cv2.rectangle(
-                img_draw,
-                (d["left"][i] - larger, d["top"][i] - larger),
-                (
-                    d["left"][i] + d["width"][i] + larger,
-                    d["top"][i] + d["height"][i] + larger,
-                ),
-                (255, 0, 0),
-                7,
-            )
-
-            # Create a small black square background for the ID
-            cv2.rectangle(
-                img_draw,
-                (
-                    d["left"][i] + d["width"][i] // 2 - larger * 2,
-                    d["top"][i] + d["height"][i] // 2 - larger * 2,
-                ),
-                (
-                    d["left"][i] + d["width"][i] // 2 + larger * 2,
-                    d["top"][i] + d["height"][i] // 2 + larger * 2,
-                ),
-                (0, 0, 0),
-                -1,
-            )
-
-            # Put the ID in the center of the bounding box in red
-            cv2.putText(
-                img_draw,
-                str(id),
-                (
-                    d["left"][i] + d["width"][i] // 2 - larger,
-                    d["top"][i] + d["height"][i] // 2 + larger,
-                ),
-                cv2.FONT_HERSHEY_DUPLEX,
-                1,
-                (255, 155, 155),
-                4,
-            )
-
-            # Increment id
-            id += 1
+def text_index(d):
+    """
+    Indexes pytesseract data for matching: the lowercase words joined into one string (a space between words
+    on the same line, a newline between lines), the offset each word starts at, and each word's box index.
+    """
+    lines = None
+    if all(key in d for key in ["block_num", "par_num", "line_num"]):
+        lines = list(zip(d["block_num"], d["par_num"], d["line_num"]))
+
+    pieces, starts, boxes = [], [], []
+    offset = 0
+    for i, text in enumerate(d["text"]):
+        word = str(text).strip().lower()
+        if not word:
+            continue
+        if boxes:
+            same_line = lines is not None and lines[i] == lines[boxes[-1]]
+            pieces.append(" " if same_line else "\n")
+            offset += 1
+        pieces.append(word)
+        starts.append(offset)
+        boxes.append(i)
+        offset += len(word)
+
+    return (
+        "".join(pieces),
+        np.array(starts, dtype=np.int64),
+        np.array(boxes, dtype=np.int64),
+    )
+
+
+def _find_words(index, query):
+    """
+    Returns (first word, last word, offset into the first word) for each place `query` appears, at most once per word.
+    """
+    joined, starts, _ = index
+    positions = []
+    position = joined.find(query)
+    while position != -1:
+        positions.append(position)
+        position = joined.find(query, position + 1)
+    if not positions:
+        return []
+
+    positions = np.array(positions, dtype=np.int64)
+    firsts = np.searchsorted(starts, positions, side="right") - 1
+    lasts = np.searchsorted(starts, positions + len(query) - 1, side="right") - 1
+    # Like str.find, keep the first match in each word
+    _, unique = np.unique(firsts, return_index=True)
+    return list(
+        zip(firsts[unique], lasts[unique], positions[unique] - starts[firsts[unique]])
+    )
+
+
+def match_text(d, text, index=None):
+    """
+    Finds `text` (case insensitive) in pytesseract data, returning a (left, top, width, height) box per match.
+
+    A single word matches inside any box, with the box narrowed to the matching part. A phrase matches across
+    adjacent words on the same line, with the box spanning them.
+    """
+    query = " ".join(text.lower().split())
+    if not query:
+        return []
+    if index is None:
+        index = text_index(d)
+    boxes = index[2]
+
+    matches = []
+    for first, last, offset in _find_words(index, query):
+        covered = boxes[first : last + 1]
+        if first == last:
+            # Narrow the box to the part of its text that matched
+            i = covered[0]
+            length = len(str(d["text"][i]).strip())
+            left = d["left"][i] + int(d["width"][i] * offset / length)
+            width = int(d["width"][i] * len(query) / length)
+            matches.append((left, d["top"][i], width, d["height"][i]))
+        else:
+            left = min(d["left"][i] for i in covered)
+            top = min(d["top"][i] for i in covered)
+            right = max(d["left"][i] + d["width"][i] for i in covered)
+            bottom = max(d["top"][i] + d["height"][i] for i in covered)
+            matches.append((left, top, right - left, bottom - top))
+    return matches
+
+
+def _nearby_words(d, text, index=None, max_distance=400):
+    """
+    If the words of `text` weren't found together, looks for two of them found near each other,
+    returning the center between them.
+    """
+    if index is None:
+        index = text_index(d)
+    boxes = index[2]
+
+    found = [
+        boxes[first]
+        for word in text.lower().split()
+        for first, _, _ in _find_words(index, word)
+    ]
+    if len(found) < 2:
+        return []
+    found = np.array(found)
+    centers = np.array(
+        [
+            np.array(d["left"])[found] + np.array(d["width"])[found] / 2,
+            np.array(d["top"])[found] + np.array(d["height"])[found] / 2,
+        ]
+    ).T
+
+    # The first center with another (different) center close enough
+    for center in centers:
+        close = (np.linalg.norm(centers - center, axis=1) <= max_distance) & (
+            centers != center
+        ).any(axis=1)
+        if close.any():
+            other = centers[np.argmax(close)]
+            return [tuple(((center + other) / 2).tolist())]
+    return []
+
+
+def draw_text_matches(img, d, matches):
+    """
+    Returns a copy of the image with every OCR box and its text in green, and the matches numbered in red.
+    """
+    from PIL import ImageDraw, ImageFont
+
+    debug_image = img.convert("RGB")
+    draw = ImageDraw.Draw(debug_image)
+    font = ImageFont.load_default()
+
+    for left, top, width, height, text in zip(
+        d["left"], d["top"], d["width"], d["height"], d["text"]
+    ):
+        draw.rectangle([(left, top), (left + width, top + height)], outline="green")
+        draw.text((left, top - 10), str(text), fill="blue", font=font)
+
+    larger = 10
+    for id, (left, top, width, height) in enumerate(matches):
+        draw.rectangle(
+            [
+                (left - larger, top - larger),
+                (left + width + larger, top + height + larger),
+            ],
+            outline="red",
+            width=7,
+        )
+        center_x, center_y = left + width // 2, top + height // 2
+        draw.rectangle(
+            [
+                (center_x - larger * 2, center_y - larger * 2),
+                (center_x + larger * 2, center_y + larger * 2),
+            ],
+            fill="black",
+        )
+        draw.text(
+            (center_x - larger, center_y - larger), str(id), fill="red", font=font
+        )
+
+    return debug_image
+
+
+def find_text_in_image(img, text, debug=False, analysis=None):
+    """
+    Returns the center of each place `text` appears in the image, relative to the image's size (0 to 1).
+
+    With `debug`, saves the OCR boxes and matches to ~/Desktop/oi-debug/find_text_in_image.png.
+    """
+    # Use pytesseract to get the data from the image (or the cached data, if we've seen this frame).
+    # The text index is kept with it, so each query on the same frame is just a string search
+    entry = _ocr_entry(img, analysis)
+    d = entry[0]
+    if entry[2] is None:
+        entry[2] = text_index(d)
+    index = entry[2]
+
+    matches = match_text(d, text, index)
+    centers = [
+        (left + width / 2, top + height / 2) for left, top, width, height in matches
+    ]
 
     if not centers:
-        word_centers = []
-        for word in text.split():
-            for i in range(n_boxes):
-                if word.lower() in d["text"][i].lower():
-                    center = (
-                        d["left"][i] + d["width"][i] / 2,
-                        d["top"][i] + d["height"][i] / 2,
-                    )
-                    center = (center[0] / 2, center[1] / 2)
-                    word_centers.append(center)
-
-        for center1 in word_centers:
-            for center2 in word_centers:
-                if (
-                    center1 != center2
-                    and (
-                        (center1[0] - center2[0]) ** 2 + (center1[1] - center2[1]) ** 2
-                    )
-                    ** 0.5
-                    <= 400
-                ):
-                    centers.append(
-                        ((center1[0] + center2[0]) / 2, (center1[1] + center2[1]) / 2)
-                    )
-                    break
-            if centers:
-                break
-
-    bounding_box_image = PIL.Image.fromarray(img_draw)
-    bounding_box_image.format = img.format
+        centers = _nearby_words(d, text, index)
+
+    if debug:
+        debug_path = os.path.join(os.path.expanduser("~"), "Desktop", "oi-debug")
+        os.makedirs(debug_path, exist_ok=True)
+        draw_text_matches(img, d, matches).save(
+            os.path.join(debug_path, "find_text_in_image.png")
+        )
 
     # Convert centers to relative
     img_width, img_height = img.size
     centers = [(x / img_width, y / img_height) for x, y in centers]
 
-    # Debug by showing bounding boxes:
-    # bounding_box_image.show()
-
     return centers
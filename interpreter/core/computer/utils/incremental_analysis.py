@@ -0,0 +1,198 @@
+"""
+Re-analyzes only the parts of the screen that changed since the last frame.
+
+In OS mode we screenshot after almost every action, but usually only a menu or a text field changed. For each kind
+of analysis (OCR words, element boxes...) we keep the last frame and its boxes, diff the new frame in tiles, run the
+analysis on the changed regions only, and merge the new boxes with the old boxes outside those regions.
+"""
+
+import threading
+
+from ...utils.lazy_import import lazy_import
+from ..display.point.box_merging import merge_overlapping_boxes
+
+np = lazy_import("numpy")
+
+
+def changed_tiles(previous, current, tile_size):
+    """
+    Returns a (rows, columns) boolean array, True where the tile differs between the two frames (arrays of the same shape).
+    """
+    height, width = current.shape[:2]
+    rows, columns = -(-height // tile_size), -(-width // tile_size)
+
+    diff = previous != current
+    if height % tile_size or width % tile_size:
+        # Pad to whole tiles
+        padded = np.zeros(
+            (rows * tile_size, columns * tile_size) + diff.shape[2:], dtype=bool
+        )
+        padded[:height, :width] = diff
+        diff = padded
+
+    # Reduce along contiguous memory first (each tile row, channels included), which is much faster
+    # than reducing over the tile's two axes at once
+    diff = diff.reshape(rows * tile_size, columns, -1).any(axis=2)
+    return diff.reshape(rows, tile_size, columns).any(axis=1)
+
+
+def dirty_regions(tiles, tile_size, width, height, margin=0):
+    """
+    Groups touching changed tiles into (left, top, right, bottom) pixel regions, grown by `margin` and clipped to the frame.
+    """
+    rows, columns = tiles.shape
+    seen = np.zeros_like(tiles)
+    regions = []
+    for row, column in zip(*np.nonzero(tiles)):
+        if seen[row, column]:
+            continue
+        # Flood fill this group of tiles, tracking its extent
+        stack = [(row, column)]
+        seen[row, column] = True
+        top, left, bottom, right = row, column, row, column
+        while stack:
+            r, c = stack.pop()
+            top, left = min(top, r), min(left, c)
+            bottom, right = max(bottom, r), max(right, c)
+            for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                if 0 <= nr < rows and 0 <= nc < columns:
+                    if tiles[nr, nc] and not seen[nr, nc]:
+                        seen[nr, nc] = True
+                        stack.append((nr, nc))
+        regions.append(
+            (
+                max(0, left * tile_size - margin),
+                max(0, top * tile_size - margin),
+                min(width, (right + 1) * tile_size + margin),
+                min(height, (bottom + 1) * tile_size + margin),
+            )
+        )
+    return regions
+
+
+def _box_rects(boxes, keys):
+    """
+    Returns an (n, 4) array of the boxes' (left, top, right, bottom).
+    """
+    x_key, y_key = keys
+    rects = np.array(
+        [
+            (
+                box[x_key],
+                box[y_key],
+                box[x_key] + box["width"],
+                box[y_key] + box["height"],
+            )
+            for box in boxes
+        ],
+        dtype=float,
+    )
+    return rects.reshape(-1, 4)
+
+
+def _intersecting(rects, region):
+    """
+    Returns a boolean mask of the rects that overlap the (left, top, right, bottom) region.
+    """
+    left, top, right, bottom = region
+    return (
+        (rects[:, 0] < right)
+        & (rects[:, 2] > left)
+        & (rects[:, 1] < bottom)
+        & (rects[:, 3] > top)
+    )
+
+
+class IncrementalAnalysis:
+    def __init__(self, tile_size=64, margin=8, max_dirty_fraction=0.5):
+        self.tile_size = tile_size
+        self.margin = margin  # Pixels of context around each changed region
+        # If more than this fraction of the frame changed, just analyze the whole frame
+        self.max_dirty_fraction = max_dirty_fraction
+        self._frames = {}  # analysis name -> (frame array, boxes)
+        self._lock = threading.Lock()
+        self.stats = {"full": 0, "incremental": 0, "unchanged": 0}
+
+    def run(self, name, img, analyze, keys=("left", "top")):
+        """
+        Returns analyze(img), a list of box dicts with `keys` (x, y), width and height, re-running `analyze`
+        only on the regions of `img` that changed since the last frame we ran `name` on.
+        """
+        frame = np.asarray(img)
+        with self._lock:
+            previous = self._frames.get(name)
+
+        if previous is None or previous[0].shape != frame.shape:
+            boxes = self._full(name, frame, img, analyze)
+            return [box.copy() for box in boxes]
+
+        previous_frame, previous_boxes = previous
+        tiles = changed_tiles(previous_frame, frame, self.tile_size)
+        if not tiles.any():
+            self.stats["unchanged"] += 1
+            return [box.copy() for box in previous_boxes]
+        if tiles.mean() > self.max_dirty_fraction:
+            boxes = self._full(name, frame, img, analyze)
+            return [box.copy() for box in boxes]
+
+        height, width = frame.shape[:2]
+        regions = dirty_regions(tiles, self.tile_size, width, height, self.margin)
+
+        # Grow the regions over any old box they cut through, so boxes are re-analyzed whole.
+        # Growing can make regions overlap, so merge them (each pixel is analyzed once) and repeat until nothing changes
+        previous_rects = _box_rects(previous_boxes, keys)
+        while True:
+            grown = []
+            for region in regions:
+                left, top, right, bottom = region
+                cut = previous_rects[_intersecting(previous_rects, region)]
+                if len(cut):
+                    left = min(left, int(cut[:, 0].min()))
+                    top = min(top, int(cut[:, 1].min()))
+                    right = max(right, int(np.ceil(cut[:, 2].max())))
+                    bottom = max(bottom, int(np.ceil(cut[:, 3].max())))
+                grown.append(
+                    {"x": left, "y": top, "width": right - left, "height": bottom - top}
+                )
+            grown = [
+                (box["x"], box["y"], box["x"] + box["width"], box["y"] + box["height"])
+                for box in merge_overlapping_boxes(grown)
+            ]
+            if grown == regions:
+                break
+            regions = grown
+
+        dirty_area = sum(
+            (right - left) * (bottom - top) for left, top, right, bottom in regions
+        )
+        if dirty_area > self.max_dirty_fraction * width * height:
+            boxes = self._full(name, frame, img, analyze)
+            return [box.copy() for box in boxes]
+
+        stale = np.zeros(len(previous_boxes), dtype=bool)
+        for region in regions:
+            stale |= _intersecting(previous_rects, region)
+        boxes = [box for box, is_stale in zip(previous_boxes, stale) if not is_stale]
+        x_key, y_key = keys
+        for left, top, right, bottom in regions:
+            for box in analyze(img.crop((left, top, right, bottom))):
+                box = dict(box)
+                box[x_key] += left
+                box[y_key] += top
+                boxes.append(box)
+
+        self.stats["incremental"] += 1
+        with self._lock:
+            self._frames[name] = (frame, boxes)
+        return [box.copy() for box in boxes]
+
+    def _full(self, name, frame, img, analyze):
+        boxes = [dict(box) for box in analyze(img)]
+        self.stats["full"] += 1
+        with self._lock:
+            self._frames[name] = (frame, boxes)
+        return boxes
+
+    def reset(self):
+        with self._lock:
+            self._frames = {}
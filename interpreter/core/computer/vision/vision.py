@@ -1,15 +1,33 @@
 import base64
 import contextlib
+import hashlib
 import io
 import os
-import tempfile
+import threading
+from collections import OrderedDict
 
 from PIL import Image
 
 from ...utils.lazy_import import lazy_import
-from ..utils.computer_vision import pytesseract_get_text
+from ...utils.model_registry import model_registry
+from ..utils.computer_vision import image_hash
 
-# transformers = lazy_import("transformers") # Doesn't work for some reason! We import it later.
+np = lazy_import("numpy")
+
+# Silencing stdout / stderr swaps them for the whole process, so two threads doing it at once
+# could leave them silenced. OCR and descriptions can run at the same time, so take turns
+_quiet_lock = threading.RLock()
+
+
+@contextlib.contextmanager
+def _quiet(stderr=False):
+    with _quiet_lock, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            if stderr:
+                with contextlib.redirect_stderr(devnull):
+                    yield
+            else:
+                yield
 
 
 class Vision:
@@ -19,98 +37,106 @@ class Vision:
         self.tokenizer = None  # Will load upon first use
         self.easyocr = None
 
+        # The last few decoded images, so ocr() and query() on the same image decode it once,
+        # and the last few images Moondream encoded, so asking more about an image is quicker
+        self.max_cached_images = 4
+        self._images = OrderedDict()  # key -> PIL image
+        self._encoded_images = OrderedDict()  # image hash -> Moondream encoding
+        self._cache_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
     def load(self, load_moondream=True, load_easyocr=True):
         # print("Loading vision models (Moondream, EasyOCR)...\n")
 
-        with contextlib.redirect_stdout(
-            open(os.devnull, "w")
-        ), contextlib.redirect_stderr(open(os.devnull, "w")):
+        # The models are shared by every interpreter in this process, so they're only loaded once
+        with self._load_lock, _quiet(stderr=True):
             if self.easyocr == None and load_easyocr:
-                import easyocr
-
-                self.easyocr = easyocr.Reader(
-                    ["en"]
-                )  # this needs to run only once to load the model into memory
+                self.easyocr = model_registry.get("easyocr")
 
             if self.model == None and load_moondream:
-                import transformers  # Wait until we use it. Transformers can't be lazy loaded for some reason!
-
-                os.environ["TOKENIZERS_PARALLELISM"] = "false"
-
-                if self.computer.debug:
+                if self.computer.debug and not model_registry.loaded("moondream"):
                     print(
                         "Open Interpreter will use Moondream (tiny vision model) to describe images to the language model. Set `interpreter.llm.vision_renderer = None` to disable this behavior."
                     )
                     print(
                         "Alternatively, you can use a vision-supporting LLM and set `interpreter.llm.supports_vision = True`."
                     )
-                model_id = "vikhyatk/moondream2"
-                revision = "2024-04-02"
-                print("loading model")
-
-                self.model = transformers.AutoModelForCausalLM.from_pretrained(
-                    model_id, trust_remote_code=True, revision=revision
-                )
-                self.tokenizer = transformers.AutoTokenizer.from_pretrained(
-                    model_id, revision=revision
-                )
+                self.model, self.tokenizer = model_registry.get("moondream")
                 return True
 
+    def warmup(self, background=True):
+        """
+        Loads EasyOCR and Moondream ahead of time, so the first image a non-vision model sees doesn't wait for them.
+        """
+        return model_registry.warmup(["easyocr", "moondream"], background=background)
+
+    def _load_image(
+        self, base_64=None, path=None, lmc=None, pil_image=None, image_array=None
+    ):
+        """
+        Returns (key, PIL image) for an image given as a base64 string, path, LMC message, PIL image or RGB array.
+        Decoded images are kept for a while, so the same image isn't decoded again by the next call.
+        """
+        if lmc:
+            if "base64" in lmc["format"]:
+                base_64 = lmc["content"]
+            elif lmc["format"] == "path":
+                path = lmc["content"]
+
+        if base_64:
+            key = hashlib.blake2b(base_64.encode(), digest_size=16).hexdigest()
+        elif path:
+            try:
+                stat = os.stat(path)
+                source = f"{path}:{stat.st_mtime_ns}:{stat.st_size}"
+            except OSError:
+                source = path
+            key = hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+        elif pil_image is not None:
+            return image_hash(pil_image), pil_image
+        elif image_array is not None:
+            return image_hash(image_array), Image.fromarray(image_array)
+        else:
+            raise ValueError("No image was given.")
+
+        with self._cache_lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return key, self._images[key]
+
+        if base_64:
+            img = Image.open(io.BytesIO(base64.b64decode(base_64)))
+        else:
+            img = Image.open(path)
+        img.load()  # Decode it now, rather than in whichever thread uses it first
+
+        with self._cache_lock:
+            self._images[key] = img
+            while len(self._images) > self.max_cached_images:
+                self._images.popitem(last=False)
+        return key, img
+
     def ocr(
         self,
         base_64=None,
         path=None,
         lmc=None,
         pil_image=None,
+        image_array=None,
     ):
         """
         Gets OCR of image.
         """
 
-        if lmc:
-            if "base64" in lmc["format"]:
-                # # Extract the extension from the format, default to 'png' if not specified
-                # if "." in lmc["format"]:
-                #     extension = lmc["format"].split(".")[-1]
-                # else:
-                #     extension = "png"
-                # Save the base64 content as a temporary file
-                img_data = base64.b64decode(lmc["content"])
-                with tempfile.NamedTemporaryFile(
-                    delete=False, suffix=".png"
-                ) as temp_file:
-                    temp_file.write(img_data)
-                    temp_file_path = temp_file.name
-
-                # Set path to the path of the temporary file
-                path = temp_file_path
-
-            elif lmc["format"] == "path":
-                # Convert to base64
-                path = lmc["content"]
-        elif base_64:
-            # Save the base64 content as a temporary file
-            img_data = base64.b64decode(base_64)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-                temp_file.write(img_data)
-                temp_file_path = temp_file.name
-
-            # Set path to the path of the temporary file
-            path = temp_file_path
-        elif path:
-            pass
-        elif pil_image:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-                pil_image.save(temp_file, format="PNG")
-                temp_file_path = temp_file.name
-
-            # Set path to the path of the temporary file
-            path = temp_file_path
-
         try:
             if not self.easyocr:
                 self.load(load_moondream=False)
-            result = self.easyocr.readtext(path)
+
+            # EasyOCR reads arrays directly, so the image never has to be written to disk
+            if image_array is None:
+                _, img = self._load_image(base_64, path, lmc, pil_image)
+                image_array = np.asarray(img.convert("RGB"))
+            result = self.easyocr.readtext(image_array)
             text = " ".join([item[1] for item in result])
             return text.strip()
         except ImportError:
@@ -126,9 +152,10 @@ class Vision:
         path=None,
         lmc=None,
         pil_image=None,
+        image_array=None,
     ):
         """
-        Uses Moondream to ask query of the image (which can be a base64, path, or lmc message)
+        Uses Moondream to ask query of the image (which can be a base64, path, lmc message, PIL image or RGB array)
         """
 
         if self.model == None and self.tokenizer == None:
@@ -142,32 +169,20 @@ class Vision:
             if not success:
                 return ""
 
-        if lmc:
-            if "base64" in lmc["format"]:
-                # # Extract the extension from the format, default to 'png' if not specified
-                # if "." in lmc["format"]:
-                #     extension = lmc["format"].split(".")[-1]
-                # else:
-                #     extension = "png"
-
-                # Decode the base64 image
-                img_data = base64.b64decode(lmc["content"])
-                img = Image.open(io.BytesIO(img_data))
+        key, img = self._load_image(base_64, path, lmc, pil_image, image_array)
 
-            elif lmc["format"] == "path":
-                # Convert to base64
-                image_path = lmc["content"]
-                img = Image.open(image_path)
-        elif base_64:
-            img_data = base64.b64decode(base_64)
-            img = Image.open(io.BytesIO(img_data))
-        elif path:
-            img = Image.open(path)
-        elif pil_image:
-            img = pil_image
+        with self._cache_lock:
+            enc_image = self._encoded_images.get(key)
+            if enc_image is not None:
+                self._encoded_images.move_to_end(key)
 
-        with contextlib.redirect_stdout(open(os.devnull, "w")):
-            enc_image = self.model.encode_image(img)
+        with _quiet():
+            if enc_image is None:
+                enc_image = self.model.encode_image(img)
+                with self._cache_lock:
+                    self._encoded_images[key] = enc_image
+                    while len(self._encoded_images) > self.max_cached_images:
+                        self._encoded_images.popitem(last=False)
             answer = self.model.answer_question(
                 enc_image, query, self.tokenizer, max_length=400
             )
@@ -18,6 +18,7 @@ from .default_system_message import default_system_message
 from .llm.llm import Llm
 from .respond import respond
 from .utils.telemetry import send_telemetry
+from .utils.tracing import Tracer, format_turn
 from .utils.truncate_output import truncate_output
 
 
@@ -85,6 +86,8 @@ class OpenInterpreter:
         self.messages = [] if messages is None else messages
         self.responding = False
         self.last_messages_count = 0
+        # Timing spans for each turn. See interpreter.tracer.events
+        self.tracer = Tracer()
 
         # Settings
         self.offline = offline
@@ -299,7 +302,6 @@ class OpenInterpreter:
         Pulls from the respond stream, adding delimiters. Some things, like active_line, console, confirmation... these act specially.
         Also assembles new messages and adds them to `self.messages`.
         """
-        self.verbose = False
 
         # Utility function
         def is_ephemeral(chunk):
@@ -314,6 +316,7 @@ class OpenInterpreter:
 
         last_flag_base = None
 
+        self.tracer.start_turn()
         try:
             for chunk in respond(self):
                 # For async usage
@@ -426,6 +429,10 @@ class OpenInterpreter:
                 yield {**last_flag_base, "end": True}
         except GeneratorExit:
             raise  # gotta pass this up!
+        finally:
+            summary = self.tracer.end_turn()
+            if self.verbose and summary:
+                print(format_turn(summary))
 
     def reset(self):
         self.computer.terminate()  # Terminates all languages
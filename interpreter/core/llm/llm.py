@@ -13,8 +13,8 @@ import logging
 import subprocess
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
 import tokentrim as tt
 
 from .run_text_llm import run_text_llm
@@ -22,6 +22,13 @@ from .run_text_llm import run_text_llm
 # from .run_function_calling_llm import run_function_calling_llm
 from .run_tool_calling_llm import run_tool_calling_llm
 from .utils.convert_to_openai_messages import convert_to_openai_messages
+from .utils.image_pipeline import ImagePipeline
+from .utils.model_metadata import (
+    clear_model_metadata,
+    default_ttl,
+    get_model_metadata,
+    update_model_metadata,
+)
 
 # Create or get the logger
 logger = logging.getLogger("LiteLLM")
@@ -73,6 +80,15 @@ class Llm:
         # Budget manager powered by LiteLLM
         self.max_budget = None
 
+        # Drops repeated screenshots, and encodes / shrinks images once each (see image_pipeline.py)
+        self.image_pipeline = ImagePipeline()
+
+        # Remember detected capabilities / context windows on disk, so we don't look them up on every start
+        self.metadata_cache = True
+        self.metadata_cache_ttl = default_ttl  # Seconds
+        # Settings we filled in ourselves, so refresh_metadata() can undo them
+        self._detected = {}
+
     def run(self, messages):
         """
         We're responsible for formatting the call into the llm.completions object,
@@ -104,48 +120,52 @@ class Llm:
                 msg["role"] != "system"
             ), "No message after the first can have the role 'system'"
 
-        model = self.model
-        if model in [
-            "claude-3.5",
-            "claude-3-5",
-            "claude-3.5-sonnet",
-            "claude-3-5-sonnet",
-        ]:
-            model = "claude-3-5-sonnet-20240620"
-            self.model = "claude-3-5-sonnet-20240620"
-        # Setup our model endpoint
-        if model == "i":
-            model = "openai/i"
-            if not hasattr(self.interpreter, "conversation_id"):  # Only do this once
-                self.context_window = 7000
-                self.api_key = "x"
-                self.max_tokens = 1000
-                self.api_base = "https://api.openinterpreter.com/v0"
-                self.interpreter.conversation_id = str(uuid.uuid4())
+        model = self.resolve_model()
+
+        # Use what we detected last time, if we've seen this model before
+        if self.supports_functions == None or self.supports_vision == None:
+            metadata = self._get_cached_metadata(model)
+            if self.supports_functions == None:
+                self._set_detected(
+                    "supports_functions", metadata.get("supports_functions")
+                )
+            if self.supports_vision == None:
+                self._set_detected("supports_vision", metadata.get("supports_vision"))
 
         # Detect function support
         if self.supports_functions == None:
             try:
                 if litellm.supports_function_calling(model):
-                    self.supports_functions = True
+                    self._set_detected("supports_functions", True)
                 else:
-                    self.supports_functions = False
+                    self._set_detected("supports_functions", False)
             except:
-                self.supports_functions = False
+                self._set_detected("supports_functions", False)
+            self._cache_metadata(model, supports_functions=self.supports_functions)
 
         # Detect vision support
         if self.supports_vision == None:
             try:
                 if litellm.supports_vision(model):
-                    self.supports_vision = True
+                    self._set_detected("supports_vision", True)
                 else:
-                    self.supports_vision = False
+                    self._set_detected("supports_vision", False)
             except:
-                self.supports_vision = False
+                self._set_detected("supports_vision", False)
+            self._cache_metadata(model, supports_vision=self.supports_vision)
 
         # Trim image messages if they're there
         image_messages = [msg for msg in messages if msg["type"] == "image"]
         if self.supports_vision:
+            if self.image_pipeline.dedupe_images:
+                # Screenshots that look the same as the next one become a short note,
+                # so the images we keep below are different ones
+                messages = self.image_pipeline.dedupe(messages)
+                image_messages = [
+                    msg
+                    for msg in messages
+                    if msg["type"] == "image" and msg.get("format") != "description"
+                ]
             if self.interpreter.os:
                 # Keep only the last two images if the interpreter is running in OS mode
                 if len(image_messages) > 1:
@@ -177,8 +197,16 @@ class Llm:
                         postcursor = ""
 
                     try:
-                        image_description = self.vision_renderer(lmc=img_msg)
-                        ocr = self.interpreter.computer.vision.ocr(lmc=img_msg)
+                        # Describe and OCR the image at the same time (they share the decoded image)
+                        with ThreadPoolExecutor(max_workers=2) as executor:
+                            description = executor.submit(
+                                self.vision_renderer, lmc=img_msg
+                            )
+                            ocr = executor.submit(
+                                self.interpreter.computer.vision.ocr, lmc=img_msg
+                            )
+                            image_description = description.result()
+                            ocr = ocr.result()
 
                         # It would be nice to format this as a message to the user and display it like: "I see: image_description"
 
@@ -200,18 +228,63 @@ class Llm:
                         img_msg["content"] = ""
 
         # Convert to OpenAI messages format
-        messages = convert_to_openai_messages(
-            messages,
-            function_calling=self.supports_functions,
-            vision=self.supports_vision,
-            shrink_images=self.interpreter.shrink_images,
-            interpreter=self.interpreter,
-        )
+        with self.interpreter.tracer.span("convert"):
+            messages = convert_to_openai_messages(
+                messages,
+                function_calling=self.supports_functions,
+                vision=self.supports_vision,
+                shrink_images=self.interpreter.shrink_images,
+                interpreter=self.interpreter,
+                image_pipeline=self.image_pipeline,
+            )
 
         system_message = messages[0]["content"]
         messages = messages[1:]
 
         # Trim messages
+        with self.interpreter.tracer.span("trim"):
+            messages = self._trim_messages(messages, system_message, model)
+
+        # If there should be a system message, there should be a system message!
+        # Empty system messages appear to be deleted :(
+        if system_message == "":
+            if messages[0]["role"] != "system":
+                messages = [{"role": "system", "content": system_message}] + messages
+
+        ## Start forming the request
+
+        params = self.completion_params(model, messages)
+
+        # Set some params directly on LiteLLM
+        if self.max_budget:
+            litellm.max_budget = self.max_budget
+        if self.interpreter.verbose:
+            litellm.set_verbose = True
+
+        if (
+            self.interpreter.debug == True and False  # DISABLED
+        ):  # debug will equal "server" if we're debugging the server specifically
+            print("\n\n\nOPENAI COMPATIBLE MESSAGES:\n\n\n")
+            for message in messages:
+                if len(str(message)) > 5000:
+                    print(str(message)[:200] + "...")
+                else:
+                    print(message)
+                print("\n")
+            print("\n\n\n")
+
+        if self.supports_functions:
+            # chunks = run_function_calling_llm(self, params)
+            chunks = run_tool_calling_llm(self, params)
+        else:
+            chunks = run_text_llm(self, params)
+
+        yield from self._trace_completion(chunks, model, params["messages"])
+
+    def _trim_messages(self, messages, system_message, model):
+        """
+        Trims messages to fit the context window, leaving room for max_tokens.
+        """
         try:
             if self.context_window and self.max_tokens:
                 trim_to_be_this_many_tokens = (
@@ -271,14 +344,69 @@ Continuing...
 
             pass
 
-        # If there should be a system message, there should be a system message!
-        # Empty system messages appear to be deleted :(
-        if system_message == "":
-            if messages[0]["role"] != "system":
-                messages = [{"role": "system", "content": system_message}] + messages
+        return messages
 
-        ## Start forming the request
+    def _trace_completion(self, chunks, model, messages):
+        """
+        Passes the chunks through, recording time to first token, chunks and throughput in an "llm" span.
+        """
+        tracer = self.interpreter.tracer
+        count = tracer.count_tokens
+        if count is None:
+            # Only when someone will see them, since counting a long conversation takes a while
+            count = bool(tracer.trace_file) or self.interpreter.verbose == True
+        attributes = {"model": model}
+        if count:
+            attributes["prompt_tokens"] = count_tokens(model, messages=messages)
+
+        with tracer.span("llm", **attributes) as span:
+            start = time.perf_counter()
+            content = []
+            span["chunks"] = 0
+            for chunk in chunks:
+                if "ttft" not in span:
+                    span["ttft"] = time.perf_counter() - start
+                span["chunks"] += 1
+                if isinstance(chunk.get("content"), str):
+                    content.append(chunk["content"])
+                yield chunk
+
+            if count:
+                span["completion_tokens"] = count_tokens(model, text="".join(content))
+                generation_time = time.perf_counter() - start - span.get("ttft", 0)
+                if generation_time > 0:
+                    span["tokens_per_second"] = (
+                        span["completion_tokens"] / generation_time
+                    )
+
+    def resolve_model(self):
+        """
+        Applies model aliases and the settings some models need, returning the model name to send to LiteLLM.
+        """
+        model = self.model
+        if model in [
+            "claude-3.5",
+            "claude-3-5",
+            "claude-3.5-sonnet",
+            "claude-3-5-sonnet",
+        ]:
+            model = "claude-3-5-sonnet-20240620"
+            self.model = "claude-3-5-sonnet-20240620"
+        # Setup our model endpoint
+        if model == "i":
+            model = "openai/i"
+            if not hasattr(self.interpreter, "conversation_id"):  # Only do this once
+                self.context_window = 7000
+                self.api_key = "x"
+                self.max_tokens = 1000
+                self.api_base = "https://api.openinterpreter.com/v0"
+                self.interpreter.conversation_id = str(uuid.uuid4())
+        return model
 
+    def completion_params(self, model, messages):
+        """
+        Builds the params for self.completions from our settings. `model` should come from resolve_model().
+        """
         params = {
             "model": model,
             "messages": messages,
@@ -299,29 +427,7 @@ Continuing...
         if hasattr(self.interpreter, "conversation_id"):
             params["conversation_id"] = self.interpreter.conversation_id
 
-        # Set some params directly on LiteLLM
-        if self.max_budget:
-            litellm.max_budget = self.max_budget
-        if self.interpreter.verbose:
-            litellm.set_verbose = True
-
-        if (
-            self.interpreter.debug == True and False  # DISABLED
-        ):  # debug will equal "server" if we're debugging the server specifically
-            print("\n\n\nOPENAI COMPATIBLE MESSAGES:\n\n\n")
-            for message in messages:
-                if len(str(message)) > 5000:
-                    print(str(message)[:200] + "...")
-                else:
-                    print(message)
-                print("\n")
-            print("\n\n\n")
-
-        if self.supports_functions:
-            # yield from run_function_calling_llm(self, params)
-            yield from run_tool_calling_llm(self, params)
-        else:
-            yield from run_text_llm(self, params)
+        return params
 
     # If you change model, set _is_loaded to false
     @property
@@ -347,10 +453,22 @@ Continuing...
             api_base = getattr(self, "api_base", None) or os.getenv(
                 "OLLAMA_HOST", "http://localhost:11434"
             )
+
+            # If we've already seen this model installed (and know its context window), skip Ollama's API entirely
+            metadata = self._get_cached_metadata(self.model)
+            if metadata.get("installed") and (
+                self.context_window != None or "context_window" in metadata
+            ):
+                if self.context_window == None:
+                    self._set_detected("context_window", metadata["context_window"])
+                if self.max_tokens == None:
+                    self._set_detected("max_tokens", int(self.context_window * 0.2))
+                return
+
             names = []
             try:
                 # List out all downloaded ollama models. Will fail if ollama isn't installed
-                response = requests.get(f"{api_base}/api/tags")
+                response = self.interpreter.computer.http.get(f"{api_base}/api/tags")
                 if response.ok:
                     data = response.json()
                     names = [
@@ -369,24 +487,27 @@ Continuing...
             # Download model if not already installed
             if model_name not in names:
                 self.interpreter.display_message(f"\nDownloading {model_name}...\n")
-                requests.post(f"{api_base}/api/pull", json={"name": model_name})
+                # Downloading can take a long time, so don't time out
+                self.interpreter.computer.http.post(
+                    f"{api_base}/api/pull", json={"name": model_name}, timeout=None
+                )
 
             # Get context window if not set
+            context_length = None
             if self.context_window == None:
-                response = requests.post(
+                response = self.interpreter.computer.http.post(
                     f"{api_base}/api/show", json={"name": model_name}
                 )
                 model_info = response.json().get("model_info", {})
-                context_length = None
                 for key in model_info:
                     if "context_length" in key:
                         context_length = model_info[key]
                         break
                 if context_length is not None:
-                    self.context_window = context_length
+                    self._set_detected("context_window", context_length)
             if self.max_tokens == None:
                 if self.context_window != None:
-                    self.max_tokens = int(self.context_window * 0.2)
+                    self._set_detected("max_tokens", int(self.context_window * 0.2))
 
             # Send a ping, which will actually load the model
             model_name = model_name.replace(":latest", "")
@@ -397,20 +518,89 @@ Continuing...
             self.interpreter.computer.ai.chat("ping")
             self.max_tokens = old_max_tokens
 
+            self._cache_metadata(
+                self.model, installed=True, context_window=context_length
+            )
+
             self.interpreter.display_message("*Model loaded.*\n")
 
         # Validate LLM should be moved here!!
 
         if self.context_window == None:
-            try:
-                model_info = litellm.get_model_info(model=self.model)
-                self.context_window = model_info["max_input_tokens"]
-                if self.max_tokens == None:
-                    self.max_tokens = min(
-                        int(self.context_window * 0.2), model_info["max_output_tokens"]
+            metadata = self._get_cached_metadata(self.model)
+            if "context_window" in metadata:
+                self._set_detected("context_window", metadata["context_window"])
+                if self.max_tokens == None and "max_output_tokens" in metadata:
+                    self._set_detected(
+                        "max_tokens",
+                        min(
+                            int(self.context_window * 0.2),
+                            metadata["max_output_tokens"],
+                        ),
                     )
-            except:
-                pass
+            else:
+                try:
+                    model_info = litellm.get_model_info(model=self.model)
+                    self._set_detected("context_window", model_info["max_input_tokens"])
+                    if self.max_tokens == None:
+                        self._set_detected(
+                            "max_tokens",
+                            min(
+                                int(self.context_window * 0.2),
+                                model_info["max_output_tokens"],
+                            ),
+                        )
+                    self._cache_metadata(
+                        self.model,
+                        context_window=model_info["max_input_tokens"],
+                        max_output_tokens=model_info["max_output_tokens"],
+                    )
+                except:
+                    pass
+
+    def refresh_metadata(self):
+        """
+        Forgets the cached capabilities and context window of the current model, so they're detected again on the next run.
+        Settings you've set yourself are kept.
+        """
+        clear_model_metadata(self.model, self._metadata_api_base())
+        for name, value in self._detected.items():
+            # Only reset it if it hasn't been changed since we detected it
+            if getattr(self, name) == value:
+                setattr(self, name, None)
+        self._detected = {}
+        self._is_loaded = False
+
+    def _set_detected(self, name, value):
+        setattr(self, name, value)
+        if value is not None:
+            self._detected[name] = value
+
+    def _metadata_api_base(self):
+        if self.model.startswith("ollama/"):
+            return self.api_base or os.getenv("OLLAMA_HOST", "http://localhost:11434")
+        return self.api_base
+
+    def _get_cached_metadata(self, model):
+        if not self.metadata_cache:
+            return {}
+        return get_model_metadata(
+            model, self._metadata_api_base(), ttl=self.metadata_cache_ttl
+        )
+
+    def _cache_metadata(self, model, **metadata):
+        if self.metadata_cache:
+            update_model_metadata(model, self._metadata_api_base(), **metadata)
+
+
+def count_tokens(model, messages=None, text=None):
+    """
+    Counts tokens with the model's tokenizer if LiteLLM knows it, otherwise estimates ~4 characters per token.
+    """
+    try:
+        return litellm.token_counter(model=model, messages=messages, text=text)
+    except:
+        return len(str(messages if text is None else text)) // 4
 
 
 def fixed_litellm_completions(**params):
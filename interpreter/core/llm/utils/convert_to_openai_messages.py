@@ -1,9 +1,6 @@
-import base64
-import io
 import json
-import sys
 
-from PIL import Image
+from .image_pipeline import default_image_pipeline
 
 
 def convert_to_openai_messages(
@@ -12,10 +9,14 @@ def convert_to_openai_messages(
     vision=False,
     shrink_images=True,
     interpreter=None,
+    image_pipeline=None,
 ):
     """
     Converts LMC messages into OpenAI messages
     """
+    if image_pipeline is None:
+        image_pipeline = default_image_pipeline
+
     new_messages = []
 
     # if function_calling == False:
@@ -121,86 +122,8 @@ def convert_to_openai_messages(
                     # If no vision, we only support the format of "description"
                     continue
 
-                if "base64" in message["format"]:
-                    # Extract the extension from the format, default to 'png' if not specified
-                    if "." in message["format"]:
-                        extension = message["format"].split(".")[-1]
-                    else:
-                        extension = "png"
-
-                    encoded_string = message["content"]
-
-                elif message["format"] == "path":
-                    # Convert to base64
-                    image_path = message["content"]
-                    extension = image_path.split(".")[-1]
-
-                    with open(image_path, "rb") as image_file:
-                        encoded_string = base64.b64encode(image_file.read()).decode(
-                            "utf-8"
-                        )
-
-                else:
-                    # Probably would be better to move this to a validation pass
-                    # Near core, through the whole messages object
-                    if "format" not in message:
-                        raise Exception("Format of the image is not specified.")
-                    else:
-                        raise Exception(
-                            f"Unrecognized image format: {message['format']}"
-                        )
-
-                content = f"data:image/{extension};base64,{encoded_string}"
-
-                if shrink_images:
-                    # Shrink to less than 5mb
-
-                    # Calculate size
-                    content_size_bytes = sys.getsizeof(str(content))
-
-                    # Convert the size to MB
-                    content_size_mb = content_size_bytes / (1024 * 1024)
-
-                    # If the content size is greater than 5 MB, resize the image
-                    if content_size_mb > 5:
-                        # Decode the base64 image
-                        img_data = base64.b64decode(encoded_string)
-                        img = Image.open(io.BytesIO(img_data))
-
-                        # Run in a loop to make SURE it's less than 5mb
-                        for _ in range(10):
-                            # Calculate the scale factor needed to reduce the image size to 4.9 MB
-                            scale_factor = (4.9 / content_size_mb) ** 0.5
-
-                            # Calculate the new dimensions
-                            new_width = int(img.width * scale_factor)
-                            new_height = int(img.height * scale_factor)
-
-                            # Resize the image
-                            img = img.resize((new_width, new_height))
-
-                            # Convert the image back to base64
-                            buffered = io.BytesIO()
-                            img.save(buffered, format=extension)
-                            encoded_string = base64.b64encode(
-                                buffered.getvalue()
-                            ).decode("utf-8")
-
-                            # Set the content
-                            content = f"data:image/{extension};base64,{encoded_string}"
-
-                            # Recalculate the size of the content in bytes
-                            content_size_bytes = sys.getsizeof(str(content))
-
-                            # Convert the size to MB
-                            content_size_mb = content_size_bytes / (1024 * 1024)
-
-                            if content_size_mb < 5:
-                                break
-                        else:
-                            print(
-                                "Attempted to shrink the image but failed. Sending to the LLM anyway."
-                            )
+                # Encoded (and shrunk to fit the byte budget, if shrink_images) once per image, then cached
+                content = image_pipeline.encode(message, shrink=shrink_images)
 
                 new_message = {
                     "role": "user",
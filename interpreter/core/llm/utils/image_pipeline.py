@@ -0,0 +1,229 @@
+"""
+Prepares image messages for the LLM.
+
+OS mode conversations pile up screenshots that often look the same as the one before them. `dedupe` replaces
+an image that looks the same as the next image with a short note (the latest screenshot is always kept).
+`encode` turns an image message into a data URL under a byte budget, optionally re-encoded as JPEG or WebP,
+downscaling it in one step if it's too big. Both cache their work per image, since every turn resends the
+whole conversation.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from ...utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+
+# PIL's names for file extensions
+image_formats = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+
+duplicate_image_note = "(A screenshot was here, but it looked the same as the next one, so it was left out.)"
+
+
+def perceptual_hash(img, size=128):
+    """
+    A perceptual hash for screenshots: the image averaged down to a size x size RGB grid. Re-encoding an image
+    barely changes it, while a small part of the screen changing (a few typed characters) changes some cells
+    a lot, which hashes that are only a few bits long can't see.
+    """
+    return np.asarray(
+        img.convert("RGB").resize((size, size), Image.BOX), dtype=np.uint8
+    )
+
+
+def hash_distance(a, b):
+    """
+    How different two perceptual hashes are: the largest difference in any cell and channel (0 to 255).
+    """
+    return int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max())
+
+
+def image_source(message):
+    """
+    Returns (extension, encoded bytes) for an image message in a base64 or path format.
+    """
+    if "base64" in message["format"]:
+        # Extract the extension from the format, default to 'png' if not specified
+        if "." in message["format"]:
+            extension = message["format"].split(".")[-1]
+        else:
+            extension = "png"
+        return extension, base64.b64decode(message["content"])
+
+    elif message["format"] == "path":
+        extension = message["content"].split(".")[-1]
+        with open(message["content"], "rb") as image_file:
+            return extension, image_file.read()
+
+    # Probably would be better to move this to a validation pass
+    # Near core, through the whole messages object
+    if "format" not in message:
+        raise Exception("Format of the image is not specified.")
+    raise Exception(f"Unrecognized image format: {message['format']}")
+
+
+def _message_key(message):
+    """
+    Identifies an image message's contents without decoding it.
+    """
+    if message["format"] == "path":
+        try:
+            stat = os.stat(message["content"])
+            source = f"{message['content']}:{stat.st_mtime_ns}:{stat.st_size}"
+        except OSError:
+            source = message["content"]
+    else:
+        source = f"{message['format']}:{message['content']}"
+    return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+
+class ImagePipeline:
+    def __init__(self):
+        self.dedupe_images = True
+        # How far apart (see hash_distance) two images' hashes may be for them to count as the same
+        self.dedupe_distance = 4
+        # "jpeg" or "webp" to re-encode images, None to keep their format
+        self.format = None
+        self.quality = 85  # For JPEG and WebP
+        # Budget for each image's data URL, if shrinking images
+        self.max_bytes = 5 * 1024 * 1024
+
+        # Recently encoded data URLs and perceptual hashes, by image
+        self.cache_max_bytes = 64 * 1024 * 1024
+        self._encoded = OrderedDict()  # key -> data URL
+        self._hashes = OrderedDict()  # image key -> perceptual hash
+        self._lock = threading.Lock()
+
+    def dedupe(self, messages):
+        """
+        Returns `messages` with each image that looks the same as the next image replaced by a short note.
+        The messages themselves aren't modified.
+        """
+        images = [
+            i
+            for i, message in enumerate(messages)
+            if message.get("type") == "image" and message.get("format") != "description"
+        ]
+        if len(images) < 2:
+            return messages
+
+        messages = list(messages)
+        hashes = [self._hash(messages[i]) for i in images]
+        for (i, a), b in zip(zip(images, hashes), hashes[1:]):
+            if a is not None and b is not None:
+                if hash_distance(a, b) <= self.dedupe_distance:
+                    # (Sent as a user message, like the image it replaces)
+                    messages[i] = {
+                        **messages[i],
+                        "role": "user",
+                        "format": "description",
+                        "content": duplicate_image_note,
+                    }
+        return messages
+
+    def _hash(self, message):
+        key = _message_key(message)
+        with self._lock:
+            if key in self._hashes:
+                self._hashes.move_to_end(key)
+                return self._hashes[key]
+        try:
+            _, data = image_source(message)
+            with Image.open(io.BytesIO(data)) as img:
+                value = perceptual_hash(img)
+        except Exception:
+            value = None  # Can't read it, so never treat it as a duplicate
+        with self._lock:
+            self._hashes[key] = value
+            while len(self._hashes) > 256:  # About 48 KB each
+                self._hashes.popitem(last=False)
+        return value
+
+    def encode(self, message, shrink=True):
+        """
+        Returns the image message as a data URL, re-encoded if `format` is set and, if `shrink`, downscaled to fit
+        `max_bytes`.
+        """
+        key = "|".join(
+            str(value)
+            for value in [
+                _message_key(message),
+                self.format,
+                self.quality,
+                shrink and self.max_bytes,
+            ]
+        )
+        with self._lock:
+            if key in self._encoded:
+                self._encoded.move_to_end(key)
+                return self._encoded[key]
+
+        content = self._encode(message, shrink)
+
+        with self._lock:
+            self._encoded[key] = content
+            total = sum(len(value) for value in self._encoded.values())
+            while len(self._encoded) > 1 and total > self.cache_max_bytes:
+                total -= len(self._encoded.popitem(last=False)[1])
+        return content
+
+    def _encode(self, message, shrink):
+        extension, data = image_source(message)
+
+        def data_url(extension, data):
+            return f"data:image/{extension};base64,{base64.b64encode(data).decode('utf-8')}"
+
+        content = None
+        if self.format is None:
+            content = data_url(extension, data)
+            if not shrink or len(content) <= self.max_bytes:
+                return content
+
+        img = Image.open(io.BytesIO(data))
+        if self.format is not None:
+            extension = self.format.lower()
+        image_format = image_formats.get(extension.lower(), extension.upper())
+
+        if content is None:
+            data = self._save(img, image_format)
+            content = data_url(extension, data)
+            if not shrink or len(content) <= self.max_bytes:
+                return content
+
+        # The encoded size is roughly proportional to the number of pixels, so scale both sides by the square root
+        # of how far over budget we are (with a little headroom), and resize once
+        scale = (0.9 * self.max_bytes / len(content)) ** 0.5
+        size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        content = data_url(
+            extension, self._save(img.resize(size, Image.LANCZOS), image_format)
+        )
+        if len(content) > self.max_bytes:
+            print(
+                "Attempted to shrink the image but failed. Sending to the LLM anyway."
+            )
+        return content
+
+    def _save(self, img, image_format):
+        if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buffered = io.BytesIO()
+        if image_format in ("JPEG", "WEBP"):
+            img.save(buffered, format=image_format, quality=self.quality)
+        else:
+            img.save(buffered, format=image_format)
+        return buffered.getvalue()
+
+    def clear_cache(self):
+        with self._lock:
+            self._encoded.clear()
+            self._hashes.clear()
+
+
+default_image_pipeline = ImagePipeline()
@@ -0,0 +1,102 @@
+"""
+A small on-disk cache of what we've detected about each model (function calling / vision support,
+context window, whether Ollama already has it downloaded...).
+
+Without it, every process start asks LiteLLM and, for Ollama models, makes several round-trips to the
+Ollama API before the first message can be sent.
+"""
+
+import json
+import os
+import threading
+import time
+
+default_model_metadata_path = os.path.join(
+    os.path.expanduser("~"), ".cache", "open-interpreter", "model_metadata.json"
+)
+
+default_ttl = 60 * 60 * 24 * 7  # One week
+
+_lock = threading.Lock()
+
+
+def get_model_metadata_path():
+    """
+    Where the cache lives. Set INTERPRETER_MODEL_METADATA_PATH to move it (checked on every call).
+    """
+    return os.getenv("INTERPRETER_MODEL_METADATA_PATH") or default_model_metadata_path
+
+
+def _cache_key(model, api_base=None):
+    return f"{model}|{api_base or ''}"
+
+
+def _read_cache():
+    try:
+        with open(get_model_metadata_path(), "r") as file:
+            cache = json.load(file)
+        if isinstance(cache, dict):
+            return cache
+    except:
+        pass
+    return {}
+
+
+def _write_cache(cache):
+    try:
+        path = get_model_metadata_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so a concurrent reader never sees half a file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(cache, file)
+        os.replace(temp_path, path)
+    except:
+        # Non blocking
+        pass
+
+
+def get_model_metadata(model, api_base=None, ttl=default_ttl):
+    """
+    Returns the cached metadata dict for this model + api_base, or {} if we don't know it (or it's older than `ttl` seconds).
+    """
+    with _lock:
+        entry = _read_cache().get(_cache_key(model, api_base))
+
+    if not entry:
+        return {}
+    if ttl is not None and time.time() - entry.get("updated_at", 0) > ttl:
+        return {}
+    return entry.get("metadata", {})
+
+
+def update_model_metadata(model, api_base=None, **metadata):
+    """
+    Merges `metadata` into the cached entry for this model + api_base. `None` values are ignored.
+    """
+    metadata = {key: value for key, value in metadata.items() if value is not None}
+    if not metadata:
+        return
+
+    with _lock:
+        cache = _read_cache()
+        key = _cache_key(model, api_base)
+        entry = cache.get(key, {})
+        cache[key] = {
+            "updated_at": time.time(),
+            "metadata": {**entry.get("metadata", {}), **metadata},
+        }
+        _write_cache(cache)
+
+
+def clear_model_metadata(model=None, api_base=None):
+    """
+    Forgets what we know about this model + api_base, or about every model if `model` is None.
+    """
+    with _lock:
+        if model is None:
+            cache = {}
+        else:
+            cache = _read_cache()
+            cache.pop(_cache_key(model, api_base), None)
+        _write_cache(cache)
@@ -19,7 +19,13 @@ def respond(interpreter):
     last_unsupported_code = ""
     insert_loop_message = False
 
+    first_step = True
+
     while True:
+        if not first_step:
+            interpreter.tracer.next_step()
+        first_step = False
+
         ## RENDER SYSTEM MESSAGE ##
 
         system_message = interpreter.system_message
@@ -48,7 +54,8 @@ def respond(interpreter):
         #     )
 
         ## Rendering ↓
-        rendered_system_message = render_message(interpreter, system_message)
+        with interpreter.tracer.span("render"):
+            rendered_system_message = render_message(interpreter, system_message)
         ## Rendering ↑
 
         rendered_system_message = {
@@ -345,8 +352,9 @@ def respond(interpreter):
 
                 ## ↓ CODE IS RUN HERE
 
-                for line in interpreter.computer.run(language, code, stream=True):
-                    yield {"role": "computer", **line}
+                with interpreter.tracer.span("execute", language=language):
+                    for line in interpreter.computer.run(language, code, stream=True):
+                        yield {"role": "computer", **line}
 
                 ## ↑ CODE IS RUN HERE
 
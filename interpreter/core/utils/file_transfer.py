@@ -0,0 +1,108 @@
+"""
+Moving files in and out of the server (the /upload and /download routes) a chunk at a time, with the file I/O run in
+threads so big transfers don't hold up the event loop.
+"""
+
+import asyncio
+import os
+import zlib
+
+chunk_size = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Returns the (start, end) bytes (end inclusive) asked for by a "Range: bytes=..." header, or None for the whole
+    file. Only single ranges are supported; others are answered with the whole file, which HTTP allows.
+    Raises RangeNotSatisfiable if the range is past the end of the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes=") :].strip().partition("-")
+    try:
+        if start == "":
+            # The last `end` bytes
+            suffix = int(end)
+            if suffix == 0:
+                raise RangeNotSatisfiable(header)
+            return max(0, size - suffix), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+async def read_file(path, start=0, length=None, compress=False):
+    """
+    Yields the bytes of path from `start` (`length` of them, or to the end), gzipped if `compress`.
+    The file is closed when the response is done, even if the client goes away.
+    """
+    file = await asyncio.to_thread(open, path, "rb")
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip
+    try:
+        await asyncio.to_thread(file.seek, start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = await asyncio.to_thread(file.read, size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            if compressor:
+                chunk = await asyncio.to_thread(compressor.compress, chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        if compressor:
+            yield compressor.flush()
+    finally:
+        await asyncio.to_thread(file.close)
+
+
+async def write_file(chunks, path, offset=0, max_bytes=None):
+    """
+    Writes an async iterator of byte chunks to path. An `offset` of 0 replaces the file. Otherwise the chunks are
+    appended to it, to resume an upload that stopped after `offset` bytes (which must be the file's size).
+    Raises UploadTooLarge if the file would grow past max_bytes (it's left as far as it got).
+    Returns the file's size.
+    """
+    file = await asyncio.to_thread(open, path, "ab" if offset else "wb")
+    try:
+        size = offset
+        async for chunk in chunks:
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise UploadTooLarge(
+                    f"Files can't be bigger than {max_bytes} bytes (INTERPRETER_MAX_UPLOAD_BYTES)."
+                )
+            await asyncio.to_thread(file.write, chunk)
+        return size
+    finally:
+        await asyncio.to_thread(file.close)
+
+
+async def upload_chunks(upload_file):
+    """
+    Reads a FastAPI UploadFile a chunk at a time.
+    """
+    while True:
+        chunk = await upload_file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
@@ -0,0 +1,91 @@
+"""
+A small wrapper around a pooled `requests.Session`.
+
+Every outbound call used to go through module-level `requests.get/post`, which opens a new TCP (and TLS) connection each time.
+Reusing one session keeps connections to the same host alive, and lets us put a timeout on every call.
+"""
+
+import gzip
+import threading
+from json import dumps
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_default = object()
+
+
+class HttpClient:
+    def __init__(self):
+        self.timeout = (10, 60)  # (connect, read) seconds. None waits forever
+        self.pool_maxsize = 10  # Connections kept alive per host
+
+        # Compress request bodies bigger than gzip_min_size bytes (like base64 screenshots).
+        # Only turn this on if the server accepts `Content-Encoding: gzip`
+        self.gzip_requests = False
+        self.gzip_min_size = 64 * 1024
+
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_maxsize=self.pool_maxsize)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def request(
+        self,
+        method,
+        url,
+        json=None,
+        data=None,
+        headers=None,
+        timeout=_default,
+        gzip_body=None,
+        **kwargs,
+    ):
+        """
+        Like `requests.request`, on the pooled session. `timeout` defaults to self.timeout,
+        and `gzip_body` (defaults to self.gzip_requests) compresses large bodies.
+        """
+        headers = dict(headers or {})
+        if timeout is _default:
+            timeout = self.timeout
+        if gzip_body is None:
+            gzip_body = self.gzip_requests
+
+        if json is not None:
+            data = dumps(json)
+            headers.setdefault("Content-Type", "application/json")
+        if isinstance(data, str):
+            data = data.encode()
+        if gzip_body and isinstance(data, bytes) and len(data) >= self.gzip_min_size:
+            data = gzip.compress(data, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+
+        return self.session.request(
+            method, url, data=data, headers=headers, timeout=timeout, **kwargs
+        )
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+# For code that doesn't have a computer to hand (telemetry, contributing conversations)
+default_client = HttpClient()
@@ -0,0 +1,187 @@
+"""
+Counters, gauges and histograms for watching a server under load, rendered in Prometheus' text format (served at
+/metrics). The interpreter feeds the ones below as it works. Gauges like the number of sessions are read when
+they're scraped, from functions the server registers.
+"""
+
+import math
+import threading
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+        )
+        for name, value in pairs
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), function=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Returns the value (or {label values: value}) when it's scraped, instead of the values set here
+        self.function = function
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def values(self):
+        if self.function is None:
+            with self._lock:
+                return dict(self._values)
+        value = self.function()
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(self.values().items()):
+            lines.append(
+                f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts = list(counts)  # (So a scrape never sees it half updated)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, (counts, total) in sorted(self.values().items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(
+                    self.labels, key, [("le", _format_value(bound))]
+                )
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        """
+        Registers a metric. Registering a name again replaces the function behind it (so the latest server's sessions
+        are the ones reported), but keeps the values recorded so far.
+        """
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and type(existing) is type(metric):
+                existing.function = metric.function
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labels=(), function=None):
+        return self._add(Counter(name, help, labels, function))
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self._add(Gauge(name, help, labels, function))
+
+    def histogram(self, name, help, buckets, labels=()):
+        return self._add(Histogram(name, help, buckets, labels))
+
+    def render(self):
+        """
+        Returns every metric in Prometheus' text format. Metrics whose function fails are left out.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines += metric.render()
+            except Exception:
+                continue
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+llm_time_to_first_token = metrics.histogram(
+    "interpreter_llm_time_to_first_token_seconds",
+    "Seconds from the start of each LLM call to its first chunk.",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+llm_chunks_per_second = metrics.histogram(
+    "interpreter_llm_chunks_per_second",
+    "How fast the LLM streamed chunks (each usually a token or a few) after its first.",
+    buckets=(1, 5, 10, 20, 50, 100, 200, 500),
+)
+code_execution_seconds = metrics.histogram(
+    "interpreter_code_execution_seconds",
+    "Seconds each code block took to run.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+    labels=("language",),
+)
+websocket_frames_sent = metrics.counter(
+    "interpreter_websocket_frames_sent_total", "Websocket frames sent to clients."
+)
+websocket_bytes_sent = metrics.counter(
+    "interpreter_websocket_bytes_sent_total", "Bytes sent to websocket clients."
+)
+
+
+def observe_llm_span(span):
+    """
+    An on_span_end callback for interpreter.tracer, feeding the LLM histograms from its "llm" spans.
+    """
+    if span["name"] != "llm" or "ttft" not in span:
+        return
+    llm_time_to_first_token.observe(span["ttft"])
+    streaming_seconds = span["duration"] - span["ttft"]
+    if span.get("chunks", 0) > 1 and streaming_seconds > 0:
+        llm_chunks_per_second.observe((span["chunks"] - 1) / streaming_seconds)
@@ -0,0 +1,186 @@
+"""
+One copy of each local model per process.
+
+Every `OpenInterpreter` has its own `Computer`, so a server hosting many interpreters used to load the same EasyOCR,
+Moondream and CLIP weights once per interpreter. Models registered here are loaded the first time any of them asks
+for one (each model behind its own lock, so loading one doesn't hold up another), and shared from then on.
+`warmup` loads them ahead of time in a background thread, and `memory_usage` reports what each one takes.
+"""
+
+import os
+import threading
+import time
+
+
+def _load_easyocr():
+    import easyocr
+
+    return easyocr.Reader(["en"])
+
+
+def _load_moondream():
+    """
+    Returns (model, tokenizer).
+    """
+    import transformers  # Transformers can't be lazy loaded for some reason!
+
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    model_id = "vikhyatk/moondream2"
+    revision = "2024-04-02"
+    model = transformers.AutoModelForCausalLM.from_pretrained(
+        model_id, trust_remote_code=True, revision=revision
+    )
+    tokenizer = transformers.AutoTokenizer.from_pretrained(model_id, revision=revision)
+    return model, tokenizer
+
+
+def _load_clip(quantize=False):
+    from ..computer.display.point.point import load_model
+
+    return load_model(quantize=quantize)
+
+
+def _load_tiktoken(model):
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # tiktoken doesn't know non-OpenAI models. This gets us much closer than counting characters.
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def model_size(model, _seen=None):
+    """
+    Roughly how many bytes a model's weights take: the parameters and buffers of any torch modules in it (looking one
+    level into plain objects, like EasyOCR's Reader), or None if it has none we can measure.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(model) in _seen:
+        return None
+    _seen.add(id(model))
+
+    if callable(getattr(model, "parameters", None)) and callable(
+        getattr(model, "buffers", None)
+    ):
+        try:
+            tensors = list(model.parameters()) + list(model.buffers())
+            return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+        except Exception:
+            return None
+
+    if isinstance(model, (list, tuple)):
+        parts = model
+    elif isinstance(model, (str, bytes, int, float, bool)) or model is None:
+        return None
+    else:
+        try:
+            parts = list(vars(model).values())
+        except TypeError:
+            return None
+        # Only look into attributes that are modules themselves
+        parts = [part for part in parts if callable(getattr(part, "parameters", None))]
+
+    sizes = [model_size(part, _seen) for part in parts]
+    sizes = [size for size in sizes if size is not None]
+    return sum(sizes) if sizes else None
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._loaders = {}  # name -> function that loads the model
+        self._models = {}  # name -> loaded model
+        self._load_seconds = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        """
+        Registers a function that loads a model. Re-registering a name forgets the model loaded for it.
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._models.pop(name, None)
+
+    def get(self, name, loader=None):
+        """
+        Returns the model registered as `name`, loading it if this is the first time it's asked for. `loader` registers
+        it on the fly if it isn't registered yet. Loading errors (like ImportError) are raised, and tried again next time.
+        """
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._lock:
+            if loader is not None:
+                self._loaders.setdefault(name, loader)
+            if name not in self._loaders:
+                raise KeyError(f"No model is registered as {name!r}.")
+            lock = self._locks.setdefault(name, threading.Lock())
+
+        with lock:
+            if name not in self._models:
+                start = time.perf_counter()
+                model = self._loaders[name]()
+                self._load_seconds[name] = time.perf_counter() - start
+                self._models[name] = model
+            return self._models[name]
+
+    def loaded(self, name):
+        return name in self._models
+
+    def unload(self, name):
+        """
+        Forgets a loaded model, so its memory can be freed once nothing else holds on to it.
+        """
+        with self._lock:
+            self._models.pop(name, None)
+            self._load_seconds.pop(name, None)
+
+    def warmup(self, names=None, background=True):
+        """
+        Loads these models (all registered models by default) ahead of time. Models that fail to load (like ones whose
+        packages aren't installed) are skipped. Returns the thread they're loading in if `background`.
+        """
+        if names is None:
+            names = list(self._loaders)
+
+        def load():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception:
+                    pass
+
+        if background:
+            thread = threading.Thread(target=load, daemon=True)
+            thread.start()
+            return thread
+        load()
+
+    def memory_usage(self):
+        """
+        Returns {name: {"bytes": ..., "load_seconds": ...}} for each loaded model. "bytes" is None for models
+        we can't measure (like tiktoken encoders).
+        """
+        with self._lock:
+            models = dict(self._models)
+        return {
+            name: {
+                "bytes": model_size(model),
+                "load_seconds": self._load_seconds.get(name),
+            }
+            for name, model in models.items()
+        }
+
+
+model_registry = ModelRegistry()
+model_registry.register("easyocr", _load_easyocr)
+model_registry.register("moondream", _load_moondream)
+model_registry.register("clip", _load_clip)
+model_registry.register("clip-int8", lambda: _load_clip(quantize=True))
+
+
+def get_tiktoken_encoding(model):
+    return model_registry.get(f"tiktoken:{model}", lambda: _load_tiktoken(model))
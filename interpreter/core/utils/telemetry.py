@@ -16,7 +16,8 @@ import threading
 import uuid
 
 import pkg_resources
-import requests
+
+from .http_client import default_client
 
 
 def get_or_create_uuid():
@@ -59,6 +60,6 @@ def send_telemetry(event_name, properties=None):
             "properties": properties,
             "distinct_id": user_id,
         }
-        requests.post(url, headers=headers, data=json.dumps(data))
+        default_client.post(url, headers=headers, data=json.dumps(data))
     except:
         pass
@@ -0,0 +1,128 @@
+"""
+Lightweight timing spans, so you can see where a turn's time goes (rendering, trimming, the LLM, running code...).
+
+Finished spans are kept in `interpreter.tracer.events`, passed to any `on_span_end` callbacks,
+and appended to `interpreter.tracer.trace_file` (JSONL) if it's set. Nothing is sent anywhere.
+"""
+
+import collections
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    def __init__(self):
+        self.events = collections.deque(maxlen=1000)  # Most recent spans and turns
+        self.on_span_start = []  # Callbacks, called with the span dict
+        self.on_span_end = []
+        self.trace_file = None  # Path to append every event to, as JSON lines
+        # Count prompt / completion tokens for "llm" spans. None counts them in verbose mode or with a trace_file
+        self.count_tokens = None
+
+        self.step = 0  # Which step of the current turn we're on
+        self._turn = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Times the block. Yields the span dict, so the block can add attributes to it.
+        """
+        span = {"type": "span", "name": name, "step": self.step, **attributes}
+        span["start"] = time.time()
+        for callback in self.on_span_start:
+            callback(span)
+
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span["duration"] = time.perf_counter() - start
+            if self._turn is not None:
+                self._turn["spans"].append(span)
+            for callback in self.on_span_end:
+                callback(span)
+            self._record(span)
+
+    def start_turn(self):
+        self.step = 0
+        self._turn = {"start": time.time(), "perf_start": time.perf_counter()}
+        self._turn["spans"] = []
+
+    def next_step(self):
+        self.step += 1
+
+    def end_turn(self):
+        """
+        Records and returns a summary of the turn: total time per stage, plus the LLM calls.
+        """
+        if self._turn is None:
+            return None
+        turn, self._turn = self._turn, None
+
+        stages = {}
+        for span in turn["spans"]:
+            stages[span["name"]] = stages.get(span["name"], 0) + span["duration"]
+
+        summary = {
+            "type": "turn",
+            "start": turn["start"],
+            "duration": time.perf_counter() - turn["perf_start"],
+            "steps": self.step + 1,
+            "stages": stages,
+            "llm": [
+                {
+                    key: span[key]
+                    for key in [
+                        "step",
+                        "model",
+                        "duration",
+                        "ttft",
+                        "prompt_tokens",
+                        "completion_tokens",
+                        "tokens_per_second",
+                    ]
+                    if key in span
+                }
+                for span in turn["spans"]
+                if span["name"] == "llm"
+            ],
+        }
+        self._record(summary)
+        return summary
+
+    def _record(self, event):
+        self.events.append(event)
+        if self.trace_file:
+            try:
+                with self._lock:
+                    with open(self.trace_file, "a") as file:
+                        file.write(json.dumps(event, default=str) + "\n")
+            except:
+                # Non blocking
+                pass
+
+
+def format_turn(summary):
+    """
+    A short, human-readable breakdown of a turn summary from Tracer.end_turn().
+    """
+    lines = [f"Turn: {summary['duration']:.2f}s over {summary['steps']} step(s)"]
+    for name, duration in sorted(
+        summary["stages"].items(), key=lambda item: item[1], reverse=True
+    ):
+        lines.append(f"  {name}: {duration:.3f}s")
+    for call in summary["llm"]:
+        details = [f"step {call['step']}"]
+        if "ttft" in call:
+            details.append(f"TTFT {call['ttft']:.2f}s")
+        if "prompt_tokens" in call:
+            details.append(f"{call['prompt_tokens']} prompt tokens")
+        if "completion_tokens" in call:
+            details.append(f"{call['completion_tokens']} completion tokens")
+        if "tokens_per_second" in call:
+            details.append(f"{call['tokens_per_second']:.1f} tokens/s")
+        lines.append("  llm (" + ", ".join(details) + ")")
+    return "\n".join(lines)
@@ -0,0 +1,145 @@
+"""
+A fixed number of worker threads running jobs for many owners (like server sessions), fairly.
+
+Jobs wait in a queue per owner, and workers take them from each owner in turn, so one owner queueing a lot of work
+doesn't hold up everyone else. At most `max_workers` jobs run at once, so a busy server can't start more LLM calls
+and code runs than the machine can handle, and `max_queued` (if set) limits how many can wait.
+"""
+
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    """
+    A submitted function call. Like a thread, it has is_alive() and join().
+    """
+
+    def __init__(self, pool, key, function, args):
+        self.pool = pool
+        self.key = key
+        self.function = function
+        self.args = args
+        self.submitted = time.monotonic()
+        self.started = None
+        self._done = threading.Event()
+
+    def is_alive(self):
+        return not self._done.is_set()
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+
+    def cancel(self):
+        """
+        Drops the job if it hasn't started yet. Returns whether it was dropped.
+        """
+        return self.pool._cancel(self)
+
+
+class WorkerPool:
+    def __init__(self, max_workers=4, max_queued=None, name="worker"):
+        self.max_workers = max_workers
+        self.max_queued = max_queued  # None for no limit
+        self.name = name
+        # Key -> deque of jobs, keys in the order they'll be served
+        self._queues = OrderedDict()
+        self._condition = threading.Condition()
+        self._workers = []
+        self._idle = 0
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self._waits = deque(maxlen=100)  # Seconds the last jobs waited for a worker
+
+    def submit(self, key, function, *args):
+        """
+        Queues function(*args) to run after the jobs already waiting (taking turns with other keys' jobs).
+        Raises QueueFullError if max_queued jobs are already waiting.
+        """
+        with self._condition:
+            if self.max_queued is not None and self.queued >= self.max_queued:
+                self.rejected += 1
+                raise QueueFullError(
+                    f"{self.queued} jobs are already waiting. Try again later."
+                )
+            job = Job(self, key, function, args)
+            self._queues.setdefault(key, deque()).append(job)
+            self.queued += 1
+            if self._idle == 0 and len(self._workers) < self.max_workers:
+                worker = threading.Thread(
+                    target=self._work,
+                    name=f"{self.name}-{len(self._workers)}",
+                    daemon=True,
+                )
+                self._workers.append(worker)
+                worker.start()
+            self._condition.notify()
+        return job
+
+    def _next_job(self):
+        key, jobs = next(iter(self._queues.items()))
+        job = jobs.popleft()
+        if jobs:
+            self._queues.move_to_end(key)  # Its next job waits for everyone else's turn
+        else:
+            del self._queues[key]
+        self.queued -= 1
+        return job
+
+    def _work(self):
+        while True:
+            with self._condition:
+                self._idle += 1
+                # (max_workers may have been lowered since this worker started)
+                while not self._queues or self.running >= self.max_workers:
+                    self._condition.wait()
+                self._idle -= 1
+                job = self._next_job()
+                self.running += 1
+
+            job.started = time.monotonic()
+            self._waits.append(job.started - job.submitted)
+            try:
+                job.function(*job.args)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._condition:
+                    self.running -= 1
+                    self.completed += 1
+                    self._condition.notify()
+                job._done.set()
+
+    def _cancel(self, job):
+        with self._condition:
+            jobs = self._queues.get(job.key)
+            if jobs is None or job not in jobs:
+                return False
+            jobs.remove(job)
+            if not jobs:
+                del self._queues[job.key]
+            self.queued -= 1
+        job._done.set()
+        return True
+
+    def stats(self):
+        with self._condition:
+            waits = list(self._waits)
+            return {
+                "max_workers": self.max_workers,
+                "running": self.running,
+                "queued": self.queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "mean_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+                "max_wait_seconds": max(waits) if waits else 0.0,
+            }
@@ -4,8 +4,8 @@ import time
 from typing import List, TypedDict
 
 import pkg_resources
-import requests
 
+from interpreter.core.utils.http_client import default_client
 from interpreter.terminal_interface.profiles.profiles import write_key_to_profile
 from interpreter.terminal_interface.utils.display_markdown_message import (
     display_markdown_message,
@@ -187,7 +187,7 @@ def contribute_conversations(
     ), "the contribution payload is not a list of lists!"
 
     try:
-        requests.post(url, json=payload)
+        default_client.post(url, json=payload)
     except:
         # Non blocking
         pass
@@ -194,6 +194,12 @@ def start_terminal_interface(interpreter):
             "type": bool,
             "attribute": {"object": interpreter, "attr_name": "debug"},
         },
+        {
+            "name": "trace_file",
+            "help_text": "append timing spans for every step (render, trim, llm, execute) to this JSONL file",
+            "type": str,
+            "attribute": {"object": interpreter.tracer, "attr_name": "trace_file"},
+        },
         {
             "name": "fast",
             "nickname": "f",
@@ -0,0 +1,127 @@
+"""
+Times find_icon's box merging stage on a 4K-sized screen full of contours.
+
+    python tests/benchmarks/bench_box_merging.py [--boxes 4000] [--boxes-json boxes.json]
+
+--boxes-json takes a list of {"x", "y", "width", "height"} dicts, e.g. dumped from get_element_boxes on a real screenshot.
+By default we generate a busy screen: rows of text-like glyph boxes, a grid of icons and some larger panels.
+"""
+
+import argparse
+import json
+import random
+import time
+
+from interpreter.core.computer.display.point.box_merging import merge_overlapping_boxes
+
+
+def combine_boxes(icons_bounding_boxes):
+    """
+    find_icon's previous merge, verbatim: passes over every pair until nothing changes.
+    """
+    while True:
+        combined_boxes = []
+        for box in icons_bounding_boxes:
+            for i, combined_box in enumerate(combined_boxes):
+                if (
+                    box["x"] < combined_box["x"] + combined_box["width"]
+                    and box["x"] + box["width"] > combined_box["x"]
+                    and box["y"] < combined_box["y"] + combined_box["height"]
+                    and box["y"] + box["height"] > combined_box["y"]
+                ):
+                    combined_box["x"] = min(box["x"], combined_box["x"])
+                    combined_box["y"] = min(box["y"], combined_box["y"])
+                    combined_box["width"] = (
+                        max(
+                            box["x"] + box["width"],
+                            combined_box["x"] + combined_box["width"],
+                        )
+                        - combined_box["x"]
+                    )
+                    combined_box["height"] = (
+                        max(
+                            box["y"] + box["height"],
+                            combined_box["y"] + combined_box["height"],
+                        )
+                        - combined_box["y"]
+                    )
+                    break
+            else:
+                combined_boxes.append(box.copy())
+        if len(combined_boxes) == len(icons_bounding_boxes):
+            break
+        else:
+            icons_bounding_boxes = combined_boxes
+    return combined_boxes
+
+
+def synthetic_4k_boxes(count, seed=0):
+    rng = random.Random(seed)
+    width, height = 3840, 2160
+    boxes = []
+    while len(boxes) < count:
+        kind = rng.random()
+        if kind < 0.7:
+            # A line of text, one box per glyph (neighbours often touch)
+            x, y = rng.randint(0, width - 600), rng.randint(0, height - 30)
+            for _ in range(rng.randint(5, 40)):
+                w = rng.randint(6, 18)
+                boxes.append(
+                    {"x": x, "y": y, "width": w, "height": rng.randint(14, 24)}
+                )
+                x += w + rng.randint(-2, 6)
+        elif kind < 0.95:
+            # An icon made of a few pieces
+            x, y = rng.randint(0, width - 64), rng.randint(0, height - 64)
+            for _ in range(rng.randint(1, 4)):
+                boxes.append(
+                    {
+                        "x": x + rng.randint(0, 24),
+                        "y": y + rng.randint(0, 24),
+                        "width": rng.randint(10, 40),
+                        "height": rng.randint(10, 40),
+                    }
+                )
+        else:
+            # A panel or button outline
+            boxes.append(
+                {
+                    "x": rng.randint(0, width - 400),
+                    "y": rng.randint(0, height - 200),
+                    "width": rng.randint(80, 400),
+                    "height": rng.randint(30, 200),
+                }
+            )
+    return boxes[:count]
+
+
+def best_of(function, boxes, repeat):
+    times = []
+    for _ in range(repeat):
+        copies = [box.copy() for box in boxes]
+        start = time.perf_counter()
+        result = function(copies)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--boxes", type=int, default=4000)
+    parser.add_argument("--boxes-json")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.boxes_json:
+        with open(args.boxes_json) as file:
+            boxes = json.load(file)
+    else:
+        boxes = synthetic_4k_boxes(args.boxes)
+
+    before, previous = best_of(combine_boxes, boxes, args.repeat)
+    after, result = best_of(merge_overlapping_boxes, boxes, args.repeat)
+
+    # (The previous merge moved x/y before computing the far edges, so its boxes can come out smaller)
+    print(f"{len(boxes)} boxes -> {len(result)} merged ({len(previous)} before)")
+    print(f"fixpoint passes:  {before * 1000:.1f} ms")
+    print(f"sweep/union-find: {after * 1000:.1f} ms ({before / after:.1f}x)")
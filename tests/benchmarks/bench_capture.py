@@ -0,0 +1,99 @@
+"""
+Screen capture frames per second for each available backend, and the cost of building the multi-monitor collage.
+
+    xvfb-run -s "-screen 0 3840x2160x24" python tests/benchmarks/bench_capture.py [--frames 30]
+
+Capture needs a display (a virtual one is fine). Without one, only the collage is timed.
+"""
+
+import argparse
+import os
+import platform
+import time
+
+import numpy as np
+from PIL import Image
+
+from interpreter.core.computer.display.capture import capture_backends, composite_frames
+
+
+def previous_composite(frames):
+    """
+    take_screenshot_to_pil's previous collage, minus its OpenCV colour conversions: the whole collage was turned
+    into an array and back into an image for every monitor.
+    """
+    screenshots = [Image.fromarray(frame) for frame in frames]
+    new_img = Image.new(
+        "RGB",
+        (sum(img.width for img in screenshots), max(img.height for img in screenshots)),
+    )
+    x_offset = 0
+    for img in screenshots:
+        img_array = np.array(img)
+        new_img_array = np.array(new_img)
+        new_img_array[
+            0 : img_array.shape[0], x_offset : x_offset + img_array.shape[1]
+        ] = img_array
+        x_offset += img.width
+        new_img = Image.fromarray(new_img_array)
+    return new_img
+
+
+def best_of(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def capture_fps(backend, frames):
+    backend.grab()  # Connect
+    start = time.perf_counter()
+    for _ in range(frames):
+        backend.grab()
+    grab_only = frames / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        Image.fromarray(backend.grab())
+    to_image = frames / (time.perf_counter() - start)
+    return grab_only, to_image
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--monitors", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if platform.system() != "Linux" or os.getenv("DISPLAY"):
+        for name, backend_class in capture_backends.items():
+            try:
+                backend = backend_class()
+                grab_only, to_image = capture_fps(backend, args.frames)
+            except Exception as e:
+                print(f"{name:10} unavailable ({type(e).__name__}: {e})")
+                continue
+            print(
+                f"{name:10} {grab_only:6.1f} fps as arrays, {to_image:6.1f} fps as PIL images"
+            )
+            backend.close()
+    else:
+        print("No display (try xvfb-run), skipping capture")
+
+    frames = [
+        np.random.default_rng(i).integers(0, 255, (2160, 3840, 3), dtype=np.uint8)
+        for i in range(args.monitors)
+    ]
+    before, previous = best_of(lambda: previous_composite(frames), args.repeat)
+    after, collage = best_of(
+        lambda: Image.fromarray(composite_frames(frames)), args.repeat
+    )
+    assert np.array_equal(np.asarray(previous), np.asarray(collage))
+    print(
+        f"{args.monitors} x 4K collage: previous {before * 1000:.1f} ms, "
+        f"one allocation {after * 1000:.1f} ms ({before / after:.1f}x)"
+    )
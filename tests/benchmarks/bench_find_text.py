@@ -0,0 +1,152 @@
+"""
+Times find_text_in_image on a 4K screen with thousands of words.
+
+    python tests/benchmarks/bench_find_text.py [--words 5000]
+
+OCR itself isn't timed (it runs once per frame and is cached), just what find_text_in_image does with its results.
+"""
+
+import argparse
+import hashlib
+import random
+import string
+import time
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from interpreter.core.computer.utils import computer_vision
+
+
+def previous_matching(d, text):
+    """
+    find_text_in_image's previous matching, without the drawing: a loop over every box, then every pair of word matches.
+    (Minus the halving of the fallback's centers, which was a bug, so the results can be compared.)
+    """
+    centers = []
+    n_boxes = len(d["level"])
+    for i in range(n_boxes):
+        if text.lower() in d["text"][i].lower():
+            start_index = d["text"][i].lower().find(text.lower())
+            start_percentage = start_index / len(d["text"][i])
+            left = d["left"][i] + int(d["width"][i] * start_percentage)
+            text_width_percentage = len(text) / len(d["text"][i])
+            width = int(d["width"][i] * text_width_percentage)
+            centers.append((left + width / 2, d["top"][i] + d["height"][i] / 2))
+
+    if not centers:
+        word_centers = []
+        for word in text.split():
+            for i in range(n_boxes):
+                if word.lower() in d["text"][i].lower():
+                    center = (
+                        d["left"][i] + d["width"][i] / 2,
+                        d["top"][i] + d["height"][i] / 2,
+                    )
+                    word_centers.append(center)
+        for center1 in word_centers:
+            for center2 in word_centers:
+                if (
+                    center1 != center2
+                    and (
+                        (center1[0] - center2[0]) ** 2 + (center1[1] - center2[1]) ** 2
+                    )
+                    ** 0.5
+                    <= 400
+                ):
+                    centers.append(
+                        ((center1[0] + center2[0]) / 2, (center1[1] + center2[1]) / 2)
+                    )
+                    break
+            if centers:
+                break
+    return centers
+
+
+def synthetic_ocr_data(count, seed=0):
+    rng = random.Random(seed)
+    vocabulary = [
+        "".join(rng.choice(string.ascii_letters) for _ in range(rng.randint(2, 10)))
+        for _ in range(2000)
+    ] + ["File", "Edit", "View", "Save", "Settings", "Open", "Recent"] * 20
+    d = {key: [] for key in ["level", "block_num", "par_num", "line_num", "text"]}
+    d.update({key: [] for key in ["left", "top", "width", "height"]})
+    block, line, x, y = 1, 1, 20, 20
+    for _ in range(count):
+        word = rng.choice(vocabulary)
+        width = 12 * len(word)
+        if x + width > 3800:
+            x, y, line = 20, y + 30, line + 1
+            if y > 2100:
+                x, y, block = 20, 20, block + 1
+        for key, value in zip(
+            d.keys(),
+            [5, block, 1, line, word, x, y, width, 20],
+        ):
+            d[key].append(value)
+        x += width + 12
+    return d
+
+
+def best_of(function, args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def previous_find_text(screenshot, d, text):
+    """
+    The previous find_text_in_image around that loop: a grayscale copy, the cache lookup (a blake2b hash of
+    tobytes, then a copy of the data) and an RGB copy to draw on, even without debug. The drawing isn't timed.
+    """
+    gray = screenshot.convert("L")
+    digest = hashlib.blake2b(screenshot.tobytes(), digest_size=16)
+    digest.update(f"{screenshot.size}{screenshot.mode}".encode())
+    digest.hexdigest()
+    d = {name: list(values) for name, values in d.items()}
+    gray.convert("RGB")
+    return previous_matching(d, text)
+
+
+def current_matching(d, index, text):
+    matches = computer_vision.match_text(d, text, index)
+    return matches or computer_vision._nearby_words(d, text, index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    d = synthetic_ocr_data(args.words)
+    screenshot = Image.fromarray(
+        np.random.default_rng(0).integers(0, 255, (2160, 3840, 3), dtype=np.uint8)
+    )
+    # OCR "runs" once, then the frame's data is cached like on a real screen
+    computer_vision.pytesseract = mock.Mock()
+    computer_vision.pytesseract.image_to_data.return_value = d
+    start = time.perf_counter()
+    computer_vision.find_text_in_image(screenshot, "warm up")
+    first = time.perf_counter() - start
+
+    index = computer_vision.text_index(d)
+    print(f"{args.words} words, first query on the frame {first * 1000:.1f} ms")
+    for query in ["settings", "open recent", "edit file view", "not on screen"]:
+        before, previous = best_of(
+            previous_find_text, (screenshot, d, query), args.repeat
+        )
+        after, current = best_of(
+            computer_vision.find_text_in_image, (screenshot, query), args.repeat
+        )
+        matching_before, _ = best_of(previous_matching, (d, query), args.repeat)
+        matching_after, _ = best_of(current_matching, (d, index, query), args.repeat)
+        print(
+            f"{query!r:18} previous {before * 1000:6.1f} ms   now {after * 1000:6.1f} ms"
+            f"   ({len(previous)} -> {len(current)} matches)   matching alone"
+            f" {matching_before * 1000:.2f} -> {matching_after * 1000:.2f} ms"
+        )
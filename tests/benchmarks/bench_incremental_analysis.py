@@ -0,0 +1,115 @@
+"""
+Per-step screen analysis cost, whole frame vs. only the changed regions, over a sequence of synthetic 4K frames
+(a screen of "words", then typing into a field, opening a menu, scrolling a small panel...).
+
+    python tests/benchmarks/bench_incremental_analysis.py [--tesseract] [--steps 20]
+
+By default the analysis is a NumPy stand-in for OCR (boxes of solid dark rectangles), whose cost grows with the
+analyzed area like Tesseract's does. --tesseract runs real OCR instead (needs pytesseract and Tesseract).
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from interpreter.core.computer.utils.incremental_analysis import IncrementalAnalysis
+
+WIDTH, HEIGHT = 3840, 2160
+
+
+def find_rectangles(img):
+    black = np.asarray(img.convert("L")) < 128
+    above = np.zeros_like(black)
+    above[1:] = black[:-1]
+    left = np.zeros_like(black)
+    left[:, 1:] = black[:, :-1]
+    boxes = []
+    for y, x in zip(*np.nonzero(black & ~above & ~left)):
+        width = np.argmin(np.append(black[y, x:], False))
+        height = np.argmin(np.append(black[y:, x], False))
+        boxes.append({"left": int(x), "top": int(y), "width": width, "height": height})
+    return boxes
+
+
+def tesseract_words(img):
+    import pytesseract
+
+    data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+    return [
+        {key: data[key][i] for key in ["left", "top", "width", "height", "text"]}
+        for i in range(len(data["text"]))
+        if data["level"][i] == 5
+    ]
+
+
+def frames(steps, seed=0):
+    rng = random.Random(seed)
+    # Lines of words, in a few windows side by side
+    words = []
+    for window_left in range(40, WIDTH - 1200, 1260):
+        for y in range(200, HEIGHT - 100, 32):
+            x = window_left
+            while x < window_left + 1100:
+                width = rng.randint(20, 140)
+                words.append((x, y, width, rng.randint(12, 20)))
+                x += width + rng.randint(10, 16)
+
+    def render(extra):
+        img = Image.new("RGB", (WIDTH, HEIGHT), "white")
+        draw = ImageDraw.Draw(img)
+        for x, y, w, h in words + extra:
+            draw.rectangle((x, y, x + w - 1, y + h - 1), fill="black")
+        return img
+
+    typed = []
+    for step in range(steps):
+        if step % 5 == 4:
+            # Open a menu
+            x, y = rng.randrange(0, WIDTH - 400), rng.randrange(0, HEIGHT - 600)
+            menu = [(x, y + 30 * i, 300, 20) for i in range(15)]
+            yield render(typed + menu)
+        else:
+            # Type a word into a text field
+            typed.append((200 + 90 * len(typed), 100, 80, 18))
+            yield render(typed)
+
+
+def time_steps(analyze, images, incremental):
+    analysis = IncrementalAnalysis()
+    times, results = [], []
+    for img in images:
+        start = time.perf_counter()
+        if incremental:
+            boxes = analysis.run("ocr", img, analyze)
+        else:
+            boxes = analyze(img)
+        times.append(time.perf_counter() - start)
+        results.append(sorted(tuple(sorted(box.items())) for box in boxes))
+    return times, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--tesseract", action="store_true")
+    args = parser.parse_args()
+
+    analyze = tesseract_words if args.tesseract else find_rectangles
+    images = list(frames(args.steps))
+
+    full, full_results = time_steps(analyze, images, incremental=False)
+    incremental, incremental_results = time_steps(analyze, images, incremental=True)
+
+    print("step   whole frame   changed regions")
+    for step, (a, b) in enumerate(zip(full, incremental)):
+        print(f"{step:4d}   {a * 1000:8.1f} ms   {b * 1000:8.1f} ms")
+    # The first step analyzes the whole frame either way
+    print(
+        f"mean after the first frame: {np.mean(full[1:]) * 1000:.1f} ms -> "
+        f"{np.mean(incremental[1:]) * 1000:.1f} ms"
+    )
+    same = sum(a == b for a, b in zip(full_results, incremental_results))
+    print(f"same boxes as the whole frame analysis: {same}/{len(images)} steps")
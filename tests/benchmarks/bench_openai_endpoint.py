@@ -0,0 +1,97 @@
+"""
+Load test for the OpenAI-compatible endpoint: many clients stream /openai/chat/completions at once (each in its own
+session) from a stub LLM, while we keep checking how quickly /heartbeat answers.
+
+    python tests/benchmarks/bench_openai_endpoint.py [--clients 8] [--tokens 20] [--delay 0.02]
+
+Runs the server in-process (no network needed). The stub LLM blocks for --delay seconds per token, like a real one.
+If streams ran on the event loop, they'd run one after another and heartbeats would wait for them.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from interpreter.core.async_core import AsyncInterpreter
+
+
+def stub_interpreter(tokens, delay):
+    def completions(**params):
+        for i in range(tokens):
+            time.sleep(delay)
+            yield {"choices": [{"delta": {"content": f" token{i}"}}]}
+
+    interpreter = AsyncInterpreter()
+    interpreter.llm.completions = completions
+    interpreter.llm.model = "stub"
+    interpreter.llm.supports_functions = False
+    interpreter.llm.context_window = 8000
+    interpreter.llm.max_tokens = 1000
+    interpreter.conversation_history = False
+    interpreter.disable_telemetry = True
+    return interpreter
+
+
+async def load_test(clients, tokens, delay):
+    server = stub_interpreter(tokens, delay).server
+    server.sessions.factory = lambda: stub_interpreter(tokens, delay)
+    server.sessions.max_sessions = clients
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://test", timeout=None
+    ) as client:
+        done = asyncio.Event()
+
+        async def stream(session):
+            start = time.perf_counter()
+            response = await client.post(
+                "/openai/chat/completions",
+                json={"messages": [{"role": "user", "content": "Hi"}], "stream": True},
+                headers={"X-Session-ID": session},
+            )
+            assert response.text.count("data: ") >= tokens, response.text
+            return time.perf_counter() - start
+
+        async def heartbeats():
+            latencies = []
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/heartbeat")
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.05)
+            return latencies
+
+        await stream("warmup")  # Imports and caches
+        alone = await stream("alone")
+
+        monitor = asyncio.create_task(heartbeats())
+        start = time.perf_counter()
+        await asyncio.gather(*(stream(f"client-{i}") for i in range(clients)))
+        total = time.perf_counter() - start
+        done.set()
+        latencies = await monitor
+    return alone, total, latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    alone, total, latencies = asyncio.run(
+        load_test(args.clients, args.tokens, args.delay)
+    )
+    print(
+        f"{args.clients} streams of {args.tokens} tokens: {total:.2f} s at once, "
+        f"{alone:.2f} s for one stream alone ({args.clients * alone / total:.1f}x faster than one after another)"
+    )
+    print(
+        f"heartbeat latency during load: median {statistics.median(latencies) * 1000:.1f} ms, "
+        f"max {max(latencies) * 1000:.1f} ms ({len(latencies)} checks)"
+    )
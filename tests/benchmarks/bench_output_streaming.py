@@ -0,0 +1,87 @@
+"""
+Websocket streaming throughput: a stub LLM streams many small tokens as fast as it can, and we count the frames and
+bytes the client receives, with chunk coalescing off and on.
+
+    python tests/benchmarks/bench_output_streaming.py [--tokens 5000] [--windows 0,15] [--repeat 3]
+
+Runs the server in-process (no network needed). --windows are coalescing windows in milliseconds (0 turns it off).
+"""
+
+import argparse
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+from interpreter.core.async_core import AsyncInterpreter
+
+
+def stub_interpreter(tokens, window):
+    def completions(**params):
+        for i in range(tokens):
+            yield {"choices": [{"delta": {"content": f" t{i}"}}]}
+
+    interpreter = AsyncInterpreter()
+    interpreter.llm.completions = completions
+    interpreter.llm.model = "stub"
+    interpreter.llm.supports_functions = False
+    interpreter.llm.context_window = 8000
+    interpreter.llm.max_tokens = 1000
+    interpreter.conversation_history = False
+    interpreter.disable_telemetry = True
+    interpreter.coalesce_window = window
+    return interpreter
+
+
+def stream(tokens, window):
+    server = stub_interpreter(tokens, window).server
+    server.sessions.factory = lambda: stub_interpreter(tokens, window)
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/") as websocket:
+            websocket.send_text(json.dumps({"auth": "dummy-api-key"}))
+            assert json.loads(websocket.receive_text()) == {"auth": True}
+
+            start = time.perf_counter()
+            websocket.send_text(json.dumps({"role": "user", "start": True}))
+            websocket.send_text(
+                json.dumps({"role": "user", "type": "message", "content": "Hi"})
+            )
+            websocket.send_text(json.dumps({"role": "user", "end": True}))
+
+            frames = 0
+            size = 0
+            content = ""
+            while True:
+                text = websocket.receive_text()
+                frames += 1
+                size += len(text)
+                message = json.loads(text)
+                if message.get("role") == "server" and message.get("type") in (
+                    "status",
+                    "error",
+                ):
+                    break
+                if message.get("type") == "message" and "content" in message:
+                    content += message["content"]
+            seconds = time.perf_counter() - start
+
+    assert content.count(" t") == tokens, content[:200]
+    return seconds, frames, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=5000)
+    parser.add_argument("--windows", default="0,15")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for window in [float(ms) for ms in args.windows.split(",")]:
+        seconds, frames, size = min(
+            stream(args.tokens, window / 1000) for _ in range(args.repeat)
+        )
+        print(
+            f"window {window:4.0f} ms: {seconds:6.2f} s, {frames:6d} frames "
+            f"({frames / seconds:8.0f} frames/s), {size / seconds / 1024:7.0f} KiB/s, "
+            f"{args.tokens / seconds:8.0f} tokens/s"
+        )
@@ -0,0 +1,179 @@
+"""
+Speed and accuracy of point.py's icon embeddings: full precision CLIP against the int8 CPU fast path
+(quantized vision tower, tuned thread count, crops resized before batching, and non-icon crops filtered out).
+
+    python tests/benchmarks/bench_point_embeddings.py [--crops-dir crops/] [--repeat 3]
+
+Needs torch and sentence-transformers. --crops-dir takes PNG crops named after what they show, like
+"close_1.png" or "settings-gear_2.png" (searched for as "close icon" and "settings gear icon"). By default we draw a
+fixed set of simple icons at a few sizes, plus the text strips and slivers that find_icon's boxes often contain.
+Accuracy is how often searching for an icon's label ranks that icon first.
+"""
+
+import argparse
+import copy
+import os
+import random
+import time
+
+from PIL import Image, ImageDraw
+
+from interpreter.core.computer.display.point.cpu_inference import (
+    prefilter_icons,
+    prepare_crops,
+    quantize_clip,
+    tune_threads,
+)
+
+shapes = {
+    "red circle": lambda draw, s: draw.ellipse(
+        (s // 5, s // 5, s * 4 // 5, s * 4 // 5), fill="red"
+    ),
+    "green triangle": lambda draw, s: draw.polygon(
+        [(s // 5, s * 4 // 5), (s // 2, s // 5), (s * 4 // 5, s * 4 // 5)], fill="green"
+    ),
+    "blue square": lambda draw, s: draw.rectangle(
+        (s // 5, s // 5, s * 4 // 5, s * 4 // 5), fill="blue"
+    ),
+    "close x": lambda draw, s: [
+        draw.line(
+            (s // 5, s // 5, s * 4 // 5, s * 4 // 5),
+            fill="black",
+            width=max(2, s // 10),
+        ),
+        draw.line(
+            (s // 5, s * 4 // 5, s * 4 // 5, s // 5),
+            fill="black",
+            width=max(2, s // 10),
+        ),
+    ],
+    "plus sign": lambda draw, s: [
+        draw.line(
+            (s // 2, s // 5, s // 2, s * 4 // 5), fill="black", width=max(2, s // 10)
+        ),
+        draw.line(
+            (s // 5, s // 2, s * 4 // 5, s // 2), fill="black", width=max(2, s // 10)
+        ),
+    ],
+    "magnifying glass search": lambda draw, s: [
+        draw.ellipse(
+            (s // 5, s // 5, s * 3 // 5, s * 3 // 5),
+            outline="black",
+            width=max(2, s // 12),
+        ),
+        draw.line(
+            (s * 11 // 20, s * 11 // 20, s * 4 // 5, s * 4 // 5),
+            fill="black",
+            width=max(2, s // 10),
+        ),
+    ],
+    "yellow star": lambda draw, s: draw.regular_polygon(
+        (s // 2, s // 2, s // 3), 5, fill="gold"
+    ),
+    "hamburger menu": lambda draw, s: [
+        draw.rectangle((s // 5, y, s * 4 // 5, y + max(2, s // 12)), fill="black")
+        for y in (s // 4, s // 2 - s // 24, s * 3 // 4 - s // 12)
+    ],
+}
+
+
+def synthetic_crops():
+    crops = []
+    for label, draw_shape in shapes.items():
+        for size in (24, 32, 48, 64):
+            img = Image.new("RGB", (size, size), "white")
+            draw_shape(ImageDraw.Draw(img), size)
+            crops.append((label, img))
+
+    # What else find_icon's boxes catch: text fields, toolbars and slivers of borders
+    rng = random.Random(0)
+    for _ in range(32):
+        width, height = rng.choice([(300, 24), (500, 30), (8, 40), (12, 12), (200, 18)])
+        img = Image.new("RGB", (width, height), "white")
+        ImageDraw.Draw(img).text(
+            (2, 2), "File Edit View Window Help"[: width // 8], fill="black"
+        )
+        crops.append((None, img))
+    return crops
+
+
+def crops_from_dir(path):
+    crops = []
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(".png"):
+            label = name.rsplit(".", 1)[0].rsplit("_", 1)[0].replace("-", " ")
+            crops.append((label, Image.open(os.path.join(path, name)).convert("RGB")))
+    return crops
+
+
+def best_of(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def accuracy(model, labels, embeds, util):
+    queries = sorted(set(label for label in labels if label))
+    query_embeds = model.encode(
+        [f"{query} icon" for query in queries], convert_to_tensor=True
+    )
+    correct = 0
+    for query, query_embed in zip(queries, query_embeds):
+        hits = util.semantic_search(query_embed, embeds, top_k=1)[0]
+        correct += labels[hits[0]["corpus_id"]] == query
+    return correct / len(queries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--crops-dir")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    import torch
+    from sentence_transformers import SentenceTransformer, util
+
+    crops = crops_from_dir(args.crops_dir) if args.crops_dir else synthetic_crops()
+    labels = [label for label, _ in crops]
+    images = [img for _, img in crops]
+
+    full = SentenceTransformer("clip-ViT-B-32", device="cpu")
+    fast = quantize_clip(copy.deepcopy(full), torch)
+
+    full_time, full_embeds = best_of(
+        lambda: full.encode(images, batch_size=128, convert_to_tensor=True), args.repeat
+    )
+    full_accuracy = accuracy(full, labels, full_embeds, util)
+
+    threads = tune_threads(torch)
+    icons = prefilter_icons(
+        [
+            {"width": img.width, "height": img.height, "index": i}
+            for i, img in enumerate(images)
+        ]
+    )
+    kept = [icon["index"] for icon in icons]
+    fast_time, fast_embeds = best_of(
+        lambda: fast.encode(
+            prepare_crops([images[i] for i in kept]),
+            batch_size=128,
+            convert_to_tensor=True,
+        ),
+        args.repeat,
+    )
+    fast_accuracy = accuracy(fast, [labels[i] for i in kept], fast_embeds, util)
+
+    similarity = torch.nn.functional.cosine_similarity(
+        full_embeds[kept], fast_embeds
+    ).mean()
+    print(f"{len(images)} crops, {len(kept)} kept by the prefilter, {threads} threads")
+    print(
+        f"full precision {full_time * 1000:7.1f} ms, top-1 accuracy {full_accuracy:.0%}"
+    )
+    print(
+        f"int8 fast path {fast_time * 1000:7.1f} ms, top-1 accuracy {fast_accuracy:.0%} "
+        f"({full_time / fast_time:.1f}x, mean cosine similarity to full precision {similarity:.3f})"
+    )
@@ -0,0 +1,150 @@
+"""
+Bytes on the wire and encode / decode time for the websocket's JSON and msgpack protocols, over a synthetic OS-mode
+session transcript: streamed messages and code, console output, and a screenshot after each action.
+
+    python tests/benchmarks/bench_websocket_framing.py [--steps 20] [--width 1920] [--height 1080] [--repeat 5]
+
+Encoding is what the server does to each output (JSON: json.dumps, msgpack: images from base64 to raw bytes,
+then msgpack.packb). Decoding is what a client does to get the screenshots' bytes back (JSON: json.loads and
+base64-decoding images, msgpack: msgpack.unpackb). Needs msgpack for the msgpack numbers.
+"""
+
+import argparse
+import base64
+import io
+import json
+import random
+import time
+
+from PIL import Image, ImageDraw
+
+from interpreter.core.async_core import _to_binary, msgpack
+
+
+def screenshot(width, height, rng):
+    """
+    A desktop-like picture: flat windows with title bars and lines of "text", which compresses like a real screen.
+    """
+    img = Image.new("RGB", (width, height), (40, 60, 90))
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x, y = rng.randrange(width // 2), rng.randrange(height // 2)
+        w, h = rng.randrange(300, width // 2), rng.randrange(200, height // 2)
+        draw.rectangle((x, y, x + w, y + h), fill="white", outline="gray")
+        draw.rectangle((x, y, x + w, y + 24), fill=(220, 220, 220))
+        for line in range(y + 32, y + h - 12, 16):
+            draw.text((x + 8, line), "lorem ipsum dolor sit amet " * 3, fill="black")
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def transcript(steps, width, height):
+    rng = random.Random(0)
+    outputs = []
+
+    def stream(role, type, text, format=None):
+        flags = {"role": role, "type": type}
+        if format:
+            flags["format"] = format
+        outputs.append({**flags, "start": True})
+        for word in text.split(" "):
+            outputs.append({**flags, "content": word + " "})
+        outputs.append({**flags, "end": True})
+
+    for step in range(steps):
+        stream(
+            "assistant",
+            "message",
+            "Let me click the settings button and check it worked.",
+        )
+        stream(
+            "assistant",
+            "code",
+            f"computer.mouse.click('Settings')  # step {step}",
+            "python",
+        )
+        for line in range(3):
+            outputs.append(
+                {
+                    "role": "computer",
+                    "type": "console",
+                    "format": "active_line",
+                    "content": line,
+                }
+            )
+        stream("computer", "console", "Clicked at (1204, 88) " * 3, "output")
+        outputs.append(
+            {
+                "role": "computer",
+                "type": "image",
+                "format": "base64.png",
+                "content": screenshot(width, height, rng),
+            }
+        )
+    outputs.append({"role": "server", "type": "status", "content": "complete"})
+    return outputs
+
+
+def json_encode(output):
+    return json.dumps(output)
+
+
+def json_decode(frame):
+    output = json.loads(frame)
+    if output.get("format") == "base64.png":
+        output["content"] = base64.b64decode(output["content"])
+    return output
+
+
+def msgpack_encode(output):
+    return msgpack.packb(_to_binary(output))
+
+
+def msgpack_decode(frame):
+    return msgpack.unpackb(frame)
+
+
+def best_of(function, items, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [function(item) for item in items]
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, results
+
+
+def measure(name, encode, decode, outputs, repeat):
+    encode_seconds, frames = best_of(encode, outputs, repeat)
+    decode_seconds, _ = best_of(decode, frames, repeat)
+    size = sum(
+        len(frame.encode() if isinstance(frame, str) else frame) for frame in frames
+    )
+    print(
+        f"{name:8} {size / 1024 / 1024:8.2f} MiB  encode {encode_seconds * 1000:7.1f} ms  "
+        f"decode {decode_seconds * 1000:7.1f} ms"
+    )
+    return size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    outputs = transcript(args.steps, args.width, args.height)
+    print(
+        f"{len(outputs)} outputs, {args.steps} screenshots of {args.width}x{args.height}"
+    )
+    json_size = measure("json", json_encode, json_decode, outputs, args.repeat)
+    if msgpack is None:
+        print("msgpack isn't installed (pip install msgpack)")
+    else:
+        msgpack_size = measure(
+            "msgpack", msgpack_encode, msgpack_decode, outputs, args.repeat
+        )
+        print(f"msgpack sends {1 - msgpack_size / json_size:.0%} fewer bytes")
@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_paths(tmp_path, monkeypatch):
+    # Keep tests away from (and independent of) the real on-disk caches
+    monkeypatch.setenv(
+        "INTERPRETER_MODEL_METADATA_PATH", str(tmp_path / "model_metadata.json")
+    )
+    monkeypatch.setenv(
+        "OI_POINT_EMBEDDING_CACHE_PATH", str(tmp_path / "icon_embeddings")
+    )
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from interpreter.core.computer.ai.ai import Ai, fast_llm, split_into_chunks
+from interpreter.core.llm.llm import Llm
+
+
+class FakeLlm(Llm):
+    def __init__(self):
+        self.interpreter = mock.Mock(spec=[])
+        self.model = "gpt-4o"
+        self.api_key = None
+        self.api_base = None
+        self.api_version = None
+        self.max_tokens = None
+        self.temperature = 0
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def load(self):
+        self._is_loaded = True
+
+    def completions(self, **params):
+        with self._lock:
+            self.calls.append(params["messages"])
+        system, user = (
+            params["messages"][0]["content"],
+            params["messages"][1]["content"],
+        )
+        yield {"choices": [{"delta": {"content": f"{system}:{len(user)}"}}]}
+
+
+class TestAi(unittest.TestCase):
+    def setUp(self):
+        self.llm = FakeLlm()
+        self.computer = mock.Mock()
+        self.computer.interpreter.llm = self.llm
+        self.computer.interpreter.messages = ["untouched"]
+        self.ai = Ai(self.computer)
+        self.ai.chunk_size = 50
+        self.ai.chunk_overlap = 0
+
+        # Count ~4 characters per token, so tests don't need tiktoken's downloads
+        patcher = mock.patch(
+            "interpreter.core.computer.ai.ai.get_encoding", return_value=None
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fast_llm_resolves_the_model_like_run(self):
+        self.llm.model = "i"
+        self.llm.calls_params = []
+        self.llm.completions = lambda **params: (
+            self.llm.calls_params.append(params)
+            or iter([{"choices": [{"delta": {"content": "ok"}}]}])
+        )
+
+        self.assertEqual(fast_llm(self.llm, "system", "user"), "ok")
+        params = self.llm.calls_params[0]
+        self.assertEqual(params["model"], "openai/i")
+        self.assertEqual(params["api_base"], "https://api.openinterpreter.com/v0")
+        self.assertEqual(
+            params["conversation_id"], self.llm.interpreter.conversation_id
+        )
+
+    def test_cache_is_keyed_on_endpoint_settings(self):
+        text = "".join(f"line number {i} of the document\n" for i in range(200))
+        self.ai.query(text, "map", "reduce")
+        calls = len(self.llm.calls)
+
+        self.llm.temperature = 0.5
+        self.ai.query(text, "map", "reduce")
+        self.assertEqual(len(self.llm.calls), 2 * calls)
+
+    def test_chunks_respect_the_token_limit(self):
+        text = "".join(f"line number {i} of the document\n" for i in range(500))
+        chunks = split_into_chunks(text, 50, self.llm, 0)
+        self.assertEqual("".join(chunks), text)
+        self.assertTrue(all(len(chunk) <= 50 * 8 for chunk in chunks))
+
+    def test_query_is_stateless(self):
+        text = "".join(f"line number {i} of the document\n" for i in range(200))
+        response = self.ai.query(text, "map", "reduce")
+
+        self.assertTrue(response.startswith("reduce:"))
+        self.assertEqual(self.computer.interpreter.messages, ["untouched"])
+
+    def test_unchanged_chunks_come_from_the_cache(self):
+        text = "".join(f"line number {i} of the document\n" for i in range(200))
+        self.ai.query(text, "map", "reduce")
+        first_map_calls = [c for c in self.llm.calls if c[0]["content"] == "map"]
+
+        self.llm.calls = []
+        edited = text.replace("line number 150 ", "line number one hundred fifty ")
+        self.ai.query(edited, "map", "reduce")
+        second_map_calls = [c for c in self.llm.calls if c[0]["content"] == "map"]
+
+        self.assertLess(len(second_map_calls), len(first_map_calls))
+
+    def test_stream_yields_partial_responses(self):
+        text = "".join(f"line number {i} of the document\n" for i in range(200))
+        responses = list(self.ai.query(text, "map", "reduce", stream=True))
+
+        self.assertGreater(len(responses), 1)
+        self.assertEqual(responses[-1], self.ai.query(text, "map", "reduce"))
+
+    def test_summarize_stream_builds_a_tree(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "big.log")
+            with open(path, "w") as file:
+                for i in range(2000):
+                    file.write(f"log line {i}: something happened\n")
+
+            summaries = list(self.ai.summarize_stream(path, fan_in=3))
+
+        self.assertTrue(summaries[-1]["final"])
+        self.assertEqual(sum(summary["final"] for summary in summaries), 1)
+        self.assertGreater(max(summary["level"] for summary in summaries), 1)
+        self.assertEqual(summaries[0]["level"], 0)
+
+    def test_summarize_stream_accepts_iterators(self):
+        lines = (f"line {i}\n" for i in range(100))
+        summaries = list(self.ai.summarize_stream(lines))
+        self.assertTrue(summaries[-1]["final"])
+        self.assertEqual(list(self.ai.summarize_stream(iter([]))), [])
+
+    def test_summarize_stream_yields_a_single_chunk_once(self):
+        summaries = list(self.ai.summarize_stream("just one short line\n"))
+        self.assertEqual(len(summaries), 1)
+        self.assertTrue(summaries[0]["final"])
+        self.assertEqual(summaries[0]["level"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import random
+from unittest import TestCase
+
+from interpreter.core.computer.display.point.box_merging import (
+    boxes_overlap,
+    merge_overlapping_boxes,
+)
+
+
+def combine_boxes(boxes):
+    """
+    The pass-until-nothing-changes merge find_icon used before, as a reference.
+    """
+    while True:
+        combined_boxes = []
+        for box in boxes:
+            for combined_box in combined_boxes:
+                if boxes_overlap(box, combined_box):
+                    right = max(
+                        box["x"] + box["width"],
+                        combined_box["x"] + combined_box["width"],
+                    )
+                    bottom = max(
+                        box["y"] + box["height"],
+                        combined_box["y"] + combined_box["height"],
+                    )
+                    combined_box["x"] = min(box["x"], combined_box["x"])
+                    combined_box["y"] = min(box["y"], combined_box["y"])
+                    combined_box["width"] = right - combined_box["x"]
+                    combined_box["height"] = bottom - combined_box["y"]
+                    break
+            else:
+                combined_boxes.append(box.copy())
+        if len(combined_boxes) == len(boxes):
+            return combined_boxes
+        boxes = combined_boxes
+
+
+class TestBoxMerging(TestCase):
+    def test_matches_the_fixpoint_merge(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            size = rng.choice([50, 200, 1000])
+            boxes = [
+                {
+                    "x": rng.randint(0, size),
+                    "y": rng.randint(0, size),
+                    "width": rng.randint(0, 60),
+                    "height": rng.randint(0, 60),
+                    "center_x": i,
+                }
+                for i in range(rng.randint(0, 40))
+            ]
+            self.assertEqual(
+                merge_overlapping_boxes(boxes), combine_boxes(boxes), boxes
+            )
+
+    def test_chain_of_merges(self):
+        # a and b merge, and only their combined box reaches c
+        boxes = [
+            {"x": 0, "y": 0, "width": 10, "height": 10},
+            {"x": 5, "y": 5, "width": 10, "height": 10},
+            {"x": 12, "y": 0, "width": 5, "height": 3},
+            {"x": 100, "y": 100, "width": 5, "height": 5},
+        ]
+        self.assertEqual(
+            merge_overlapping_boxes(boxes),
+            [
+                {"x": 0, "y": 0, "width": 17, "height": 15},
+                {"x": 100, "y": 100, "width": 5, "height": 5},
+            ],
+        )
@@ -0,0 +1,63 @@
+import os
+import types
+from unittest import TestCase, mock
+
+from PIL import Image
+
+from interpreter.core.computer.display.point import cpu_inference
+
+
+class TestCpuInference(TestCase):
+    def test_enabled_by_setting(self):
+        cpu, cuda = types.SimpleNamespace(type="cpu"), types.SimpleNamespace(
+            type="cuda"
+        )
+        with mock.patch.dict(os.environ, {"OI_POINT_CPU_FAST": "False"}):
+            self.assertFalse(cpu_inference.cpu_fast_path_enabled(cpu))
+        with mock.patch.dict(os.environ, {"OI_POINT_CPU_FAST": "auto"}):
+            self.assertTrue(cpu_inference.cpu_fast_path_enabled(cpu))
+            self.assertFalse(cpu_inference.cpu_fast_path_enabled(cuda))
+        with mock.patch.dict(os.environ, {"OI_POINT_CPU_FAST": "True"}):
+            self.assertTrue(cpu_inference.cpu_fast_path_enabled(cuda))
+
+    def test_prefilter_drops_strips_and_slivers(self):
+        icons = [
+            {"width": 32, "height": 32},
+            {"width": 400, "height": 20},  # A text field
+            {"width": 12, "height": 12},  # Too small
+            {"width": 60, "height": 20},
+        ]
+        self.assertEqual(
+            cpu_inference.prefilter_icons(icons, max_aspect=4, min_area=200),
+            [icons[0], icons[3]],
+        )
+
+    def test_prepare_crops_matches_clip_preprocessing(self):
+        crop = Image.new("RGBA", (60, 20), (255, 0, 0, 255))
+        crop.paste((0, 0, 255, 255), (0, 0, 20, 20))  # Cut off by the center crop
+        (prepared,) = cpu_inference.prepare_crops([crop])
+        self.assertEqual(prepared.size, (224, 224))
+        self.assertEqual(prepared.mode, "RGB")
+        self.assertEqual(prepared.getpixel((30, 112)), (255, 0, 0))
+
+    def test_quantizes_the_vision_tower(self):
+        torch = mock.Mock()
+        torch.ao.quantization.quantize_dynamic.side_effect = lambda module, *a, **k: (
+            "int8 " + module
+        )
+        clip = types.SimpleNamespace(
+            vision_model="vision", visual_projection="projection", text_model="text"
+        )
+        model = [types.SimpleNamespace(model=clip)]
+
+        cpu_inference.quantize_clip(model, torch)
+
+        self.assertEqual(clip.vision_model, "int8 vision")
+        self.assertEqual(clip.visual_projection, "int8 projection")
+        self.assertEqual(clip.text_model, "text")
+
+    def test_threads(self):
+        torch = mock.Mock()
+        with mock.patch.dict(os.environ, {"OI_POINT_TORCH_THREADS": "3"}):
+            self.assertEqual(cpu_inference.tune_threads(torch), 3)
+        torch.set_num_threads.assert_called_once_with(3)
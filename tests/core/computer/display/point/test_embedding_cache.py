@@ -0,0 +1,68 @@
+import tempfile
+from unittest import TestCase, mock
+
+import numpy as np
+
+from interpreter.core.computer.display.point.embedding_cache import EmbeddingCache
+
+
+class TestEmbeddingCache(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def new_cache(self, entries=3):
+        return EmbeddingCache(
+            self.temp_dir.name, dim=4, max_size_mb=entries * 4 * 4 / 1024 / 1024
+        )
+
+    def test_persists_across_instances(self):
+        self.new_cache().set_many({"a": np.arange(4), "b": np.ones(4)})
+
+        found = self.new_cache().get_many(["a", "b", "c"])
+        self.assertEqual(set(found), {"a", "b"})
+        np.testing.assert_array_equal(found["a"], np.arange(4, dtype=np.float32))
+
+    def test_evicts_least_recently_used(self):
+        cache = self.new_cache(entries=2)
+        cache.set_many({"a": np.zeros(4)})
+        cache.set_many({"b": np.zeros(4)})
+        cache.get_many(["a"])  # "b" is now the least recently used
+        cache.set_many({"c": np.ones(4)})
+
+        self.assertEqual(
+            set(self.new_cache(entries=2).get_many(["a", "b", "c"])), {"a", "c"}
+        )
+
+    def test_other_settings_start_over(self):
+        self.new_cache(entries=2).set_many({"a": np.zeros(4)})
+        self.assertEqual(len(self.new_cache(entries=3)), 0)
+
+    def test_caches_sharing_a_path_use_different_rows(self):
+        # (Like two processes: each has its own copy of the index)
+        first, second = self.new_cache(), self.new_cache()
+        first.get_many(["x"])
+        second.get_many(["x"])
+        first.set_many({"a": np.zeros(4)})
+        second.set_many({"b": np.ones(4)})
+
+        found = self.new_cache().get_many(["a", "b"])
+        np.testing.assert_array_equal(found["a"], np.zeros(4))
+        np.testing.assert_array_equal(found["b"], np.ones(4))
+
+    def test_index_is_only_written_when_rows_change(self):
+        cache = EmbeddingCache(
+            self.temp_dir.name, dim=4, max_size_mb=0.001, flush_interval=60
+        )
+        cache.set_many({"a": np.zeros(4)})
+        with mock.patch.object(
+            cache, "_write_index", wraps=cache._write_index
+        ) as write_index:
+            cache.get_many(["a"])
+            cache.set_many({"a": np.ones(4)})
+            self.assertEqual(write_index.call_count, 0)
+            cache.set_many({"b": np.ones(4)})
+            self.assertEqual(write_index.call_count, 1)
+            cache.get_many(["a"])
+            cache.flush()
+            self.assertEqual(write_index.call_count, 2)
@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+import types
+from unittest import TestCase, mock
+
+import numpy as np
+from PIL import Image
+
+from interpreter.core.computer.display import capture, display
+
+
+class FakeShot:
+    def __init__(self, monitor):
+        self.width, self.height = monitor["width"], monitor["height"]
+        bgra = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        bgra[..., 0] = 30  # Blue
+        bgra[..., 1] = 20  # Green
+        bgra[..., 2] = 10  # Red
+        bgra[..., 3] = 255
+        self.raw = bytearray(bgra.tobytes())
+
+
+def fake_mss_module():
+    screen = mock.Mock()
+    screen.monitors = [{"left": 0, "top": 0, "width": 8, "height": 6}]
+    screen.grab.side_effect = FakeShot
+    return types.SimpleNamespace(mss=mock.Mock(return_value=screen)), screen
+
+
+class TestCaptureBackends(TestCase):
+    def test_mss_frames_are_rgb_views(self):
+        module, screen = fake_mss_module()
+        with mock.patch.dict(sys.modules, {"mss": module}):
+            backend = capture.get_capture_backend("mss")
+
+        frame = backend.grab(region=(1, 2, 4, 3))
+        screen.grab.assert_called_with({"left": 1, "top": 2, "width": 4, "height": 3})
+        self.assertEqual(frame.shape, (3, 4, 3))
+        self.assertEqual(frame[0, 0].tolist(), [10, 20, 30])
+        self.assertFalse(frame.flags.owndata)
+        self.assertEqual(Image.fromarray(frame).getpixel((0, 0)), (10, 20, 30))
+
+        self.assertEqual(backend.grab().shape, (6, 8, 3))
+        # One display connection per thread, reused between grabs
+        self.assertEqual(module.mss.call_count, 1)
+
+    def test_auto_falls_back_to_pyautogui(self):
+        with mock.patch.dict(sys.modules, {"mss": None}):
+            self.assertIsInstance(
+                capture.get_capture_backend(), capture.PyautoguiCapture
+            )
+            with mock.patch.dict(os.environ, {"OI_CAPTURE_BACKEND": "pyautogui"}):
+                self.assertEqual(capture.get_capture_backend().name, "pyautogui")
+        with self.assertRaises(ValueError):
+            capture.get_capture_backend("scrot")
+
+
+class TestCompositeFrames(TestCase):
+    def test_lays_frames_out_left_to_right(self):
+        frames = [
+            np.full((4, 5, 3), 50, dtype=np.uint8),
+            np.full((2, 3, 4), 200, dtype=np.uint8),
+        ]
+        collage = capture.composite_frames(frames)
+
+        self.assertEqual(collage.shape, (4, 8, 3))
+        self.assertTrue((collage[:, :5] == 50).all())
+        self.assertTrue((collage[:2, 5:] == 200).all())
+        self.assertTrue((collage[2:, 5:] == 0).all())
+
+    def test_labels_each_frame(self):
+        frames = [np.zeros((100, 200, 3), dtype=np.uint8) for _ in range(2)]
+        collage = capture.composite_frames(frames, ["Primary Monitor", "Monitor 1"])
+        self.assertTrue(collage[:, :200].any())
+        self.assertTrue(collage[:, 200:].any())
+
+    def test_take_screenshot_of_all_screens(self):
+        monitors = [
+            types.SimpleNamespace(x=0, y=0, width=6, height=4),
+            types.SimpleNamespace(x=6, y=0, width=3, height=2),
+        ]
+        backend = mock.Mock()
+        backend.grab.side_effect = lambda region: np.full(
+            (region[3], region[2], 3), region[0] + 1, dtype=np.uint8
+        )
+
+        with mock.patch.object(display, "screeninfo") as screeninfo:
+            screeninfo.get_monitors.return_value = monitors
+            with mock.patch.object(capture, "_draw_labels") as draw_labels:
+                collage = display.take_screenshot_to_pil(-1, capture=backend)
+            separate = display.take_screenshot_to_pil(
+                -1, combine_screens=False, capture=backend
+            )
+
+        self.assertEqual(collage.size, (9, 4))
+        self.assertEqual(collage.getpixel((7, 0)), (7, 7, 7))
+        self.assertEqual(draw_labels.call_args[0][2], ["Primary Monitor", "Monitor 1"])
+        self.assertEqual([img.size for img in separate], [(6, 4), (3, 2)])
+
+
+class CountingCapture:
+    """
+    Frames that change for the first `changes` grabs, then stay the same.
+    """
+
+    def __init__(self, changes=0, shape=(40, 80, 3)):
+        self.changes = changes
+        self.shape = shape
+        self.grabs = 0
+
+    def grab(self, region=None):
+        self.grabs += 1
+        return np.full(self.shape, min(self.grabs, self.changes + 1), dtype=np.uint8)
+
+
+class TestBackgroundCapture(TestCase):
+    def test_keeps_the_last_few_frames(self):
+        background = capture.BackgroundCapture(CountingCapture(changes=100), fps=200)
+        background.start()
+        self.addCleanup(background.stop)
+
+        first = background.wait_for_frame(timeout=5)
+        self.assertIsNotNone(first)
+        later = background.wait_for_frame(after=first[0], timeout=5)
+        self.assertGreater(later[0], first[0])
+        self.assertLessEqual(len(background.frames), 3)
+
+        background.stop()
+        self.assertFalse(background.running)
+        self.assertIsNone(background.wait_for_frame(after=time.time(), timeout=1))
+
+    def test_wait_for_stable(self):
+        frames = [
+            (0.0, np.zeros((8, 8, 3), dtype=np.uint8)),
+            (0.5, np.ones((8, 8, 3), dtype=np.uint8)),
+            (0.8, np.ones((8, 8, 3), dtype=np.uint8)),
+            (1.1, np.ones((8, 8, 3), dtype=np.uint8)),
+        ]
+        self.assertIs(capture.wait_for_stable(frames, stable_for=0.5), frames[3][1])
+        self.assertIsNone(capture.wait_for_stable(frames[:3], stable_for=0.5))
+
+    def test_small_changes_are_not_changes(self):
+        a = np.zeros((400, 400, 3), dtype=np.uint8)
+        b = a.copy()
+        b[:8, :8] = 255  # A caret's worth of pixels
+        self.assertFalse(capture.frames_differ(a, b))
+        b[:200] = 255
+        self.assertTrue(capture.frames_differ(a, b))
+
+
+class TestDisplayBackgroundCapture(TestCase):
+    def make_display(self, os_mode):
+        computer = mock.Mock()
+        computer.interpreter.os = os_mode
+        screen = display.Display(computer)
+        screen._width, screen._height = 40, 20
+        screen.capture = CountingCapture(shape=(40, 80, 3))  # Twice the resolution
+        screen.background_capture = True
+        screen.background_fps = 50
+        self.addCleanup(screen.stop_background_capture)
+        return screen
+
+    def test_only_in_os_mode(self):
+        screen = self.make_display(os_mode=False)
+        self.assertEqual(screen._grab().shape, (40, 80, 3))
+        self.assertIsNone(screen._background)
+
+    def test_regions_come_from_the_latest_frame(self):
+        screen = self.make_display(os_mode=True)
+        self.assertEqual(screen._grab(region=(10, 5, 20, 10)).shape, (20, 40, 3))
+        self.assertTrue(screen._background.running)
+
+        screen.computer.interpreter.os = False
+        screen._grab()
+        self.assertIsNone(screen._background)
+
+    def test_regions_off_the_primary_screen_are_grabbed(self):
+        screen = self.make_display(os_mode=True)
+        screen._grab()  # (Starts the background capture)
+        with mock.patch.object(
+            screen.capture, "grab", return_value=np.zeros((5, 7, 3), dtype=np.uint8)
+        ) as grab:
+            self.assertEqual(screen._grab(region=(40, 0, 7, 5)).shape, (5, 7, 3))
+        grab.assert_any_call(region=(40, 0, 7, 5))
+
+    def test_whole_screen_screenshots_and_finds_use_the_latest_frame(self):
+        screen = self.make_display(os_mode=True)
+        monitors = [types.SimpleNamespace(x=0, y=0, width=40, height=20)]
+        with mock.patch.object(
+            screen, "_grab", wraps=screen._grab
+        ) as grab, mock.patch.object(display, "screeninfo") as screeninfo:
+            screeninfo.get_monitors.return_value = monitors
+            screenshot = screen.screenshot(show=False, active_app_only=False)
+            grab.assert_called_once_with(region=(0, 0, 40, 20))
+
+            screen.element_index = None
+            with mock.patch.object(screen, "_find_icon") as find_icon:
+                screen.find("the settings icon")
+            self.assertEqual(grab.call_count, 2)
+        self.assertEqual(screenshot.size, (80, 40))
+        self.assertEqual(find_icon.call_args[0][1].size, (80, 40))
+        self.assertTrue(screen._background.running)
+
+    def test_wait_for_stable(self):
+        screen = self.make_display(os_mode=False)
+        screen.capture = CountingCapture(changes=3)
+        self.assertTrue(screen.wait_for_stable(timeout=5, stable_for=0.05))
+        self.assertGreaterEqual(screen.capture.grabs, 4)
+
+        screen.capture = CountingCapture(changes=1000)
+        self.assertFalse(screen.wait_for_stable(timeout=0.3, stable_for=0.05))
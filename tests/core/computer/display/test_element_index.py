@@ -0,0 +1,79 @@
+from unittest import TestCase, mock
+
+from PIL import Image, ImageDraw
+
+from interpreter.core.computer.display import display
+from interpreter.core.computer.display.element_index import ElementIndex
+
+
+def screen(text=""):
+    img = Image.new("RGB", (200, 100), "white")
+    ImageDraw.Draw(img).text((10, 10), text, fill="black")
+    return img
+
+
+class TestElementIndex(TestCase):
+    def test_answers_repeated_queries_until_the_frame_changes(self):
+        index = ElementIndex()
+        search = mock.Mock(return_value=[{"coordinates": (0.5, 0.5)}])
+
+        first = index.find(screen("Save"), "text", "Save", search)
+        first[0]["coordinates"] = None  # Callers can't change what's stored
+        again = index.find(screen("Save"), "text", "Save", search)
+        self.assertEqual(again, [{"coordinates": (0.5, 0.5)}])
+        self.assertEqual(search.call_count, 1)
+
+        index.find(screen("Save as"), "text", "Save", search)
+        self.assertEqual(search.call_count, 2)
+        self.assertEqual(
+            index.stats(),
+            {
+                "hits": 1,
+                "misses": 2,
+                "hit_rate": 1 / 3,
+                "invalidations": 1,
+                "entries": 1,
+            },
+        )
+
+    def test_results_for_an_old_frame_are_not_stored(self):
+        index = ElementIndex()
+        old = index.frame(screen("a"))
+        index.frame(screen("b"))
+        index.store(old, "icon", "gear", [(0.1, 0.1)])
+        self.assertEqual(index.stats()["entries"], 0)
+        self.assertIsNone(index.lookup(old, "icon", "gear"))
+
+
+class TestDisplayElementIndex(TestCase):
+    def make_display(self):
+        computer = mock.Mock(offline=True, debug=False)
+        return display.Display(computer)
+
+    def test_find_text_and_icons_use_the_index(self):
+        screen_display = self.make_display()
+        with mock.patch.object(
+            display, "find_text_in_image", return_value=[(0.2, 0.3)]
+        ) as find_text_in_image:
+            for _ in range(3):
+                self.assertEqual(
+                    screen_display.find('"Save"', screenshot=screen("Save")),
+                    [{"coordinates": (0.2, 0.3), "text": "", "similarity": 1}],
+                )
+        self.assertEqual(find_text_in_image.call_count, 1)
+
+        with mock.patch.object(
+            screen_display, "_find_icon", return_value=[(0.7, 0.1)]
+        ) as find_icon:
+            screen_display.find("gear icon", screenshot=screen("Save"))
+            screen_display.find("gear icon", screenshot=screen("Save"))
+            screen_display.find("gear icon", screenshot=screen("Saved"))
+        self.assertEqual(find_icon.call_count, 2)
+
+        screen_display.element_index = None
+        with mock.patch.object(
+            display, "find_text_in_image", return_value=[]
+        ) as find_text_in_image:
+            screen_display.find_text("Save", screenshot=screen("Save"))
+            screen_display.find_text("Save", screenshot=screen("Save"))
+        self.assertEqual(find_text_in_image.call_count, 2)
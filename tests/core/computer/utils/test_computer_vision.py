@@ -0,0 +1,102 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from PIL import Image
+
+from interpreter.core.computer.utils import computer_vision
+
+DATA = {
+    "text": ["", "Hello", "world", "Second", "block"],
+    "block_num": [1, 1, 1, 2, 2],
+    "par_num": [1, 1, 1, 1, 1],
+    "line_num": [1, 1, 1, 1, 1],
+    "left": [0, 10, 60, 10, 80],
+    "top": [0, 10, 10, 50, 50],
+    "width": [100, 40, 40, 60, 40],
+    "height": [100, 12, 12, 12, 12],
+}
+
+
+class TestOcrCache(TestCase):
+    def setUp(self):
+        self.pytesseract = mock.Mock()
+        self.pytesseract.image_to_data.side_effect = lambda *args, **kwargs: {
+            name: list(values) for name, values in DATA.items()
+        }
+        patcher = mock.patch.object(computer_vision, "pytesseract", self.pytesseract)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        computer_vision.clear_ocr_cache()
+        self.addCleanup(computer_vision.clear_ocr_cache)
+
+    def test_one_ocr_per_frame(self):
+        frame = Image.new("RGB", (100, 100), "white")
+
+        self.assertEqual(
+            computer_vision.pytesseract_get_text(frame), "Hello world\n\nSecond block"
+        )
+        boxes = computer_vision.pytesseract_get_text_bounding_boxes(frame.copy())
+        self.assertEqual(boxes[1]["text"], "Hello")
+        self.assertEqual(self.pytesseract.image_to_data.call_count, 1)
+
+        computer_vision.pytesseract_get_text(Image.new("RGB", (100, 100), "black"))
+        self.assertEqual(self.pytesseract.image_to_data.call_count, 2)
+
+    def test_cached_data_is_copied(self):
+        frame = Image.new("RGB", (100, 100), "white")
+        computer_vision.pytesseract_get_data(frame)["left"][1] = 999
+        self.assertEqual(computer_vision.pytesseract_get_data(frame)["left"][1], 10)
+
+    def test_evicts_oldest_frames(self):
+        frames = [Image.new("L", (10, 10), color) for color in range(3)]
+        with mock.patch.object(computer_vision, "ocr_cache_max_entries", 2):
+            for frame in frames:
+                computer_vision.pytesseract_get_data(frame)
+            computer_vision.pytesseract_get_data(frames[2])
+            self.assertEqual(self.pytesseract.image_to_data.call_count, 3)
+            computer_vision.pytesseract_get_data(frames[0])
+            self.assertEqual(self.pytesseract.image_to_data.call_count, 4)
+
+
+class TestFindText(TestCase):
+    def setUp(self):
+        self.pytesseract = mock.Mock()
+        self.pytesseract.image_to_data.side_effect = lambda *args, **kwargs: {
+            name: list(values) for name, values in DATA.items()
+        }
+        patcher = mock.patch.object(computer_vision, "pytesseract", self.pytesseract)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        computer_vision.clear_ocr_cache()
+        self.addCleanup(computer_vision.clear_ocr_cache)
+        self.frame = Image.new("RGB", (100, 100), "white")
+
+    def test_word_matches_part_of_a_box(self):
+        self.assertEqual(computer_vision.match_text(DATA, "ELL"), [(18, 10, 24, 12)])
+        self.assertEqual(
+            computer_vision.find_text_in_image(self.frame, "ell"), [(0.3, 0.16)]
+        )
+
+    def test_phrase_spans_adjacent_words(self):
+        self.assertEqual(
+            computer_vision.match_text(DATA, "hello  WORLD"), [(10, 10, 90, 12)]
+        )
+        self.assertEqual(computer_vision.match_text(DATA, "world second"), [])
+
+    def test_falls_back_to_nearby_words(self):
+        # "world" and "second" are on different lines, so meet in the middle
+        self.assertEqual(
+            computer_vision.find_text_in_image(self.frame, "world second"),
+            [(0.6, 0.36)],
+        )
+        self.assertEqual(computer_vision.find_text_in_image(self.frame, "missing"), [])
+
+    def test_debug_image(self):
+        with tempfile.TemporaryDirectory() as home:
+            with mock.patch("os.path.expanduser", return_value=home):
+                computer_vision.find_text_in_image(self.frame, "block", debug=True)
+            debug_image = Image.open(
+                os.path.join(home, "Desktop", "oi-debug", "find_text_in_image.png")
+            )
+            self.assertEqual(debug_image.size, self.frame.size)
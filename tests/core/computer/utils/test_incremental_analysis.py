@@ -0,0 +1,81 @@
+from unittest import TestCase
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from interpreter.core.computer.utils.incremental_analysis import (
+    IncrementalAnalysis,
+    changed_tiles,
+)
+
+
+def find_rectangles(img):
+    """
+    A stand-in for OCR: the boxes of solid black rectangles on a white background.
+    """
+    black = np.asarray(img.convert("L")) < 128
+    above = np.zeros_like(black)
+    above[1:] = black[:-1]
+    left = np.zeros_like(black)
+    left[:, 1:] = black[:, :-1]
+    boxes = []
+    for y, x in zip(*np.nonzero(black & ~above & ~left)):
+        width = np.argmin(np.append(black[y, x:], False))
+        height = np.argmin(np.append(black[y:, x], False))
+        boxes.append({"left": int(x), "top": int(y), "width": width, "height": height})
+    return boxes
+
+
+def frame(*rectangles):
+    img = Image.new("RGB", (640, 480), "white")
+    draw = ImageDraw.Draw(img)
+    for x, y, w, h in rectangles:
+        draw.rectangle((x, y, x + w - 1, y + h - 1), fill="black")
+    return img
+
+
+def as_set(boxes):
+    return {(box["left"], box["top"], box["width"], box["height"]) for box in boxes}
+
+
+class TestIncrementalAnalysis(TestCase):
+    def setUp(self):
+        self.analysis = IncrementalAnalysis(tile_size=32, margin=4)
+        self.analyzed = []
+
+    def analyze(self, img):
+        self.analyzed.append(img.size)
+        return find_rectangles(img)
+
+    def test_changed_tiles(self):
+        a = np.zeros((100, 70, 3), dtype=np.uint8)
+        b = a.copy()
+        b[99, 69, 2] = 1
+        tiles = changed_tiles(a, b, 32)
+        self.assertEqual(tiles.shape, (4, 3))
+        self.assertEqual(list(zip(*np.nonzero(tiles))), [(3, 2)])
+
+    def test_only_changed_regions_are_analyzed(self):
+        self.analysis.run(
+            "ocr", frame((10, 10, 50, 10), (300, 200, 100, 20)), self.analyze
+        )
+        self.analyzed.clear()
+
+        # The second rectangle got wider (crossing tiles), and a new one appeared
+        new_frame = frame((10, 10, 50, 10), (300, 200, 140, 20), (500, 400, 30, 30))
+        boxes = self.analysis.run("ocr", new_frame, self.analyze)
+
+        self.assertEqual(as_set(boxes), as_set(find_rectangles(new_frame)))
+        analyzed_area = sum(width * height for width, height in self.analyzed)
+        self.assertLess(analyzed_area, 640 * 480 / 4)
+
+    def test_unchanged_frame_reuses_boxes(self):
+        img = frame((10, 10, 50, 10))
+        first = self.analysis.run("ocr", img, self.analyze)
+        self.assertEqual(self.analysis.run("ocr", img.copy(), self.analyze), first)
+        self.assertEqual(len(self.analyzed), 1)
+
+    def test_big_changes_analyze_everything(self):
+        self.analysis.run("ocr", frame((10, 10, 50, 10)), self.analyze)
+        self.analysis.run("ocr", frame((0, 0, 600, 400)), self.analyze)
+        self.assertEqual(self.analyzed, [(640, 480), (640, 480)])
@@ -0,0 +1,82 @@
+import base64
+import io
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase, mock
+
+import numpy as np
+from PIL import Image
+
+from interpreter.core.computer.vision.vision import Vision
+
+
+def base64_png(color="white"):
+    buffered = io.BytesIO()
+    Image.new("RGB", (64, 32), color).save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+def make_vision():
+    vision = Vision(mock.Mock())
+    vision.easyocr = mock.Mock()
+    vision.easyocr.readtext.return_value = [([], "hello", 0.9), ([], "world", 0.8)]
+    vision.model = mock.Mock()
+    vision.model.encode_image.side_effect = lambda img: ("encoded", img.size)
+    vision.model.answer_question.return_value = "A white rectangle."
+    vision.tokenizer = mock.Mock()
+    return vision
+
+
+class TestVision(TestCase):
+    def test_ocr_reads_arrays_without_temp_files(self):
+        vision = make_vision()
+        lmc = {"type": "image", "format": "base64.png", "content": base64_png()}
+
+        with mock.patch.object(
+            tempfile, "NamedTemporaryFile", side_effect=AssertionError
+        ):
+            self.assertEqual(vision.ocr(lmc=lmc), "hello world")
+            vision.ocr(pil_image=Image.new("RGBA", (8, 8)))
+
+        image = vision.easyocr.readtext.call_args_list[0][0][0]
+        self.assertIsInstance(image, np.ndarray)
+        self.assertEqual(image.shape, (32, 64, 3))
+        self.assertEqual(vision.easyocr.readtext.call_args_list[1][0][0].shape[2], 3)
+
+        array = np.zeros((4, 4, 3), dtype=np.uint8)
+        vision.ocr(image_array=array)
+        self.assertIs(vision.easyocr.readtext.call_args[0][0], array)
+
+    def test_decodes_and_encodes_each_image_once(self):
+        vision = make_vision()
+        lmc = {"type": "image", "format": "base64.png", "content": base64_png()}
+
+        with mock.patch.object(Image, "open", wraps=Image.open) as image_open:
+            vision.ocr(lmc=lmc)
+            vision.query(lmc=lmc)
+            vision.query("What color is it?", lmc=lmc)
+        self.assertEqual(image_open.call_count, 1)
+        self.assertEqual(vision.model.encode_image.call_count, 1)
+        self.assertEqual(vision.model.answer_question.call_count, 2)
+
+        vision.query(base_64=base64_png("black"))
+        self.assertEqual(vision.model.encode_image.call_count, 2)
+
+    def test_quiet_queries_restore_stdout(self):
+        vision = make_vision()
+        vision.model.answer_question.side_effect = lambda *args, **kwargs: (
+            time.sleep(0.01) or "ok"
+        )
+
+        stdout = sys.stdout
+        threads = [
+            threading.Thread(target=vision.query, kwargs={"base_64": base64_png(c)})
+            for c in ["red", "green", "blue", "white"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIs(sys.stdout, stdout)
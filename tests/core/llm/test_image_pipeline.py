@@ -0,0 +1,126 @@
+import base64
+import io
+from unittest import TestCase, mock
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from interpreter.core.llm.utils import image_pipeline
+from interpreter.core.llm.utils.convert_to_openai_messages import (
+    convert_to_openai_messages,
+)
+from interpreter.core.llm.utils.image_pipeline import ImagePipeline
+
+
+def screenshot(text, compress_level=6, size=(320, 200)):
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((20, 20, 300, 60), fill="navy")
+    draw.text((30, 100), text, fill="black")
+    draw.ellipse((200, 120, 260, 180), fill="red" if text == "a" else "green")
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG", compress_level=compress_level)
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+def image_message(content, image_format="base64.png"):
+    return {
+        "role": "computer",
+        "type": "image",
+        "format": image_format,
+        "content": content,
+    }
+
+
+def noise(size):
+    img = Image.fromarray(
+        np.random.default_rng(0).integers(0, 255, size + (3,), dtype=np.uint8)
+    )
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+class TestDedupe(TestCase):
+    def test_drops_images_that_look_like_the_next_one(self):
+        messages = [
+            image_message(screenshot("a")),
+            {"role": "assistant", "type": "message", "content": "Clicking..."},
+            # The same pixels, encoded differently
+            image_message(screenshot("a", compress_level=1)),
+            image_message(screenshot("b")),
+        ]
+        original = [dict(message) for message in messages]
+
+        deduped = ImagePipeline().dedupe(messages)
+
+        self.assertEqual(deduped[0]["format"], "description")
+        self.assertEqual(deduped[0]["role"], "user")
+        self.assertEqual(deduped[0]["content"], image_pipeline.duplicate_image_note)
+        self.assertEqual(deduped[1:], messages[1:])
+        self.assertEqual(messages, original)
+
+    def test_hashes_each_image_once(self):
+        pipeline = ImagePipeline()
+        messages = [image_message(screenshot("a")), image_message(screenshot("b"))]
+        with mock.patch.object(
+            image_pipeline, "perceptual_hash", wraps=image_pipeline.perceptual_hash
+        ) as perceptual_hash:
+            pipeline.dedupe(messages)
+            pipeline.dedupe(messages + [image_message(screenshot("b", 1))])
+        self.assertEqual(perceptual_hash.call_count, 3)
+
+    def test_small_changes_are_not_duplicates(self):
+        base = Image.new("RGB", (1920, 1080), "white")
+        typed = base.copy()
+        ImageDraw.Draw(typed).text((600, 500), "h", fill="black")
+        self.assertGreater(
+            image_pipeline.hash_distance(
+                image_pipeline.perceptual_hash(base),
+                image_pipeline.perceptual_hash(typed),
+            ),
+            ImagePipeline().dedupe_distance,
+        )
+
+
+class TestEncode(TestCase):
+    def test_small_images_are_sent_as_they_are(self):
+        content = screenshot("a")
+        url = ImagePipeline().encode(image_message(content))
+        self.assertEqual(url, f"data:image/png;base64,{content}")
+
+    def test_shrinks_to_the_budget_in_one_resize(self):
+        pipeline = ImagePipeline()
+        pipeline.max_bytes = 100_000
+        message = image_message(noise((300, 400)))
+
+        with mock.patch.object(
+            Image.Image, "resize", autospec=True, side_effect=Image.Image.resize
+        ) as resize:
+            url = pipeline.encode(message)
+            self.assertEqual(pipeline.encode(message), url)
+        self.assertEqual(resize.call_count, 1)
+        self.assertLessEqual(len(url), pipeline.max_bytes)
+
+        # Not shrinking sends it whole
+        self.assertGreater(len(pipeline.encode(message, shrink=False)), 100_000)
+
+    def test_reencodes_as_jpeg_or_webp(self):
+        pipeline = ImagePipeline()
+        for image_format in ["jpeg", "webp"]:
+            pipeline.format = image_format
+            url = pipeline.encode(image_message(screenshot("a")))
+            self.assertTrue(url.startswith(f"data:image/{image_format};base64,"))
+            data = base64.b64decode(url.split(",", 1)[1])
+            self.assertEqual(Image.open(io.BytesIO(data)).format, image_format.upper())
+
+    def test_convert_uses_the_pipeline(self):
+        pipeline = mock.Mock()
+        pipeline.encode.return_value = "data:image/png;base64,abc"
+        messages = convert_to_openai_messages(
+            [image_message("xyz")], vision=True, image_pipeline=pipeline
+        )
+        self.assertEqual(
+            messages[0]["content"][0]["image_url"]["url"], "data:image/png;base64,abc"
+        )
+        pipeline.encode.assert_called_once_with(image_message("xyz"), shrink=True)
@@ -0,0 +1,36 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from interpreter.core.llm.llm import Llm
+from interpreter.core.utils.tracing import Tracer
+
+
+class TestTraceCompletion(TestCase):
+    def trace(self, verbose=False, trace_file=None):
+        llm = Llm(mock.Mock())
+        llm.interpreter.verbose = verbose
+        llm.interpreter.tracer = Tracer()
+        llm.interpreter.tracer.trace_file = trace_file
+        chunks = [{"type": "message", "content": "Hi"}] * 3
+        with mock.patch(
+            "interpreter.core.llm.llm.count_tokens", return_value=7
+        ) as count_tokens:
+            list(llm._trace_completion(iter(chunks), "gpt-4o", []))
+        return llm.interpreter.tracer.events[-1], count_tokens
+
+    def test_tokens_are_only_counted_when_they_will_be_seen(self):
+        span, count_tokens = self.trace()
+        count_tokens.assert_not_called()
+        self.assertNotIn("prompt_tokens", span)
+        self.assertEqual(span["chunks"], 3)
+
+        span, count_tokens = self.trace(verbose=True)
+        self.assertEqual(count_tokens.call_count, 2)
+        self.assertEqual(span["completion_tokens"], 7)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            span, count_tokens = self.trace(
+                trace_file=os.path.join(temp_dir, "trace.jsonl")
+            )
+        self.assertEqual(count_tokens.call_count, 2)
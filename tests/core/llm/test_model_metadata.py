@@ -0,0 +1,163 @@
+import time
+from unittest import TestCase, mock
+
+from interpreter.core.llm.llm import Llm
+from interpreter.core.llm.utils import model_metadata
+from interpreter.core.utils.tracing import Tracer
+
+
+class TestModelMetadata(TestCase):
+    def test_unknown_model_is_empty(self):
+        self.assertEqual(model_metadata.get_model_metadata("gpt-4o"), {})
+
+    def test_update_merges_and_is_keyed_by_api_base(self):
+        model = "ollama/llama3:latest"
+        model_metadata.update_model_metadata(model, "http://a", installed=True)
+        model_metadata.update_model_metadata(
+            model, "http://a", context_window=8000, supports_vision=None
+        )
+
+        self.assertEqual(
+            model_metadata.get_model_metadata(model, "http://a"),
+            {"installed": True, "context_window": 8000},
+        )
+        self.assertEqual(model_metadata.get_model_metadata(model, "http://b"), {})
+
+    def test_expired_entries_are_ignored(self):
+        model_metadata.update_model_metadata("gpt-4o", supports_functions=True)
+
+        later = time.time() + 100
+        with mock.patch.object(model_metadata.time, "time", return_value=later):
+            self.assertEqual(model_metadata.get_model_metadata("gpt-4o", ttl=10), {})
+            self.assertEqual(
+                model_metadata.get_model_metadata("gpt-4o", ttl=None),
+                {"supports_functions": True},
+            )
+
+    def test_clear(self):
+        model_metadata.update_model_metadata("gpt-4o", supports_functions=True)
+        model_metadata.update_model_metadata("claude", supports_functions=True)
+
+        model_metadata.clear_model_metadata("gpt-4o")
+        self.assertEqual(model_metadata.get_model_metadata("gpt-4o"), {})
+        self.assertNotEqual(model_metadata.get_model_metadata("claude"), {})
+
+        model_metadata.clear_model_metadata()
+        self.assertEqual(model_metadata.get_model_metadata("claude"), {})
+
+
+class TestLlmMetadataCache(TestCase):
+    def setUp(self):
+        self.requests = mock.Mock()
+        self.requests.get.return_value.ok = True
+        self.requests.get.return_value.json.return_value = {
+            "models": [{"name": "llama3:latest"}]
+        }
+        self.requests.post.return_value.json.return_value = {
+            "model_info": {"llama.context_length": 8000}
+        }
+        self.litellm = mock.Mock()
+        self.litellm.supports_function_calling.return_value = True
+        self.litellm.supports_vision.return_value = False
+        self.litellm.get_model_info.return_value = {
+            "max_input_tokens": 128000,
+            "max_output_tokens": 4096,
+        }
+
+        for target, new in [
+            ("interpreter.core.llm.llm.litellm", self.litellm),
+            ("interpreter.core.llm.llm.tt", mock.Mock()),
+            (
+                "interpreter.core.llm.llm.run_tool_calling_llm",
+                mock.Mock(return_value=[]),
+            ),
+            ("interpreter.core.llm.llm.run_text_llm", mock.Mock(return_value=[])),
+        ]:
+            patcher = mock.patch(target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def new_llm(self, model):
+        llm = Llm(mock.Mock())
+        llm.interpreter.computer.http = self.requests
+        llm.interpreter.tracer = Tracer()
+        llm.interpreter.tracer.count_tokens = False
+        llm.model = model
+        return llm
+
+    def ollama_calls(self):
+        return self.requests.get.call_count + self.requests.post.call_count
+
+    def run_llm(self, llm):
+        list(llm.run([{"role": "system", "type": "message", "content": "Hi"}]))
+
+    def test_ollama_load_is_skipped_on_a_cache_hit(self):
+        llm = self.new_llm("ollama/llama3")
+        llm.load()
+        self.assertEqual(llm.context_window, 8000)
+        self.assertEqual(self.ollama_calls(), 2)  # /api/tags and /api/show
+        llm.interpreter.computer.ai.chat.assert_called_once_with("ping")
+
+        llm = self.new_llm("ollama/llama3")
+        llm.load()
+        self.assertEqual(llm.context_window, 8000)
+        self.assertEqual(llm.max_tokens, 1600)
+        self.assertEqual(self.ollama_calls(), 2)
+        llm.interpreter.computer.ai.chat.assert_not_called()
+
+    def test_ollama_load_runs_again_after_the_ttl(self):
+        self.new_llm("ollama/llama3").load()
+
+        later = time.time() + 100
+        with mock.patch.object(model_metadata.time, "time", return_value=later):
+            llm = self.new_llm("ollama/llama3")
+            llm.metadata_cache_ttl = 10
+            llm.load()
+        self.assertEqual(self.ollama_calls(), 4)
+        llm.interpreter.computer.ai.chat.assert_called_once_with("ping")
+
+    def test_litellm_detection_is_skipped_on_a_cache_hit(self):
+        llm = self.new_llm("gpt-4o")
+        self.run_llm(llm)
+        self.assertEqual(self.litellm.get_model_info.call_count, 1)
+        self.assertEqual(self.litellm.supports_function_calling.call_count, 1)
+        self.assertEqual(self.litellm.supports_vision.call_count, 1)
+
+        llm = self.new_llm("gpt-4o")
+        self.run_llm(llm)
+        self.assertEqual(llm.context_window, 128000)
+        self.assertEqual(llm.max_tokens, 4096)
+        self.assertTrue(llm.supports_functions)
+        self.assertFalse(llm.supports_vision)
+        self.assertEqual(self.litellm.get_model_info.call_count, 1)
+        self.assertEqual(self.litellm.supports_function_calling.call_count, 1)
+        self.assertEqual(self.litellm.supports_vision.call_count, 1)
+
+    def test_refresh_metadata_detects_again(self):
+        llm = self.new_llm("gpt-4o")
+        self.run_llm(llm)
+
+        llm.refresh_metadata()
+        self.assertIsNone(llm.context_window)
+        self.assertIsNone(llm.max_tokens)
+        self.assertIsNone(llm.supports_functions)
+        self.assertIsNone(llm.supports_vision)
+
+        self.run_llm(llm)
+        self.assertEqual(llm.context_window, 128000)
+        self.assertEqual(self.litellm.get_model_info.call_count, 2)
+        self.assertEqual(self.litellm.supports_function_calling.call_count, 2)
+        self.assertEqual(self.litellm.supports_vision.call_count, 2)
+
+    def test_refresh_metadata_keeps_user_settings(self):
+        llm = self.new_llm("gpt-4o")
+        llm.max_tokens = 100
+        llm.supports_vision = True
+        self.run_llm(llm)
+        llm.supports_functions = False  # Changed after it was detected
+
+        llm.refresh_metadata()
+        self.assertIsNone(llm.context_window)
+        self.assertEqual(llm.max_tokens, 100)
+        self.assertTrue(llm.supports_vision)
+        self.assertFalse(llm.supports_functions)
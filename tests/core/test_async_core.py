@@ -1,7 +1,25 @@
+import asyncio
+import base64
+import json
 import os
-from unittest import TestCase, mock
+import tempfile
+import threading
+import time
+from unittest import TestCase, mock, skipIf
 
-from interpreter.core.async_core import Server, AsyncInterpreter
+import janus
+
+from interpreter.core.async_core import (
+    AsyncInterpreter,
+    ReplayBuffer,
+    Server,
+    SessionLimitError,
+    SessionManager,
+    _from_binary,
+    _to_binary,
+    msgpack,
+)
+from interpreter.core.utils.worker_pool import WorkerPool
 
 
 class TestServerConstruction(TestCase):
@@ -46,3 +64,535 @@ class TestServerConstruction(TestCase):
             s = Server(AsyncInterpreter())
             self.assertEqual(s.host, fake_host)
             self.assertEqual(s.port, fake_port)
+class FakeInterpreter:
+    def __init__(self):
+        self.respond_thread = None
+        self.stop_event = threading.Event()
+        self.computer = mock.Mock()
+
+
+class TestSessionManager(TestCase):
+    def make_sessions(self, **kwargs):
+        return SessionManager(FakeInterpreter(), factory=FakeInterpreter, **kwargs)
+
+    def test_sessions_are_isolated(self):
+        sessions = self.make_sessions(max_sessions=4, ttl=60)
+        a, b = sessions.get("a"), sessions.get("b")
+        self.assertIsNot(a, b)
+        self.assertIs(sessions.get("a"), a)
+        self.assertIs(sessions.get(None), sessions.default)
+        self.assertEqual((a.id, b.id), ("a", "b"))
+
+    def test_evicts_the_least_recently_used_idle_session(self):
+        sessions = self.make_sessions(max_sessions=2, ttl=60)
+        a, b = sessions.get("a"), sessions.get("b")
+        sessions.get("a")
+        sessions.get("c")
+
+        b.computer.terminate.assert_called_once()
+        self.assertTrue(b.stop_event.is_set())
+        a.computer.terminate.assert_not_called()
+        self.assertEqual(sessions.stats()["evicted"], 1)
+
+        with sessions.connection("a"), sessions.connection("c"):
+            with self.assertRaises(SessionLimitError):
+                sessions.get("d")
+        sessions.get("d")
+
+    def test_idle_sessions_expire(self):
+        sessions = self.make_sessions(max_sessions=4, ttl=10)
+        with mock.patch.object(time, "monotonic", return_value=100):
+            a = sessions.get("a")
+            b = sessions.get("b")
+        with mock.patch.object(time, "monotonic", return_value=105):
+            sessions.get("b")
+        with mock.patch.object(time, "monotonic", return_value=112):
+            sessions.close_expired()
+
+        a.computer.terminate.assert_called_once()
+        b.computer.terminate.assert_not_called()
+        self.assertEqual(sessions.stats()["sessions"], 1)
+        self.assertEqual(sessions.stats()["expired"], 1)
+
+    def test_interpreters_are_made_outside_the_lock(self):
+        sessions = self.make_sessions(max_sessions=4, ttl=60)
+        locked = []
+
+        def factory():
+            locked.append(sessions._lock.locked())
+            return FakeInterpreter()
+
+        sessions.factory = factory
+        sessions.get("a")
+        self.assertEqual(locked, [False])
+
+    def test_new_sessions_share_functions_but_not_objects(self):
+        def completions(**params):
+            return []
+
+        interpreter = AsyncInterpreter()
+        interpreter.llm.completions = completions
+        interpreter.respond_pool = WorkerPool(max_workers=1)
+        session = interpreter.new_session()
+
+        self.assertIs(session.llm.completions, completions)
+        self.assertIs(session.respond_pool, interpreter.respond_pool)
+        self.assertIs(session.llm.vision_renderer.__self__, session.computer.vision)
+        self.assertIsNot(session.tracer, interpreter.tracer)
+
+
+class TestSessionRoutes(TestCase):
+    def test_settings_are_per_session(self):
+        from fastapi.testclient import TestClient
+
+        interpreter = AsyncInterpreter()
+        interpreter.custom_instructions = "shared"
+        client = TestClient(interpreter.server.app)
+
+        client.post("/sessions/a/settings", json={"custom_instructions": "mine"})
+        self.assertEqual(
+            json.loads(client.get("/sessions/a/settings/custom_instructions").json()),
+            {"custom_instructions": "mine"},
+        )
+        for headers in [{}, {"X-Session-ID": "b"}]:
+            self.assertEqual(
+                json.loads(
+                    client.get("/settings/custom_instructions", headers=headers).json()
+                ),
+                {"custom_instructions": "shared"},
+            )
+        self.assertEqual(client.get("/sessions").json()["sessions"], 2)
+        self.assertEqual(client.delete("/sessions/a").json(), {"closed": True})
+def slow_chat(self, message=None, stream=False, display=True):
+    """
+    A stand-in for the LLM: blocks for 0.1 seconds per chunk, like a real model and code would.
+    """
+
+    def chunks():
+        for word in ["Hello", " there", "!"]:
+            time.sleep(0.1)
+            yield {"role": "assistant", "type": "message", "content": word}
+
+    if stream:
+        return chunks()
+    list(chunks())
+    return [{"role": "assistant", "type": "message", "content": "Hello there!"}]
+
+
+class TestOpenAICompatibleEndpoint(TestCase):
+    def test_streams_dont_block_the_server(self):
+        import httpx
+
+        async def run():
+            app = AsyncInterpreter().server.app
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+
+                async def stream(session):
+                    response = await client.post(
+                        "/openai/chat/completions",
+                        json={
+                            "messages": [{"role": "user", "content": "Hi"}],
+                            "stream": True,
+                        },
+                        headers={"X-Session-ID": session},
+                    )
+                    return response.text
+
+                async def heartbeat():
+                    await asyncio.sleep(0.15)
+                    start = time.perf_counter()
+                    await client.get("/heartbeat")
+                    return time.perf_counter() - start
+
+                start = time.perf_counter()
+                *streams, heartbeat_seconds = await asyncio.gather(
+                    *(stream(f"user-{i}") for i in range(4)), heartbeat()
+                )
+                return streams, heartbeat_seconds, time.perf_counter() - start
+
+        with mock.patch.object(AsyncInterpreter, "chat", slow_chat):
+            streams, heartbeat_seconds, total = asyncio.run(run())
+
+        for text in streams:
+            self.assertEqual(text.count("data: "), 3)
+            self.assertIn('"content": " there"', text)
+        # Each stream takes ~0.4s (0.1s stop + 0.3s of chunks). One after another they'd take 1.6s
+        self.assertLess(heartbeat_seconds, 0.1)
+        self.assertLess(total, 1.2)
+
+    def test_requests_share_the_response_workers(self):
+        import httpx
+
+        pool = WorkerPool(max_workers=1)
+
+        async def run():
+            app = AsyncInterpreter().server.app
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+
+                async def ask(session, stream):
+                    response = await client.post(
+                        "/openai/chat/completions",
+                        json={
+                            "messages": [{"role": "user", "content": "Hi"}],
+                            "stream": stream,
+                        },
+                        headers={"X-Session-ID": session},
+                    )
+                    return response.text
+
+                start = time.perf_counter()
+                texts = await asyncio.gather(ask("a", False), ask("b", True))
+                return texts, time.perf_counter() - start
+
+        with mock.patch.object(AsyncInterpreter, "chat", slow_chat), mock.patch(
+            "interpreter.core.async_core.respond_pool", pool
+        ):
+            (answer, streamed), total = asyncio.run(run())
+
+        self.assertIn("Hello there!", answer)
+        self.assertEqual(streamed.count("data: "), 3)
+        self.assertEqual(pool.stats()["completed"], 2)
+        # With one worker they take turns: 0.1s stop + 0.3s + 0.3s
+        self.assertGreater(total, 0.65)
+
+
+class TestOutputStreaming(TestCase):
+    message = {"role": "assistant", "type": "message"}
+
+    def test_chunks_of_the_same_message_are_coalesced(self):
+        interpreter = AsyncInterpreter()
+        message = self.message
+        code = {"role": "assistant", "type": "code", "format": "python"}
+        chunks = [
+            {**message, "start": True},
+            {**message, "content": "Hel"},
+            {**message, "content": "lo"},
+            {**message, "end": True},
+            {**code, "content": "print("},
+            {**code, "content": "1)"},
+            {**message, "content": "!"},
+        ]
+
+        async def stream():
+            interpreter.output_queue = janus.Queue()
+            for chunk in chunks:
+                interpreter._put_output(chunk)
+            outputs = []
+            while interpreter.output_queue.async_q.qsize():
+                outputs += await interpreter.outputs()
+            return outputs
+
+        self.assertEqual(
+            asyncio.run(stream()),
+            [
+                {**message, "start": True},
+                {**message, "content": "Hello"},
+                {**message, "end": True},
+                {**code, "content": "print(1)"},
+                {**message, "content": "!"},
+            ],
+        )
+
+    def test_full_queue_drops_content_but_not_flags(self):
+        interpreter = AsyncInterpreter()
+        interpreter.output_backpressure = "drop"
+        interpreter.output_block_timeout = 0.01
+
+        async def stream():
+            interpreter.output_queue = janus.Queue(maxsize=2)
+            for i in range(5):
+                interpreter._put_output({**self.message, "content": str(i)})
+            # Waits for room (and is dropped after the timeout, since nothing reads the queue)
+            interpreter._put_output({**self.message, "end": True})
+            return interpreter.output_queue.async_q.qsize()
+
+        self.assertEqual(asyncio.run(stream()), 2)
+        self.assertEqual(interpreter.dropped_outputs, 4)
+
+    def test_full_queue_waits_for_the_client(self):
+        interpreter = AsyncInterpreter()
+        interpreter.output_block_timeout = 5
+        first = {**self.message, "content": "x"}
+        second = {**self.message, "content": "y"}
+
+        async def stream():
+            interpreter.output_queue = janus.Queue(maxsize=1)
+            interpreter._put_output(first)
+            producer = threading.Thread(target=interpreter._put_output, args=(second,))
+            producer.start()
+            await asyncio.sleep(0.05)
+            waited = producer.is_alive()
+            outputs = [await interpreter.output(), await interpreter.output()]
+            await asyncio.to_thread(producer.join, 1)
+            return waited, outputs
+
+        waited, outputs = asyncio.run(stream())
+        self.assertTrue(waited)
+        self.assertEqual(outputs, [first, second])
+        self.assertEqual(interpreter.dropped_outputs, 0)
+
+
+class TestReplayBuffer(TestCase):
+    def test_outputs_are_numbered_and_kept(self):
+        replay = ReplayBuffer(size=3)
+        outputs = [replay.add({"content": str(i)}) for i in range(5)]
+        self.assertEqual([output["seq"] for output in outputs], [1, 2, 3, 4, 5])
+        self.assertEqual(replay.since(3), outputs[3:])
+        # 1 and 2 are gone, so this is as far back as it goes
+        self.assertEqual(replay.since(0), outputs[2:])
+        self.assertEqual(replay.since(5), [])
+
+    def test_acks_are_cumulative(self):
+        replay = ReplayBuffer()
+        for i in range(3):
+            replay.add({"content": str(i)})
+
+        async def wait():
+            waits = [asyncio.create_task(replay.wait_for_ack(seq, 1)) for seq in (1, 2)]
+            late = asyncio.create_task(replay.wait_for_ack(3, 0.05))
+            await asyncio.sleep(0)
+            replay.ack(2)
+            return await asyncio.gather(*waits, late)
+
+        self.assertEqual(asyncio.run(wait()), [True, True, False])
+        self.assertEqual(replay._waiters, [])
+
+
+def scripted_respond(self):
+    for word in ["Hello", " there"]:
+        yield {"role": "assistant", "type": "message", "content": word}
+
+
+class TestResumableStreams(TestCase):
+    def receive_response(self, websocket):
+        outputs = []
+        while not outputs or outputs[-1].get("content") != "complete":
+            outputs.append(websocket.receive_json())
+        return outputs
+
+    def test_reconnecting_client_resumes(self):
+        from fastapi.testclient import TestClient
+
+        interpreter = AsyncInterpreter()
+        interpreter.coalesce_window = 0
+        with TestClient(interpreter.server.app) as client, mock.patch.dict(
+            os.environ, {"INTERPRETER_REQUIRE_AUTH": "False"}
+        ), mock.patch.object(AsyncInterpreter, "_respond_and_store", scripted_respond):
+            with client.websocket_connect("/sessions/a/") as websocket:
+                websocket.send_json({"role": "user", "start": True})
+                websocket.send_json(
+                    {"role": "user", "type": "message", "content": "Hi"}
+                )
+                websocket.send_json({"role": "user", "end": True})
+                outputs = self.receive_response(websocket)
+
+            self.assertEqual([output["seq"] for output in outputs], [1, 2, 3])
+            with client.websocket_connect("/sessions/a/?resume=1") as websocket:
+                self.assertEqual(self.receive_response(websocket), outputs[1:])
+
+
+class TestBinaryProtocol(TestCase):
+    image = {
+        "role": "computer",
+        "type": "image",
+        "format": "base64.png",
+        "content": base64.b64encode(b"\x89PNG not really").decode(),
+    }
+
+    def test_images_travel_as_bytes(self):
+        wire = _to_binary(self.image)
+        self.assertEqual(wire["format"], "bytes.png")
+        self.assertEqual(wire["content"], b"\x89PNG not really")
+        self.assertEqual(_from_binary(wire), self.image)
+        message = {"role": "assistant", "type": "message", "content": "Hi"}
+        self.assertIs(_to_binary(message), message)
+
+    def websocket_outputs(self, url):
+        from fastapi.testclient import TestClient
+
+        interpreter = AsyncInterpreter()
+        with TestClient(interpreter.server.app) as client, mock.patch.dict(
+            os.environ, {"INTERPRETER_REQUIRE_AUTH": "False"}
+        ):
+            with client.websocket_connect(url) as websocket:
+                while interpreter.output_queue is None:
+                    time.sleep(0.01)
+                interpreter._put_output(self.image)
+                return websocket.receive()
+
+    def test_refused_without_msgpack(self):
+        from fastapi.testclient import TestClient
+        from starlette.websockets import WebSocketDisconnect
+
+        interpreter = AsyncInterpreter()
+        with TestClient(interpreter.server.app) as client, mock.patch(
+            "interpreter.core.async_core.msgpack", None
+        ):
+            with client.websocket_connect("/?protocol=msgpack") as websocket:
+                with self.assertRaises(WebSocketDisconnect) as disconnect:
+                    websocket.receive_text()
+        self.assertEqual(disconnect.exception.code, 1003)
+        self.assertIn("pip install msgpack", disconnect.exception.reason)
+
+    @skipIf(msgpack is None, "msgpack isn't installed")
+    def test_msgpack_frames(self):
+        frame = self.websocket_outputs("/?protocol=msgpack")
+        output = msgpack.unpackb(frame["bytes"])
+        self.assertEqual(output["content"], b"\x89PNG not really")
+
+
+class TestRespondPool(TestCase):
+    def test_stopping_a_queued_response_frees_its_place(self):
+        pool = WorkerPool(max_workers=1)
+        release = threading.Event()
+        pool.submit("someone else", release.wait)
+        time.sleep(0.05)  # So ours has to wait
+
+        interpreter = AsyncInterpreter()
+        interpreter.respond_pool = pool
+
+        async def turn():
+            await interpreter.input({"role": "user", "start": True})
+            await interpreter.input(
+                {"role": "user", "type": "message", "content": "Hi"}
+            )
+            await interpreter.input({"role": "user", "end": True})
+            queued = pool.stats()["queued"]
+            await interpreter.input({"role": "user", "start": True})
+            return queued
+
+        with mock.patch.object(AsyncInterpreter, "respond") as respond:
+            self.assertEqual(asyncio.run(turn()), 1)
+            release.set()
+            time.sleep(0.05)
+        self.assertEqual(pool.stats()["queued"], 0)
+        respond.assert_not_called()
+
+
+class TestMetricsEndpoint(TestCase):
+    def test_metrics_dont_need_the_api_key(self):
+        from fastapi.testclient import TestClient
+
+        interpreter = AsyncInterpreter()
+        interpreter.coalesce_window = 0
+        with TestClient(interpreter.server.app) as client, mock.patch.dict(
+            os.environ,
+            {"INTERPRETER_API_KEY": "secret", "INTERPRETER_REQUIRE_AUTH": "False"},
+        ), mock.patch.object(AsyncInterpreter, "_respond_and_store", scripted_respond):
+            with client.websocket_connect("/") as websocket:
+                websocket.send_json({"role": "user", "start": True})
+                websocket.send_json(
+                    {"role": "user", "type": "message", "content": "Hi"}
+                )
+                websocket.send_json({"role": "user", "end": True})
+                while websocket.receive_json().get("content") != "complete":
+                    pass
+
+            self.assertEqual(client.get("/sessions").status_code, 403)
+            response = client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        text = response.text
+        self.assertIn("# TYPE interpreter_websocket_frames_sent_total counter", text)
+        self.assertIn(
+            "# TYPE interpreter_llm_time_to_first_token_seconds histogram", text
+        )
+        self.assertIn("interpreter_responses_queued 0.0", text)
+        self.assertIn("process_resident_memory_bytes", text)
+
+
+class TestFileRoutes(TestCase):
+    def test_upload_and_download(self):
+        from fastapi.testclient import TestClient
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "data.bin")
+        data = os.urandom(5000)
+
+        with mock.patch.dict(
+            os.environ,
+            {
+                "INTERPRETER_INSECURE_ROUTES": "True",
+                "INTERPRETER_MAX_UPLOAD_BYTES": "6000",
+            },
+        ):
+            client = TestClient(AsyncInterpreter().server.app)
+
+        upload = lambda body, offset=0: client.put(
+            "/upload", params={"path": path, "offset": offset}, content=body
+        )
+        self.assertEqual(upload(data[:3000]).json()["size"], 3000)
+        # Resuming from the wrong place says where to resume from
+        response = upload(data[3000:], offset=2000)
+        self.assertEqual((response.status_code, response.json()["size"]), (409, 3000))
+        self.assertEqual(upload(data[3000:], offset=3000).json()["size"], 5000)
+        self.assertEqual(upload(b"x" * 2000, offset=5000).status_code, 413)
+
+        response = client.get(f"/download/{path}")
+        self.assertEqual(response.content, data)
+        self.assertEqual(response.headers["content-length"], "5000")
+
+        response = client.get(f"/download/{path}", headers={"Range": "bytes=4000-"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers["content-range"], "bytes 4000-4999/5000")
+        self.assertEqual(response.content, data[4000:])
+
+        response = client.get(f"/download/{path}", headers={"Range": "bytes=6000-"})
+        self.assertEqual(response.status_code, 416)
+
+        # httpx decompresses it for us
+        response = client.get(f"/download/{path}", params={"gzip": "true"})
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.content, data)
+
+        response = client.post(
+            "/upload", files={"file": ("data.bin", data[:100])}, data={"path": path}
+        )
+        self.assertEqual(response.json(), {"status": "success", "size": 100})
+class TestStopWithFullQueue(TestCase):
+    def test_start_stops_a_response_waiting_on_a_full_queue(self):
+        interpreter = AsyncInterpreter()
+        interpreter.output_queue_size = 1
+        interpreter.output_block_timeout = 30
+
+        def endless_respond(self):
+            while not self.stop_event.is_set():
+                yield {"role": "assistant", "type": "message", "content": "x"}
+
+        async def turn():
+            await interpreter.input({"role": "user", "start": True})
+            await interpreter.input(
+                {"role": "user", "type": "message", "content": "Hi"}
+            )
+            await interpreter.input({"role": "user", "end": True})
+            await asyncio.sleep(0.2)  # So the response is waiting on the full queue
+            # Nothing reads the queue, but neither the response nor the loop should wait out the timeout
+            started = time.monotonic()
+            await interpreter.input({"role": "user", "start": True})
+            return time.monotonic() - started
+
+        with mock.patch.object(AsyncInterpreter, "_respond_and_store", endless_respond):
+            self.assertLess(asyncio.run(turn()), 2)
+        self.assertFalse(interpreter.respond_thread.is_alive())
+class TestServer(TestCase):
+    def test_a_server_made_directly_is_the_interpreters_server(self):
+        from fastapi.testclient import TestClient
+
+        interpreter = AsyncInterpreter()
+        server = Server(interpreter)
+        self.assertIs(interpreter.server, server)
+
+        server.authenticate = lambda key: key == "custom"
+        with TestClient(server.app) as client, mock.patch.dict(
+            os.environ, {"INTERPRETER_REQUIRE_AUTH": "True"}
+        ):
+            with client.websocket_connect("/") as websocket:
+                websocket.send_json({"auth": "custom"})
+                self.assertEqual(websocket.receive_json(), {"auth": True})
@@ -0,0 +1,74 @@
+import asyncio
+import gzip
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from interpreter.core.utils import file_transfer
+from interpreter.core.utils.file_transfer import (
+    RangeNotSatisfiable,
+    UploadTooLarge,
+    parse_range,
+    read_file,
+    write_file,
+)
+
+
+async def collect(chunks):
+    return b"".join([chunk async for chunk in chunks])
+
+
+async def chunks_of(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class TestParseRange(TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(parse_range("bytes=900-", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=990-2000", 1000), (990, 999))
+        # Not a single byte range: the whole file
+        self.assertIsNone(parse_range(None, 1000))
+        self.assertIsNone(parse_range("bytes=0-1,5-6", 1000))
+        self.assertIsNone(parse_range("items=0-1", 1000))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range("bytes=1000-", 1000)
+
+
+class TestFileTransfer(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "data.bin")
+        self.data = os.urandom(2500)
+
+    def test_reads_in_chunks(self):
+        with open(self.path, "wb") as f:
+            f.write(self.data)
+        with mock.patch.object(file_transfer, "chunk_size", 1000):
+            self.assertEqual(asyncio.run(collect(read_file(self.path))), self.data)
+            self.assertEqual(
+                asyncio.run(collect(read_file(self.path, 900, 1200))),
+                self.data[900:2100],
+            )
+            compressed = asyncio.run(collect(read_file(self.path, compress=True)))
+        self.assertEqual(gzip.decompress(compressed), self.data)
+
+    def test_writes_resumes_and_limits(self):
+        size = asyncio.run(write_file(chunks_of(self.data[:1000]), self.path))
+        self.assertEqual(size, 1000)
+        size = asyncio.run(
+            write_file(
+                chunks_of(self.data[1000:2000], self.data[2000:]), self.path, 1000
+            )
+        )
+        self.assertEqual(size, 2500)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+        with self.assertRaises(UploadTooLarge):
+            asyncio.run(
+                write_file(chunks_of(b"x" * 600, b"x" * 600), self.path, max_bytes=1000)
+            )
@@ -0,0 +1,38 @@
+import gzip
+import json
+from unittest import TestCase, mock
+
+from interpreter.core.utils.http_client import HttpClient
+
+
+class TestHttpClient(TestCase):
+    def setUp(self):
+        self.client = HttpClient()
+        patcher = mock.patch.object(self.client.session, "request")
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reuses_one_session_with_a_default_timeout(self):
+        session = self.client.session
+        self.client.get("http://localhost/a")
+        self.client.post("http://localhost/b", json={"a": 1}, timeout=None)
+
+        self.assertIs(self.client.session, session)
+        self.assertEqual(self.request.call_args_list[0][1]["timeout"], (10, 60))
+        self.assertIsNone(self.request.call_args_list[1][1]["timeout"])
+
+    def test_gzips_large_bodies_when_enabled(self):
+        payload = {"base64": "a" * self.client.gzip_min_size}
+
+        self.client.post("http://localhost/", json=payload)
+        kwargs = self.request.call_args[1]
+        self.assertNotIn("Content-Encoding", kwargs["headers"])
+
+        self.client.gzip_requests = True
+        self.client.post("http://localhost/", json=payload)
+        kwargs = self.request.call_args[1]
+        self.assertEqual(kwargs["headers"]["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(kwargs["data"])), payload)
+
+        self.client.post("http://localhost/", json={"small": True})
+        self.assertNotIn("Content-Encoding", self.request.call_args[1]["headers"])
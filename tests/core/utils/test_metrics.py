@@ -0,0 +1,52 @@
+from unittest import TestCase, mock
+
+from interpreter.core.utils import metrics as metrics_module
+from interpreter.core.utils.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry(TestCase):
+    def test_prometheus_text_format(self):
+        registry = MetricsRegistry()
+        frames = registry.counter("frames_total", "Frames sent.")
+        frames.inc()
+        frames.inc(2)
+        registry.gauge("sessions", "Sessions.", function=lambda: 3)
+        durations = registry.histogram(
+            "duration_seconds", "Run time.", buckets=(0.1, 1), labels=("language",)
+        )
+        durations.observe(0.5, language="python")
+        durations.observe(2, language='sh"ell')
+
+        text = registry.render()
+        self.assertIn("# TYPE frames_total counter\nframes_total 3.0\n", text)
+        self.assertIn("# TYPE sessions gauge\nsessions 3.0\n", text)
+        self.assertIn('duration_seconds_bucket{language="python",le="0.1"} 0\n', text)
+        self.assertIn('duration_seconds_bucket{language="python",le="1.0"} 1\n', text)
+        self.assertIn('duration_seconds_bucket{language="python",le="+Inf"} 1\n', text)
+        self.assertIn('duration_seconds_count{language="sh\\"ell"} 1\n', text)
+        self.assertIn('duration_seconds_sum{language="sh\\"ell"} 2.0\n', text)
+
+    def test_failing_functions_are_left_out(self):
+        registry = MetricsRegistry()
+        registry.gauge("broken", "Fails.", function=lambda: 1 / 0)
+        registry.gauge("fine", "Works.", function=lambda: 1)
+        self.assertEqual(
+            registry.render(), "# HELP fine Works.\n# TYPE fine gauge\nfine 1.0\n"
+        )
+
+
+class TestObserveLLMSpan(TestCase):
+    def test_feeds_the_llm_histograms(self):
+        with mock.patch.object(
+            metrics_module, "llm_time_to_first_token"
+        ) as first_chunk, mock.patch.object(
+            metrics_module, "llm_chunks_per_second"
+        ) as chunks_per_second:
+            metrics_module.observe_llm_span({"name": "execute", "duration": 5})
+            # First chunk after 2s, then 20 more over 2s
+            metrics_module.observe_llm_span(
+                {"name": "llm", "duration": 4, "ttft": 2, "chunks": 21}
+            )
+
+        first_chunk.observe.assert_called_once_with(2)
+        chunks_per_second.observe.assert_called_once_with(10)
@@ -0,0 +1,113 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+import numpy as np
+
+from interpreter.core.computer.vision.vision import Vision
+from interpreter.core.utils import model_registry as registry_module
+from interpreter.core.utils.model_registry import ModelRegistry, model_size
+
+
+class FakeTensor:
+    def __init__(self, count, size=4):
+        self.count, self.size = count, size
+
+    def numel(self):
+        return self.count
+
+    def element_size(self):
+        return self.size
+
+
+class FakeModule:
+    def __init__(self, count):
+        self.count = count
+
+    def parameters(self):
+        return [FakeTensor(self.count)]
+
+    def buffers(self):
+        return [FakeTensor(self.count, 1)]
+
+
+class TestModelRegistry(TestCase):
+    def test_loads_each_model_once_across_threads(self):
+        registry = ModelRegistry()
+        loads = []
+
+        def load():
+            loads.append(1)
+            time.sleep(0.05)
+            return object()
+
+        registry.register("slow", load)
+        models = []
+        threads = [
+            threading.Thread(target=lambda: models.append(registry.get("slow")))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertTrue(all(model is models[0] for model in models))
+        with self.assertRaises(KeyError):
+            registry.get("missing")
+
+    def test_failed_loads_are_retried(self):
+        registry = ModelRegistry()
+        registry.register("model", mock.Mock(side_effect=[ImportError, "model"]))
+        with self.assertRaises(ImportError):
+            registry.get("model")
+        self.assertFalse(registry.loaded("model"))
+        self.assertEqual(registry.get("model"), "model")
+
+    def test_background_warmup_and_memory_usage(self):
+        registry = ModelRegistry()
+        registry.register("module", lambda: FakeModule(100))
+        registry.register("reader", lambda: mock.Mock(spec=[]))
+        registry.register("broken", mock.Mock(side_effect=ImportError))
+
+        registry.warmup().join(timeout=5)
+
+        usage = registry.memory_usage()
+        self.assertEqual(set(usage), {"module", "reader"})
+        self.assertEqual(usage["module"]["bytes"], 500)
+        self.assertGreaterEqual(usage["module"]["load_seconds"], 0)
+
+        registry.unload("module")
+        self.assertFalse(registry.loaded("module"))
+
+    def test_model_size_looks_into_wrappers(self):
+        reader = mock.Mock(spec=[])
+        reader.detector, reader.recognizer = FakeModule(10), FakeModule(20)
+        self.assertEqual(model_size(reader), 150)
+        self.assertEqual(model_size((FakeModule(10), "tokenizer")), 50)
+        self.assertIsNone(model_size(np.zeros(3)))
+
+
+class TestSharedVisionModels(TestCase):
+    def test_interpreters_share_one_copy(self):
+        registry = ModelRegistry()
+        reader = mock.Mock()
+        registry.register("easyocr", mock.Mock(return_value=reader))
+        registry.register("moondream", mock.Mock(return_value=("model", "tokenizer")))
+
+        with mock.patch(
+            "interpreter.core.computer.vision.vision.model_registry", registry
+        ):
+            visions = [Vision(mock.Mock(debug=False)) for _ in range(3)]
+            for vision in visions:
+                vision.load()
+
+        self.assertTrue(all(vision.easyocr is reader for vision in visions))
+        self.assertEqual(visions[2].model, "model")
+        self.assertEqual(registry._loaders["easyocr"].call_count, 1)
+        self.assertEqual(registry._loaders["moondream"].call_count, 1)
+
+    def test_default_models_are_registered(self):
+        for name in ["easyocr", "moondream", "clip"]:
+            self.assertIn(name, registry_module.model_registry._loaders)
@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from interpreter.core.utils.tracing import Tracer, format_turn
+
+
+class TestTracer(TestCase):
+    def test_turn_summary(self):
+        tracer = Tracer()
+        ended = []
+        tracer.on_span_end.append(ended.append)
+
+        tracer.start_turn()
+        with tracer.span("render"):
+            pass
+        with tracer.span("llm", model="gpt-4o") as span:
+            span["ttft"] = 0.5
+            span["completion_tokens"] = 10
+        tracer.next_step()
+        with tracer.span("execute", language="python"):
+            pass
+        summary = tracer.end_turn()
+
+        self.assertEqual([span["name"] for span in ended], ["render", "llm", "execute"])
+        self.assertEqual(ended[2]["step"], 1)
+        self.assertEqual(summary["steps"], 2)
+        self.assertEqual(set(summary["stages"]), {"render", "llm", "execute"})
+        self.assertEqual(summary["llm"][0]["ttft"], 0.5)
+        self.assertIs(tracer.events[-1], summary)
+        self.assertIn("TTFT 0.50s", format_turn(summary))
+
+    def test_trace_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tracer = Tracer()
+            tracer.trace_file = os.path.join(temp_dir, "trace.jsonl")
+
+            tracer.start_turn()
+            with tracer.span("trim"):
+                pass
+            tracer.end_turn()
+
+            with open(tracer.trace_file) as file:
+                events = [json.loads(line) for line in file]
+            self.assertEqual([event["type"] for event in events], ["span", "turn"])
+            self.assertEqual(events[0]["name"], "trim")
@@ -0,0 +1,62 @@
+import threading
+import time
+from unittest import TestCase
+
+from interpreter.core.utils.worker_pool import QueueFullError, WorkerPool
+
+
+class TestWorkerPool(TestCase):
+    def test_runs_at_most_max_workers_at_once(self):
+        pool = WorkerPool(max_workers=2)
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def work():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        jobs = [pool.submit(i, work) for i in range(6)]
+        for job in jobs:
+            job.join(2)
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(pool.stats()["completed"], 6)
+        self.assertFalse(any(job.is_alive() for job in jobs))
+
+    def test_sessions_take_turns(self):
+        pool = WorkerPool(max_workers=1)
+        release = threading.Event()
+        order = []
+
+        pool.submit("blocker", release.wait)
+        time.sleep(0.05)  # So the rest wait in the queue
+        jobs = [pool.submit("a", order.append, f"a{i}") for i in range(3)]
+        jobs.append(pool.submit("b", order.append, "b0"))
+        time.sleep(0.05)
+        release.set()
+        for job in jobs:
+            job.join(2)
+        self.assertEqual(order, ["a0", "b0", "a1", "a2"])
+        self.assertGreater(pool.stats()["max_wait_seconds"], 0.04)
+
+    def test_admission_and_cancel(self):
+        pool = WorkerPool(max_workers=1, max_queued=1)
+        release = threading.Event()
+        ran = []
+
+        pool.submit("a", release.wait)
+        time.sleep(0.05)
+        queued = pool.submit("b", ran.append, "b")
+        with self.assertRaises(QueueFullError):
+            pool.submit("c", ran.append, "c")
+
+        self.assertTrue(queued.cancel())
+        self.assertFalse(queued.is_alive())
+        release.set()
+        pool.submit("c", ran.append, "c").join(2)
+        self.assertEqual(ran, ["c"])
+        self.assertEqual(pool.stats()["rejected"], 1)